@@ -0,0 +1,87 @@
+"""
+Description: Benchmark the 14N/15N hit matching engine against the previous nested loop.
+"""
+
+# Import packages
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OtherScripts'))
+
+from FindN145Hits import find_hits  # noqa: E402
+
+HIT_COLUMNS = ['Sequence', 'Modifications', 'Start', 'End', 'Charge', '14N m/z', '15N m/z', '14N Mass (Exp)',
+               '15N Mass (Exp)']
+
+
+def create_peptide_list(size: int, seed: int) -> pd.DataFrame:
+    """
+    Create a synthetic peptide list in the layout returned by FindN145Hits.read_peptide_lists.
+    :param size: The number of peptides.
+    :param seed: The seed of the random number generator.
+    :return: The peptide list.
+    """
+    rng = np.random.default_rng(seed)
+    n_unique = max(size // 2, 1)
+    peptide_ids = rng.integers(0, n_unique, size=size)
+    starts = 18 + peptide_ids % 380
+    return pd.DataFrame({'Sequence': [f"PEPTIDE{idx}K" for idx in peptide_ids],
+                         'Charge': rng.integers(1, 4, size=size),
+                         'm/z': rng.uniform(300, 1500, size=size).round(4),
+                         'Mass (Exp)': rng.uniform(600, 4500, size=size).round(4),
+                         'Mass (Thr)': rng.uniform(600, 4500, size=size).round(4),
+                         'Start': starts,
+                         'End': starts + 8,
+                         'Modifications': np.where(peptide_ids % 5 == 0, [f"{s}@15.995" for s in starts], '-')})
+
+
+def find_hits_nested_loop(n14: pd.DataFrame, n15: pd.DataFrame) -> pd.DataFrame:
+    """
+    The previous implementation of find_hits, which compares every 14N row with every 15N row.
+    :param n14: The 14N peptide list
+    :param n15: The 15N peptide list
+    :return: The hit list as a pandas dataframe
+    """
+    hit_list: pd.DataFrame = pd.DataFrame(columns=HIT_COLUMNS)
+    for _, n14_row in n14.iterrows():
+        for _, n15_row in n15.iterrows():
+            if n14_row['Sequence'] == n15_row['Sequence'] and n14_row['Modifications'] == n15_row['Modifications'] and \
+                    n14_row['Charge'] == n15_row['Charge']:
+                hit_list = pd.concat([hit_list, pd.DataFrame([[n14_row['Sequence'], n14_row['Modifications'],
+                                                               n14_row['Start'], n14_row['End'], n14_row['Charge'],
+                                                               n14_row['m/z'], n15_row['m/z'], n14_row['Mass (Exp)'],
+                                                               n15_row['Mass (Exp)']]], columns=HIT_COLUMNS)],
+                                     ignore_index=True)
+    hit_list = hit_list.drop_duplicates(subset=['Sequence', 'Modifications'])
+    hit_list = hit_list.sort_values(by=['Start'])
+    hit_list = hit_list.reset_index(drop=True)
+    return hit_list
+
+
+if __name__ == '__main__':
+    output_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_hits')
+    loop_max_size = 400
+
+    for list_size in [100, 400, 5000, 50000]:
+        n14_list = create_peptide_list(list_size, seed=14)
+        n15_list = create_peptide_list(list_size, seed=15)
+
+        start_time = time.perf_counter()
+        hits = find_hits(n14_list, n15_list, output_filepath=output_file)
+        engine_time = time.perf_counter() - start_time
+        print(f"{list_size} rows: hash join {round(engine_time, 3)} s ({hits.shape[0]} hits)")
+
+        # The nested loop is only timed on the small lists as it is quadratic
+        if list_size <= loop_max_size:
+            start_time = time.perf_counter()
+            loop_hits = find_hits_nested_loop(n14_list, n15_list)
+            loop_time = time.perf_counter() - start_time
+            identical = loop_hits.astype(str).equals(hits.astype(str))
+            print(f"{list_size} rows: nested loop {round(loop_time, 3)} s ({loop_hits.shape[0]} hits, "
+                  f"identical: {identical})")
+
+    os.remove(output_file)
@@ -0,0 +1,79 @@
+"""
+Description: Benchmark the vectorized modification parser against the previous per-string parser.
+"""
+
+# Import packages
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'FinalScripts'))
+
+from cysteine_oxidations import MODIFICATIONS, POSITIONS  # noqa: E402
+from quantiative_plot_utilities import _parse_and_filter_modifications  # noqa: E402
+
+
+def create_modifications(size: int, seed: int) -> pd.Series:
+    """
+    Create a synthetic 'modifs' column with at most one modification per peptide, which the previous parser supports.
+    :param size: The number of peptides.
+    :param seed: The seed of the random number generator.
+    :return: The modifications.
+    """
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(POSITIONS + [19, 83], size=size)
+    masses = rng.choice(list(MODIFICATIONS), size=size)
+    modified = rng.random(size) < 0.6
+    return pd.Series(np.where(modified, [f"{pos}@{mass:.3f}" for pos, mass in zip(positions, masses)], '-'))
+
+
+def tally_per_string(modifications: pd.Series) -> dict:
+    """
+    The previous parsing and counting, which handles one modification string and one modification at a time.
+    :param modifications: The modifications.
+    :return: The number of each modification at each position.
+    """
+    mods_raw = [mod for mod in list(modifications) if mod != '-']
+    modifications_list = [str.split(mod, sep='@') for mod in mods_raw]
+    parsed = [(mod[0], MODIFICATIONS[float(mod[1])]) for mod in modifications_list if int(mod[0]) in POSITIONS]
+
+    modification_count: dict = {}
+    for pos in POSITIONS:
+        modification_count[str(pos)] = {}
+        for modification_type in MODIFICATIONS.values():
+            modification_count[str(pos)][modification_type] = 0
+    for pos, mod in parsed:
+        modification_count[pos][mod] += 1
+    return modification_count
+
+
+def tally_vectorized(modifications: pd.Series) -> dict:
+    """
+    The vectorized parsing and counting.
+    :param modifications: The modifications.
+    :return: The number of each modification at each position.
+    """
+    parsed = _parse_and_filter_modifications(modifications=modifications, positions=POSITIONS,
+                                             modification_dict=MODIFICATIONS)
+    count_df = pd.crosstab(parsed['Position'], parsed['Modification'])
+    count_df = count_df.reindex(index=POSITIONS, columns=list(MODIFICATIONS.values()), fill_value=0)
+    return {str(pos): {mod: int(count) for mod, count in row.items()} for pos, row in count_df.iterrows()}
+
+
+if __name__ == '__main__':
+    for n_peptides in [1000, 10000, 100000]:
+        modifs = create_modifications(n_peptides, seed=11)
+
+        start_time = time.perf_counter()
+        per_string_counts = tally_per_string(modifs)
+        per_string_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        vectorized_counts = tally_vectorized(modifs)
+        vectorized_time = time.perf_counter() - start_time
+
+        print(f"{n_peptides} rows: per string {round(per_string_time, 4)} s, vectorized {round(vectorized_time, 4)} s "
+              f"(identical: {per_string_counts == vectorized_counts})")
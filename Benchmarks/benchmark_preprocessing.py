@@ -0,0 +1,89 @@
+"""
+Description: Benchmark the peak lookups in raw and in centroided, noise filtered MS1 scans.
+
+Usage: python benchmark_preprocessing.py [mzXML ...]. Without mzXML files synthetic profile scans are used.
+"""
+
+# Import packages
+import os
+import sys
+import time
+from dataclasses import replace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OtherScripts'))
+
+from MS1Index import MS1Index, find_nearest  # noqa: E402
+from ScanPreprocessing import PreprocessingSettings, preprocess_scans, summarise_peak_counts  # noqa: E402
+
+N_TARGETS = 2000
+
+
+def create_profile_scans(n_scans: int, n_peaks: int, seed: int) -> list:
+    """
+    Create synthetic profile scans with Gaussian peaks sampled every 2 mDa on top of a noise baseline.
+    :param n_scans: The number of scans.
+    :param n_peaks: The number of peaks per scan.
+    :param seed: The seed of the random number generator.
+    :return: The scans as tuples containing the scan number, the retention time and the m/z and intensity arrays.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = np.arange(-7, 8) * 0.002
+    scans = []
+    for scan_idx in range(n_scans):
+        centres = rng.uniform(400, 1600, size=n_peaks)
+        heights = rng.lognormal(mean=11, sigma=1.5, size=n_peaks)
+        mz = (centres[:, None] + offsets[None, :]).ravel()
+        intensity = (heights[:, None] * np.exp(-0.5 * (offsets[None, :] / 0.004) ** 2)).ravel()
+        noise_mz = rng.uniform(400, 1600, size=10 * n_peaks)
+        mz = np.concatenate([mz, noise_mz])
+        intensity = np.concatenate([intensity, rng.exponential(2000, size=10 * n_peaks)])
+        order = np.argsort(mz, kind='mergesort')
+        scans.append((str(scan_idx + 1), scan_idx * 0.5, mz[order], intensity[order]))
+    return scans
+
+
+def lookup_throughput(ms1_index: MS1Index, targets: np.ndarray, tolerance: float) -> tuple:
+    """
+    Look up the targets in every scan of the index.
+    :param ms1_index: The scans.
+    :param targets: The target m/z values.
+    :param tolerance: The tolerance in Da.
+    :return: The tuple containing the lookups per second and the fraction of the lookups finding a peak.
+    """
+    found = 0
+    start_time = time.perf_counter()
+    for scan_idx in range(len(ms1_index)):
+        mz, _ = ms1_index.peaks(scan_idx)
+        found += int(np.count_nonzero(find_nearest(mz, targets, tolerance) != -1))
+    lookup_time = time.perf_counter() - start_time
+    n_lookups = len(ms1_index) * targets.size
+    return n_lookups / lookup_time, found / max(n_lookups, 1)
+
+
+if __name__ == '__main__':
+    settings = PreprocessingSettings()
+    if len(sys.argv) > 1:
+        from MzXMLReader import iter_ms1_scans
+        runs = {os.path.basename(path): list(iter_ms1_scans(path)) for path in sys.argv[1:]}
+    else:
+        runs = {'synthetic': create_profile_scans(n_scans=400, n_peaks=2000, seed=19)}
+
+    for name, raw_scans in runs.items():
+        raw_index = MS1Index.from_scans(raw_scans)
+        for workers in [1, None]:
+            peak_counts = []
+            start_time = time.perf_counter()
+            preprocessed_index = MS1Index.from_scans(preprocess_scans(raw_scans, replace(settings, workers=workers),
+                                                                      peak_counts=peak_counts))
+            print(f"{name}: preprocessing with {workers or os.cpu_count()} worker(s) took "
+                  f"{round(time.perf_counter() - start_time, 3)} s")
+        print(f"{name}: {summarise_peak_counts(peak_counts)}")
+
+        targets = np.random.default_rng(0).uniform(raw_index.mz.min(), raw_index.mz.max(), size=N_TARGETS) \
+            if raw_index.mz.size else np.empty(0)
+        for label, ms1_index in [('raw', raw_index), ('preprocessed', preprocessed_index)]:
+            throughput, found = lookup_throughput(ms1_index, targets, tolerance=0.01)
+            print(f"{name}: {label} scans, {round(throughput / 1e6, 2)} million lookups/s, "
+                  f"{round(100 * found, 1)} % of the lookups find a peak")
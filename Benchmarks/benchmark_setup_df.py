@@ -0,0 +1,102 @@
+"""
+Description: Benchmark the columnar peptide annotation of setup_df against the previous per-row apply/map.
+"""
+
+# Import packages
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OtherScripts'))
+
+from IsotopeMass import clear_cache  # noqa: E402
+from N145Calculator import annotate_peptides  # noqa: E402
+from N145CalculatorUtilities import calculate_mass  # noqa: E402
+
+AMINO_ACIDS = list('ACDEFGHIKLMNPQRSTVWY')
+
+
+def create_peptides(size: int, n_sequences: int, seed: int) -> pd.DataFrame:
+    """
+    Create synthetic peptides in the layout returned by read_tandem_result_file.
+    :param size: The number of peptides.
+    :param n_sequences: The number of unique modified sequences.
+    :param seed: The seed of the random number generator.
+    :return: The peptides.
+    """
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(6, 25, size=n_sequences)
+    sequences = np.array([''.join(rng.choice(AMINO_ACIDS, size=length)) + 'K' for length in lengths], dtype=object)
+    sequence_idx = rng.integers(0, n_sequences, size=size)
+    starts = rng.integers(1, 400, size=n_sequences)[sequence_idx]
+    return pd.DataFrame({'Sequence': sequences[sequence_idx], 'ModSequence': sequences[sequence_idx],
+                         'Charge': rng.integers(1, 5, size=size), 'Start': starts,
+                         'End': starts + lengths[sequence_idx], 'RT': rng.uniform(0, 3600, size=size),
+                         'Modifications': None})
+
+
+def annotate_per_row(df: pd.DataFrame, min_mz: float) -> pd.DataFrame:
+    """
+    The previous annotation, which builds tuple columns and maps the region and mass functions over the rows.
+    :param df: The peptides.
+    :param min_mz: The minimum m/z.
+    :return: The annotated peptides.
+    """
+    df = df.copy()
+    df['StartEnd'] = df.apply(lambda x: (x['Start'], x['End']), axis=1)
+    df['Region'] = df['StartEnd'].map(get_region_per_row)
+    df['SeqCharge'] = df.apply(lambda x: (x['ModSequence'], x['Charge'], min_mz), axis=1)
+    df['14N mass'], df['14N mz (Thr)'], df['15N mass'], df['15N mz (Thr)'] = \
+        zip(*df['SeqCharge'].map(calculate_mass))
+    df = df[df['15N mz (Thr)'] != 0]
+    del df['SeqCharge']
+    del df['ModSequence']
+    del df['StartEnd']
+    return df
+
+
+def get_region_per_row(start_end: tuple) -> str:
+    """
+    The previous region assignment of a single peptide.
+    :param start_end: The start and end position.
+    :return: The region.
+    """
+    regions = []
+    for pos in start_end:
+        if pos < 17:
+            regions.append("Signal")
+        elif pos < 204:
+            regions.append("Core")
+        elif pos < 305:
+            regions.append("P")
+        elif pos < 336:
+            regions.append("Core")
+        else:
+            regions.append("C")
+    return regions[0] if regions[0] == regions[1] else f"{regions[0]};{regions[1]}"
+
+
+if __name__ == '__main__':
+    for n_peptides in [1000, 10000, 100000]:
+        peptides = create_peptides(n_peptides, n_sequences=n_peptides // 4, seed=16)
+        # With a cold cache most of the time is spent on the compositions, which both versions calculate once per
+        # sequence. With a warm cache only the per-row work is left.
+        for cache in ['cold', 'warm']:
+            if cache == 'cold':
+                clear_cache()
+            start_time = time.perf_counter()
+            per_row = annotate_per_row(peptides, min_mz=500)
+            per_row_time = time.perf_counter() - start_time
+
+            if cache == 'cold':
+                clear_cache()
+            start_time = time.perf_counter()
+            columnar = annotate_peptides(peptides, min_mz=500)
+            columnar_time = time.perf_counter() - start_time
+
+            identical = per_row[columnar.columns].reset_index(drop=True).equals(columnar.reset_index(drop=True))
+            print(f"{n_peptides} rows, {cache} mass cache: per row {round(per_row_time, 3)} s, columnar "
+                  f"{round(columnar_time, 3)} s (identical: {identical})")
@@ -0,0 +1,318 @@
+"""
+Description: Time the hot paths of the 14N/15N workflow on deterministic synthetic inputs and write the timings to JSON.
+
+Usage: python benchmark_suite.py [--sizes 1000 10000] [--scans 300] [--repeats 3] [--output results.json]
+                                 [--compare previous.json]
+
+The inputs are generated from the seed, so the timings of two versions of the code can be compared by running the suite
+on both and diffing the JSON files, or by passing the results of the previous version with --compare.
+"""
+
+# Import packages
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'FinalScripts'))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'OtherScripts'))
+
+import CalculateN145HitIntensity  # noqa: E402
+import N145CalculatorUtilities  # noqa: E402
+from cysteine_oxidations import MODIFICATIONS, POSITIONS  # noqa: E402
+from FindMatchingPeptides import find_matching_hits  # noqa: E402
+from FindN145Hits import find_hits, read_peptide_lists  # noqa: E402
+from IsotopeMass import clear_cache  # noqa: E402
+from N145Calculator import setup_df  # noqa: E402
+from OutputWriter import DEFAULT_FORMAT, output_filepath  # noqa: E402
+from quantiative_plot_utilities import _count_peptides, _find_modifications  # noqa: E402
+
+AMINO_ACIDS = list('ACDEFGHIKLMNPQRSTVWY')
+PROTON_MASS = 1.00727646688
+# The retention time between two MS1 scans and the number of scans a peptide elutes over
+SCAN_INTERVAL = 0.5
+ELUTION_SCANS = 20
+
+
+def create_sequences(n_sequences: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Create tryptic-like peptide sequences and their start positions in calreticulin.
+    :param n_sequences: The number of sequences.
+    :param rng: The random number generator.
+    :return: The tuple containing the sequences and the start positions.
+    """
+    lengths = rng.integers(6, 25, size=n_sequences)
+    sequences = np.array([''.join(rng.choice(AMINO_ACIDS, size=length)) + 'K' for length in lengths], dtype=object)
+    starts = rng.integers(90, 170, size=n_sequences)
+    return sequences, starts
+
+
+def create_peptide_list_workbook(filepath: str, size: int, seed: int) -> str:
+    """
+    Create a peptide list workbook with a 14N and a 15N sheet in the layout of the exported peptide lists, i.e. with
+    the columns 'V', 'z', 'MH+ exp', 'MH+ theo', 'delta', 'from', 'to', 'seq', 'm/z' and 'modifs'. Half of the
+    peptides of a sheet are also in the other sheet.
+    :param filepath: The path to the workbook.
+    :param size: The number of peptides in each sheet.
+    :param seed: The seed of the random number generator.
+    :return: The path to the workbook.
+    """
+    rng = np.random.default_rng(seed)
+    sequences, starts = create_sequences(max(size // 2, 1), rng)
+    masses = np.array(list(MODIFICATIONS), dtype=np.float64)
+    with pd.ExcelWriter(filepath) as writer:
+        for sheet_name, mass_shift in [('S14', 0.0), ('S15', 12.0)]:
+            idx = rng.integers(0, sequences.size, size=size)
+            lengths = np.array([len(sequence) for sequence in sequences[idx]])
+            charges = rng.integers(1, 4, size=size)
+            mh = rng.uniform(600, 3500, size=size) + mass_shift
+            modified = rng.random(size) < 0.5
+            modification_positions = rng.choice(POSITIONS, size=size)
+            modification_masses = rng.choice(masses, size=size)
+            pd.DataFrame({
+                'V': np.where(rng.random(size) < 0.8, 'Y', 'N'),
+                'z': charges,
+                'MH+ exp': mh.round(4),
+                'MH+ theo': (mh + rng.normal(0, 0.002, size=size)).round(4),
+                'delta': rng.normal(0, 2, size=size).round(2),
+                'from': starts[idx],
+                'to': starts[idx] + lengths - 1,
+                'seq': sequences[idx],
+                'm/z': ((mh - PROTON_MASS) / charges + PROTON_MASS).round(4),
+                'modifs': np.where(modified, [f"{pos}@{mass:.3f}" for pos, mass
+                                              in zip(modification_positions, modification_masses)], '-')
+            }).to_excel(writer, sheet_name=sheet_name, index=False)
+    return filepath
+
+
+def create_psm_table(size: int, seed: int) -> pd.DataFrame:
+    """
+    Create X!Tandem-like PSMs in the layout returned by N145Calculator.read_tandem_result_file.
+    :param size: The number of PSMs.
+    :param seed: The seed of the random number generator.
+    :return: The PSMs.
+    """
+    rng = np.random.default_rng(seed)
+    sequences, starts = create_sequences(max(size // 4, 1), rng)
+    idx = rng.integers(0, sequences.size, size=size)
+    oxidised = np.array(['M' in sequence for sequence in sequences[idx]]) & (rng.random(size) < 0.3)
+    return pd.DataFrame({
+        'Sequence': sequences[idx],
+        'ModSequence': sequences[idx],
+        'Charge': rng.integers(1, 5, size=size),
+        'Start': starts[idx],
+        'End': starts[idx] + np.array([len(sequence) for sequence in sequences[idx]]) - 1,
+        'RT': rng.uniform(0, 1, size=size),
+        'Modifications': np.where(oxidised, 'M@15.995', None)
+    })
+
+
+def create_scans(n_scans: int, n_noise_peaks: int, targets: np.ndarray, target_rts: np.ndarray,
+                 seed: int) -> List[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Create MS1 scans with noise peaks and a Gaussian elution profile of every target around its retention time.
+    :param n_scans: The number of scans.
+    :param n_noise_peaks: The number of noise peaks in each scan.
+    :param targets: The m/z of the targets.
+    :param target_rts: The retention time of the apex of every target.
+    :param seed: The seed of the random number generator.
+    :return: The scans as tuples containing the scan number, the retention time and the m/z and intensity arrays.
+    """
+    rng = np.random.default_rng(seed)
+    rt_order = np.argsort(target_rts, kind='mergesort')
+    sorted_rts = target_rts[rt_order]
+    half_width = ELUTION_SCANS / 2 * SCAN_INTERVAL
+    scans = []
+    for scan_idx in range(n_scans):
+        rt = scan_idx * SCAN_INTERVAL
+        eluting = rt_order[np.searchsorted(sorted_rts, rt - half_width):np.searchsorted(sorted_rts, rt + half_width)]
+        profile = np.exp(-0.5 * ((rt - target_rts[eluting]) / (half_width / 3)) ** 2)
+        mz = np.concatenate([rng.uniform(300, 2000, size=n_noise_peaks),
+                             targets[eluting] + rng.normal(0, 0.001, size=eluting.size)])
+        intensity = np.concatenate([rng.exponential(1e3, size=n_noise_peaks),
+                                    1e5 * profile * rng.uniform(0.8, 1.2, size=eluting.size)])
+        order = np.argsort(mz, kind='mergesort')
+        scans.append((str(scan_idx + 1), rt, mz[order], intensity[order]))
+    return scans
+
+
+def write_mzxml(filepath: str, scans: List[Tuple[str, float, np.ndarray, np.ndarray]]) -> str:
+    """
+    Write MS1 scans to a minimal mzXML file with zlib compressed 64-bit peaks.
+    :param filepath: The path to the mzXML.
+    :param scans: The scans.
+    :return: The path to the mzXML.
+    """
+    with open(filepath, 'w') as mzxml_file:
+        mzxml_file.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<mzXML '
+                         'xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_3.2">\n<msRun>\n')
+        for scan_id, rt, mz, intensity in scans:
+            peaks = np.column_stack([mz, intensity]).astype('>f8').tobytes()
+            mzxml_file.write(f'<scan num="{scan_id}" msLevel="1" peaksCount="{mz.size}" retentionTime="PT{rt:.4f}S">'
+                             f'<peaks precision="64" byteOrder="network" contentType="m/z-int" '
+                             f'compressionType="zlib">{base64.b64encode(zlib.compress(peaks)).decode()}</peaks>'
+                             f'</scan>\n')
+        mzxml_file.write('</msRun>\n</mzXML>\n')
+    return filepath
+
+
+def time_function(function: Callable, repeats: int) -> Tuple[float, object]:
+    """
+    Time a function.
+    :param function: The function without arguments.
+    :param repeats: The number of runs.
+    :return: The tuple containing the fastest time in seconds and the result of the last run.
+    """
+    times: List[float] = []
+    result = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+
+def run_suite(sizes: List[int], n_scans: int, repeats: int, seed: int, work_dir: str) -> List[dict]:
+    """
+    Run all the benchmarks at every size.
+    :param sizes: The number of rows of the peptide lists and PSM tables.
+    :param n_scans: The number of MS1 scans.
+    :param repeats: The number of runs of each benchmark, of which the fastest is reported.
+    :param seed: The seed of the synthetic inputs.
+    :param work_dir: The directory of the synthetic files and the outputs.
+    :return: The results with the benchmark name, size, time in seconds and number of output rows.
+    """
+    results: List[dict] = []
+
+    def record(name: str, size: int, function: Callable):
+        seconds, result = time_function(function, repeats)
+        rows = len(result[0]) if isinstance(result, tuple) else len(result)
+        results.append({'benchmark': name, 'size': size, 'seconds': round(seconds, 6), 'rows': rows})
+        print(f"{name:<35} {size:>8} rows {seconds:>10.4f} s {rows:>8} output rows")
+
+    for size in sizes:
+        # Peptide lists and hits
+        workbook = create_peptide_list_workbook(os.path.join(work_dir, f"peptides_{size}.xlsx"), size, seed)
+        n14_list, n15_list = read_peptide_lists(workbook, n14_tab_name='S14', n15_tab_name='S15')
+        hits_filepath = output_filepath(os.path.join(work_dir, f"hits_{size}"), DEFAULT_FORMAT)
+        record('find_hits', size, lambda: find_hits(n14_list, n15_list, output_filepath=hits_filepath))
+        hit_list = find_hits(n14_list, n15_list, output_filepath=hits_filepath)
+        conditions = {name: hit_list.sample(frac=0.8, random_state=seed + offset)
+                      for offset, name in enumerate(['A', 'B', 'C'])}
+        record('find_matching_hits', size,
+               lambda: find_matching_hits(conditions, output=os.path.join(work_dir, f"matching_{size}")))
+
+        # Modification analysis of the final scripts
+        sheet = pd.read_excel(workbook, sheet_name='S14', usecols=['V', 'modifs', 'from', 'to', 'seq'])
+        sheet = sheet[sheet['V'] == 'Y']
+        record('_find_modifications', size, lambda: _find_modifications(sheet, POSITIONS, MODIFICATIONS))
+        record('_count_peptides', size, lambda: _count_peptides(sheet, POSITIONS))
+
+        # Masses of the identified peptides with a cold mass cache
+        psms = create_psm_table(size, seed)
+        psms['RT'] = psms['RT'] * (n_scans - ELUTION_SCANS) * SCAN_INTERVAL + ELUTION_SCANS / 2 * SCAN_INTERVAL
+
+        def calculate_mass_per_row() -> list:
+            clear_cache()
+            return [N145CalculatorUtilities.calculate_mass((sequence, charge, 500))
+                    for sequence, charge in zip(psms['ModSequence'], psms['Charge'])]
+
+        def setup_cold() -> pd.DataFrame:
+            clear_cache()
+            return setup_df(psms, 500)
+
+        record('calculate_mass', size, calculate_mass_per_row)
+        record('setup_df', size, setup_cold)
+        peptides = setup_df(psms, 500)
+
+        # Intensities from synthetic scans containing the peptides and the hits
+        hit_rts = np.random.default_rng(seed).uniform(ELUTION_SCANS / 2 * SCAN_INTERVAL,
+                                                      (n_scans - ELUTION_SCANS / 2) * SCAN_INTERVAL, len(hit_list))
+        targets = np.concatenate([peptides['14N mz (Thr)'], peptides['15N mz (Thr)'], hit_list['14N m/z'],
+                                  hit_list['15N m/z']]).astype(np.float64)
+        target_rts = np.concatenate([peptides['RT'], peptides['RT'], hit_rts, hit_rts]).astype(np.float64)
+        mzxml = write_mzxml(os.path.join(work_dir, f"scans_{size}.mzXML"),
+                            create_scans(n_scans, n_noise_peaks=2000, targets=targets, target_rts=target_rts,
+                                         seed=seed))
+        record('calculate_intensities (peptides)', size,
+               lambda: N145CalculatorUtilities.calculate_intensities(peptides.copy(), mzxml))
+        record('calculate_intensities (hits)', size,
+               lambda: CalculateN145HitIntensity.calculate_intensities(
+                   hit_list_filepath=hits_filepath, mzxml_filepath=mzxml,
+                   intensity_hit_list_filepath=os.path.join(work_dir, f"hit_intensity_{size}")))
+    return results
+
+
+def environment() -> dict:
+    """
+    Describe the code version and the environment of the run.
+    :return: The description.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(results: List[dict], settings: dict, previous_filepath: str):
+    """
+    Print the speed-up of every benchmark compared to previous results.
+    :param results: The results of this run.
+    :param settings: The settings of this run.
+    :param previous_filepath: The JSON file of the previous run.
+    """
+    with open(previous_filepath, 'r') as previous_file:
+        previous_run: dict = json.load(previous_file)
+    if any(previous_run['settings'].get(key) != settings[key] for key in ['scans', 'seed']):
+        print(f"WARN: The inputs of {previous_filepath} were created with other settings.")
+    previous: Dict[Tuple[str, int], float] = {(result['benchmark'], result['size']): result['seconds']
+                                              for result in previous_run['results']}
+    for result in results:
+        before = previous.get((result['benchmark'], result['size']))
+        if before is not None and result['seconds'] > 0:
+            print(f"{result['benchmark']:<35} {result['size']:>8} rows {before:>10.4f} s -> "
+                  f"{result['seconds']:>10.4f} s ({before / result['seconds']:.2f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the hot paths on synthetic inputs.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help="The number of rows of the peptide lists and PSM tables. Default 1000 and 10000.")
+    parser.add_argument('--scans', type=int, default=300, help="The number of MS1 scans. Default 300.")
+    parser.add_argument('--repeats', type=int, default=3, help="The number of runs of each benchmark. Default 3.")
+    parser.add_argument('--seed', type=int, default=22, help="The seed of the synthetic inputs. Default 22.")
+    parser.add_argument('--output', default=os.path.join(BENCHMARK_DIR, 'benchmark_results.json'),
+                        help="The JSON file of the results.")
+    parser.add_argument('--compare', default=None, help="The JSON file of previous results to compare with.")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        # Some of the functions write debug files to the working directory
+        working_dir = os.getcwd()
+        os.chdir(temporary_dir)
+        try:
+            suite_results = run_suite(arguments.sizes, n_scans=arguments.scans, repeats=arguments.repeats,
+                                      seed=arguments.seed, work_dir=temporary_dir)
+        finally:
+            os.chdir(working_dir)
+
+    with open(arguments.output, 'w') as output_file:
+        json.dump({'environment': environment(), 'settings': vars(arguments), 'results': suite_results}, output_file,
+                  indent=1)
+    print(f"Results written to {arguments.output}")
+    if arguments.compare is not None:
+        compare(suite_results, vars(arguments), arguments.compare)
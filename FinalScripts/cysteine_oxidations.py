@@ -7,7 +7,7 @@ import os.path
 
 import pandas as pd
 
-from quantiative_plot_utilities import create_plots_from_peptide_lists
+from quantiative_plot_utilities import create_plots_from_peptide_lists, read_annotation_track, PlotRenderer
 
 """
 The modification dictionary and the cysteine positions, which are specific for CRT.
@@ -41,6 +41,17 @@ def _combine_and_clean_modifications(raw_df: pd.DataFrame) -> pd.DataFrame:
 
 if __name__ == '__main__':
     BASE_FILE_PATH = r""
+    # The number of worker processes used for reading the peptide lists. None uses one worker per CPU.
+    WORKERS = None
+    # The directory the figures are written to without a display. None shows the figures instead.
+    OUTPUT_DIR = None
+    # The directory of the result cache, so only new or changed peptide lists are analysed. None disables the cache.
+    RESULT_CACHE_DIR = os.path.join(BASE_FILE_PATH, '.result_cache')
+    # The domain file, e.g. OtherScripts/Domains.csv, whose regions of calreticulin are shown below the positions. None
+    # shows only the positions.
+    DOMAINS_FILE = None
+    annotation_track = read_annotation_track(DOMAINS_FILE, protein='CRT') if DOMAINS_FILE is not None else None
+    renderer = PlotRenderer(OUTPUT_DIR, formats=('png', 'pdf')) if OUTPUT_DIR is not None else None
     conditions_n14 = [['Tryp_rCrt14_Cys', 'A) Trypsin rCrt14 (rCRT)'], ['Tryp_pCrt14_Cys', 'B) Trypsin pCrt14 (pCRT)'],
                       ['Mix_37', 'C) 37 °C (pCRT)'], ['Mix_42', 'D) 42 °C (pCRT)'],
                       ['Mix_42_Zn', 'E) 42 °C + Zn (pCRT)']]
@@ -58,7 +69,9 @@ if __name__ == '__main__':
         file_data_n14.append((os.path.join(BASE_FILE_PATH, condition[0]), condition[1], None))
     create_plots_from_peptide_lists(peptide_lists=file_data_n14, modifications=MODIFICATIONS,
                                     modification_position=POSITIONS,
-                                    combine_function=_combine_and_clean_modifications, labels=None)
+                                    combine_function=_combine_and_clean_modifications, labels=None, workers=WORKERS,
+                                    renderer=renderer, name='cysteine_14N',
+                                    cache_dir=RESULT_CACHE_DIR, annotation_track=annotation_track)
     
     # Create the plot for 15N data
     file_data_n15: list = []
@@ -66,4 +79,6 @@ if __name__ == '__main__':
         file_data_n15.append((os.path.join(BASE_FILE_PATH, condition[0]), condition[1], None))
     create_plots_from_peptide_lists(peptide_lists=file_data_n15, modifications=MODIFICATIONS,
                                     modification_position=POSITIONS,
-                                    combine_function=_combine_and_clean_modifications, labels=None)
+                                    combine_function=_combine_and_clean_modifications, labels=None, workers=WORKERS,
+                                    renderer=renderer, name='cysteine_15N',
+                                    cache_dir=RESULT_CACHE_DIR, annotation_track=annotation_track)
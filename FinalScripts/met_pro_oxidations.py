@@ -5,7 +5,7 @@ Description: Find the methionine and proline and plot them in a bar chart.
 # Import packages
 import os.path
 
-from quantiative_plot_utilities import create_plots_from_peptide_lists
+from quantiative_plot_utilities import create_plots_from_peptide_lists, read_annotation_track, PlotRenderer
 
 """
 The modification dictionary and the cysteine positions, which are specific for CRT.
@@ -19,6 +19,17 @@ POSITIONS = [19, 83, 114, 122, 131, 134, 139, 178, 204, 205, 211, 216, 228, 233,
 if __name__ == '__main__':
     
     BASE_FILE_PATH = r""
+    # The number of worker processes used for reading the peptide lists. None uses one worker per CPU.
+    WORKERS = None
+    # The directory the figures are written to without a display. None shows the figures instead.
+    OUTPUT_DIR = None
+    # The directory of the result cache, so only new or changed peptide lists are analysed. None disables the cache.
+    RESULT_CACHE_DIR = os.path.join(BASE_FILE_PATH, '.result_cache')
+    # The domain file, e.g. OtherScripts/Domains.csv, whose regions of calreticulin are shown below the positions. None
+    # shows only the positions.
+    DOMAINS_FILE = None
+    annotation_track = read_annotation_track(DOMAINS_FILE, protein='CRT') if DOMAINS_FILE is not None else None
+    renderer = PlotRenderer(OUTPUT_DIR, formats=('png', 'pdf')) if OUTPUT_DIR is not None else None
     conditions_n14 = [['Tryp_rCrt14_Cys', 'A) Trypsin rCrt14 (rCRT)'], ['Tryp_pCrt14_Cys', 'B) Trypsin pCrt14 (pCRT)'],
                       ['Mix_37', 'C) 37 °C (pCRT)'], ['Mix_42', 'D) 42 °C (pCRT)'],
                       ['Mix_42_Zn', 'E) 42 °C + Zn (pCRT)']]
@@ -36,7 +47,9 @@ if __name__ == '__main__':
         file_data_n14.append((os.path.join(BASE_FILE_PATH, condition[0]), condition[1], None))
     create_plots_from_peptide_lists(peptide_lists=file_data_n14, modifications=MODIFICATIONS,
                                     modification_position=POSITIONS,
-                                    combine_function=None, labels=None)
+                                    combine_function=None, labels=None, workers=WORKERS,
+                                    renderer=renderer, name='met_pro_14N',
+                                    cache_dir=RESULT_CACHE_DIR, annotation_track=annotation_track)
     
     # Create the plot for 15N data
     file_data_n15: list = []
@@ -45,4 +58,6 @@ if __name__ == '__main__':
 
     create_plots_from_peptide_lists(peptide_lists=file_data_n15, modifications=MODIFICATIONS,
                                     modification_position=POSITIONS,
-                                    combine_function=None, labels=None)
+                                    combine_function=None, labels=None, workers=WORKERS,
+                                    renderer=renderer, name='met_pro_15N',
+                                    cache_dir=RESULT_CACHE_DIR, annotation_track=annotation_track)
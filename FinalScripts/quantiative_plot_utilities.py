@@ -2,14 +2,34 @@
 Description: Utility functions for creating the quantitative plots.
 """
 
-import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import List, Tuple, Dict, Callable, Union
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
+# The workbook cache and the domains are shared with the scripts in OtherScripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OtherScripts'))
 
-def _find_modifications(hits_df: pd.DataFrame, positions: List[int], modification_dict: Dict[float, str]) \
+from result_cache import analysis_fingerprint, load_result, store_result  # noqa: E402
+from DomainMap import load_domain_map  # noqa: E402
+from WorkbookCache import read_workbook_sheet  # noqa: E402
+
+# The default tolerance in Da for matching modification masses
+MASS_TOLERANCE: float = 0.001
+# The size of the figures in inches
+FIGURE_SIZE: Tuple[float, float] = (20 / 2.54, 20 / 2.54)
+
+
+def _find_modifications(hits_df: pd.DataFrame, positions: List[int], modification_dict: Dict[float, str],
+                        mass_tolerance: float = MASS_TOLERANCE, tolerance_unit: str = 'Da') \
         -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Find the modifications in the given peptide DataFrame.
@@ -17,138 +37,440 @@ def _find_modifications(hits_df: pd.DataFrame, positions: List[int], modificatio
     :param hits_df: The hits found hits.
     :param positions: The list of positions available for modification.
     :param modification_dict: The dictionary with the modification mass and the name.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
     :return: The tuple containing DataFrames with position, modifications for the absolute and percentage values,
         and the total peptide count, respectively.
     """
-    # Get the modifications  and filter them
-    modifications: list = _parse_and_filter_modifications(modifications=hits_df['modifs'], positions=positions,
-                                                          modification_dict=modification_dict)
+    # Get the modifications and filter them
+    modifications: pd.DataFrame = _parse_and_filter_modifications(modifications=hits_df['modifs'], positions=positions,
+                                                                  modification_dict=modification_dict,
+                                                                  mass_tolerance=mass_tolerance,
+                                                                  tolerance_unit=tolerance_unit)
     # Count the number of modifications at each position.
-    modification_count: dict = {}
-    for pos in positions:
-        modification_count[str(pos)]: dict = {}
-        for modification_type in modification_dict.values():
-            modification_count[str(pos)][modification_type]: int = 0
-
-    for pos, mod in modifications:
-        modification_count[pos][mod] += 1
+    modification_types: list = list(dict.fromkeys(modification_dict.values()))
+    count_df: pd.DataFrame = pd.crosstab(modifications['Position'], modifications['Modification'])
+    count_df = count_df.reindex(index=positions, columns=modification_types, fill_value=0)
 
     # Calculate the modification percentage
-    modification_percentage: dict = {}
-
     peptide_count: dict = _count_peptides(hits_df=hits_df, positions=positions)
-
-    for pos in modification_count:
-        modification_percentage[pos]: dict = {}
-        for mod in modification_count[pos]:
-            if peptide_count[int(pos)] != 0:
-                modification_percentage[pos][mod] = (modification_count[pos][mod] / peptide_count[int(pos)]) * 100
-            else:
-                modification_percentage[pos][mod] = 0
-
-    # Convert the dictionaries to data frames
-    percentage_df: pd.DataFrame = pd.DataFrame.from_dict(modification_percentage, orient='index')
-    count_df: pd.DataFrame = pd.DataFrame.from_dict(modification_count, orient='index')
+    peptide_counts: np.ndarray = np.array([peptide_count[pos] for pos in positions], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages: np.ndarray = count_df.to_numpy() / peptide_counts[:, np.newaxis] * 100
+    percentage_df: pd.DataFrame = pd.DataFrame(np.where(peptide_counts[:, np.newaxis] != 0, percentages, 0),
+                                               index=count_df.index, columns=count_df.columns)
+
+    # Use the position as string index, as before
+    count_df.index = [str(pos) for pos in positions]
+    count_df.columns.name = None
+    percentage_df.index = count_df.index
+    percentage_df.columns.name = None
     peptide_count_df: pd.DataFrame = pd.DataFrame.from_dict(data=peptide_count, orient='index')
     return count_df, percentage_df, peptide_count_df
 
 
 def _parse_and_filter_modifications(modifications: pd.Series, positions: List[int],
-                                    modification_dict: Dict[float, str]) -> List[tuple]:
+                                    modification_dict: Dict[float, str], mass_tolerance: float = MASS_TOLERANCE,
+                                    tolerance_unit: str = 'Da') -> pd.DataFrame:
     """
     Parse and filter the modifications.
 
     :param modifications: The Series containing the modifications found in the hits.
     :param positions: The list of positions.
-    :return: The list containing tuples with the modification position and the modification type.
+    :param modification_dict: The dictionary with the modification mass and the name.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
+    :return: The DataFrame with the row, position, mass and modification type of each modification at the positions.
+    """
+    modification_table: pd.DataFrame = _parse_modifications(modifications=modifications)
+    modification_table['Modification'] = _match_modification_masses(masses=modification_table['Mass'].to_numpy(),
+                                                                     modification_dict=modification_dict,
+                                                                     mass_tolerance=mass_tolerance,
+                                                                     tolerance_unit=tolerance_unit)
+    # Get the modifications at the positions
+    modification_table = modification_table[modification_table['Position'].isin(positions)]
+    unknown: pd.DataFrame = modification_table[modification_table['Modification'].isna()]
+    if not unknown.empty:
+        print(f"\tWARN: Unknown modification masses {sorted(unknown['Mass'].unique())} are ignored.")
+    return modification_table[modification_table['Modification'].notna()]
+
+
+def _parse_modifications(modifications: pd.Series) -> pd.DataFrame:
     """
-    mods_raw = [mod for mod in list(modifications) if mod != '-']
-    mod_temp: list = []
-    # Get all the modifications even if the multiple exist for one peptide
-    for mod_raw in mods_raw:
-        if ' ' in mod_raw:
-            mods = str.split(' ')
-            for mod in mods:
-                mod_temp.append(mod)
-        else:
-            mod_temp.append(mod_raw)
+    Parse the modification strings, e.g. '105@15.995 163@31.990', into one row per modification.
 
-    # Split the modifications into residue nad mass
-    modifications_list = [str.split(mod, sep='@') for mod in mod_temp]
-    # Get the modification position and type
-    return [(mod[0], modification_dict[float(mod[1])]) for mod in modifications_list if int(mod[0]) in positions]
+    :param modifications: The Series containing the modifications found in the hits.
+    :return: The DataFrame with the row of the hit, the position and the mass of each modification.
+    """
+    modifications = modifications.dropna().astype(str)
+    modifications = modifications[modifications != '-']
+    # Get all the modifications even if the multiple exist for one peptide. The strings are joined and split once, which
+    # gives alternating positions and masses.
+    modification_counts: np.ndarray = modifications.str.count('@').to_numpy(dtype=np.int64)
+    values: list = ' '.join(modifications.to_numpy()).replace('@', ' ').split()
+    if len(values) != 2 * modification_counts.sum():
+        raise ValueError("The modifications must be written as position@mass separated by spaces.")
+    numbers: np.ndarray = np.array(values, dtype=np.float64).reshape(-1, 2)
+    return pd.DataFrame({'Row': np.repeat(modifications.index.to_numpy(), modification_counts),
+                         'Position': numbers[:, 0].astype(np.int64),
+                         'Mass': numbers[:, 1]})
+
+
+def _match_modification_masses(masses: np.ndarray, modification_dict: Dict[float, str],
+                               mass_tolerance: float = MASS_TOLERANCE, tolerance_unit: str = 'Da') -> np.ndarray:
+    """
+    Match the masses to the closest modification mass within the tolerance.
 
+    :param masses: The modification masses.
+    :param modification_dict: The dictionary with the modification mass and the name.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
+    :return: The modification type of each mass. None if no modification is within the tolerance.
+    """
+    if tolerance_unit not in ('Da', 'ppm'):
+        raise ValueError(f"The tolerance unit must be 'Da' or 'ppm', not '{tolerance_unit}'.")
+    known_masses: np.ndarray = np.array(sorted(modification_dict), dtype=np.float64)
+    known_names: np.ndarray = np.array([modification_dict[known_mass] for known_mass in sorted(modification_dict)] +
+                                       [None], dtype=object)
+    if known_masses.size == 0 or masses.size == 0:
+        return np.full(masses.shape, None, dtype=object)
+
+    # Compare the masses to the known masses to the left and right of the insertion point
+    right: np.ndarray = np.clip(np.searchsorted(known_masses, masses), 0, known_masses.size - 1)
+    left: np.ndarray = np.clip(right - 1, 0, known_masses.size - 1)
+    closest: np.ndarray = np.where(np.abs(masses - known_masses[left]) <= np.abs(known_masses[right] - masses),
+                                   left, right)
+    tolerances = mass_tolerance if tolerance_unit == 'Da' else np.abs(known_masses[closest]) * mass_tolerance * 1e-6
+    matched: np.ndarray = np.abs(masses - known_masses[closest]) <= tolerances
+    return known_names[np.where(matched, closest, known_masses.size)]
+
+
+def calculate_coverage(hits_df: pd.DataFrame, protein_length: Union[int, None] = None) -> pd.Series:
+    """
+    Calculate the number of peptides covering each residue of the protein. Every peptide adds one at its first
+    position and subtracts one after its last position, and the cumulative sum gives the coverage.
 
-def _count_peptides(hits_df: pd.DataFrame, positions: List[int]) -> dict:
+    :param hits_df: The data frame containing the hits.
+    :param protein_length: The length of the protein. If None, the last position covered by a peptide is used.
+    :return: The number of peptides for each position, indexed by position starting at 1.
+    """
+    starts: np.ndarray = hits_df['from'].to_numpy(dtype=np.int64)
+    ends: np.ndarray = hits_df['to'].to_numpy(dtype=np.int64)
+    if protein_length is None:
+        protein_length = int(ends.max()) if ends.size else 0
+    # Peptides outside the protein are clipped to the protein
+    starts = np.clip(starts, 1, protein_length + 1)
+    ends = np.clip(ends, 0, protein_length)
+    valid: np.ndarray = starts <= ends
+
+    changes: np.ndarray = np.bincount(starts[valid], minlength=protein_length + 2) - \
+        np.bincount(ends[valid] + 1, minlength=protein_length + 2)
+    coverage: np.ndarray = np.cumsum(changes)[1:protein_length + 1]
+    return pd.Series(coverage, index=pd.RangeIndex(1, protein_length + 1, name='Position'))
+
+
+def _count_peptides(hits_df: pd.DataFrame, positions: List[int], coverage: Union[pd.Series, None] = None) -> dict:
     """
     Count the the number of peptide that contains each of the specified cysteines.
 
     :param hits_df: The data frame containing the hits.
     :param positions: The list of positions available for modification.
+    :param coverage: The coverage from calculate_coverage. If None, it is calculated from the hits.
     :return: The number of peptide for each position.
     """
-    counts: dict = {}
+    if coverage is None:
+        coverage = calculate_coverage(hits_df=hits_df)
+    counts: np.ndarray = coverage.reindex([int(pos) for pos in positions], fill_value=0).to_numpy()
+    return {pos: int(count) for pos, count in zip(positions, counts)}
 
-    for pos in positions:
-        counts[pos] = 0
 
-    for start_pos, end_pos in zip(hits_df['from'], hits_df['to']):
-        for pos in positions:
-            if start_pos <= int(pos) <= end_pos:
-                counts[pos] += 1
+def _bar_labels(count_df: pd.DataFrame, percentage_df: pd.DataFrame, peptide_count_df: pd.DataFrame) -> List[str]:
+    """
+    Create the labels of all the bars of a condition in the order of the bar patches, i.e. column by column.
 
-    return counts
+    :param count_df: The count DataFrame.
+    :param percentage_df: The percentage DataFrame.
+    :param peptide_count_df: The peptide count DataFrame.
+    :return: The labels. Bars with a percentage of zero get an empty label.
+    """
+    percentages: np.ndarray = percentage_df.to_numpy().ravel(order='F')
+    counts: np.ndarray = count_df.to_numpy().ravel(order='F')
+    total_counts: np.ndarray = np.tile(peptide_count_df.iloc[:, 0].to_numpy(), count_df.shape[1])
+    return [f"{format(percentage, '.1f').rstrip('0').rstrip('.')}%\n({count}/{total_count})" if percentage != 0 else ''
+            for percentage, count, total_count in zip(percentages, counts, total_counts)]
 
 
-def _create_plot(mod_dict: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]], labels: Union[List[str], None],
-                 max_y: int):
+def read_annotation_track(domains_filepath: str, protein: str) -> pd.Series:
+    """
+    Read the region of every residue of a protein from a domain file. The domains are loaded as a DomainMap, so they are
+    validated and expanded in the same way as the regions of the peptides.
+
+    :param domains_filepath: The CSV file with the columns 'Protein', 'Region', 'Start' and 'End'.
+    :param protein: The name of the protein.
+    :return: The region names indexed by position.
+    """
+    return load_domain_map(protein, domains_filepath).annotation_track()
+
+
+def _draw_conditions(fig, axes: List, mod_dict: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                     labels: Union[List[str], None], max_y: int, rasterize_bars: bool = False,
+                     annotation_track: Union[pd.Series, None] = None):
     """
-    Create plot.
+    Draw the bar plot of each condition on its axes.
 
+    :param fig: The figure.
+    :param axes: The axes, one for each condition.
     :param mod_dict: The dictionary with the condition name and the count and percentage, and total count DataFrames.
     :param labels: The list of labels. If None, no legend will be shown.
     :param max_y: The maximum y-value.
+    :param rasterize_bars: Whether the bars are rasterized in vector formats. The labels are kept as text.
+    :param annotation_track: The region of each position, which is shown below the position. If None, only the
+        positions are shown.
+    :return: The legend. None if no labels are given.
     """
-    # Create the subplots
-    fig, ax = plt.subplots(nrows=len(mod_dict), sharex='all', figsize=(20 * 1 / 2.54, 20 * 1 / 2.54))
-    fig.text(0.03, 0.025, 'Position', ha='center', va='center')  # X-label
-    fig.text(0.02, 0.5, 'Percentage (Count)', ha='center', va='center', rotation='vertical')  # Y-label
-    # Loop over the conditions and create a plot for each condition
-    for condition_index, condition in enumerate(mod_dict):
+    for ax, condition in zip(axes, mod_dict):
         # Get the DataFrames
-        count_df: pd.DataFrame = mod_dict[condition][0]
-        percentage_df: pd.DataFrame = mod_dict[condition][1]
-        peptide_count_df: pd.DataFrame = mod_dict[condition][2]
+        count_df, percentage_df, peptide_count_df = mod_dict[condition]
 
         # Create the bar plot
-        percentage_df.plot.bar(ax=ax[condition_index], legend=False)
-        ax[condition_index].set_title(condition)
-        ax[condition_index].set_ylim([0, max_y])
-        # Add annotations for each patch
-        for patch_idx, p in enumerate(ax[condition_index].patches):
-            # Get dataframe index
-            row_idx = patch_idx % len(count_df.index)
-            column_idx = math.floor(patch_idx / len(count_df.index))
-            # Get the values
-            percentage = percentage_df.iloc[row_idx, column_idx]
-            count = count_df.iloc[row_idx, column_idx]
-            total_count = peptide_count_df.iloc[row_idx, 0]
-            label_y_offset: int = 20 if patch_idx % 2 == 0 else 0
-            label: str = f"{format(percentage, '.1f').rstrip('0').rstrip('.')}%\n({count}/{total_count})" \
-                if percentage != 0 else ''
-            ax[condition_index].annotate(label, (p.get_x(), p.get_y()), xytext=(0, 10 + label_y_offset),
-                                         textcoords='offset points')
+        percentage_df.plot.bar(ax=ax, legend=False)
+        ax.set_title(condition)
+        ax.set_ylim([0, max_y])
+        if annotation_track is not None:
+            regions: pd.Series = annotation_track.reindex(percentage_df.index)
+            ax.set_xticklabels([f"{pos}\n{region}" if isinstance(region, str) else str(pos)
+                                for pos, region in regions.items()], rotation=0)
+
+        # Add the labels with alternating heights. Only the non-empty labels are drawn.
+        bar_labels: List[str] = _bar_labels(count_df, percentage_df, peptide_count_df)
+        for patch_idx, (p, label) in enumerate(zip(ax.patches, bar_labels)):
+            if rasterize_bars:
+                p.set_rasterized(True)
+            if label:
+                label_y_offset: int = 20 if patch_idx % 2 == 0 else 0
+                ax.annotate(label, (p.get_x(), p.get_y()), xytext=(0, 10 + label_y_offset), textcoords='offset points')
 
     # Possibly create legend
     if labels is not None:
-        fig.legend(loc='lower center', ncol=len(labels), labels=labels)
+        return fig.legend(loc='lower center', ncol=len(labels), labels=labels)
+    return None
+
+
+def _create_plot(mod_dict: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]], labels: Union[List[str], None],
+                 max_y: int, annotation_track: Union[pd.Series, None] = None):
+    """
+    Create plot and show it.
+
+    :param mod_dict: The dictionary with the condition name and the count and percentage, and total count DataFrames.
+    :param labels: The list of labels. If None, no legend will be shown.
+    :param max_y: The maximum y-value.
+    :param annotation_track: The region of each position. If None, only the positions are shown.
+    """
+    # Create the subplots
+    fig, ax = plt.subplots(nrows=len(mod_dict), sharex='all', figsize=FIGURE_SIZE, squeeze=False)
+    fig.text(0.03, 0.025, 'Position', ha='center', va='center')  # X-label
+    fig.text(0.02, 0.5, 'Percentage (Count)', ha='center', va='center', rotation='vertical')  # Y-label
+    _draw_conditions(fig, list(ax[:, 0]), mod_dict=mod_dict, labels=labels, max_y=max_y,
+                     annotation_track=annotation_track)
     plt.tight_layout(pad=0.5)
     plt.show()
 
 
+class PlotRenderer:
+    """
+    Render the plots to files with the Agg backend, i.e. without a display. The figure and its axes are created once
+    and reused for every plot with the same number of conditions.
+    """
+
+    def __init__(self, output_dir: str, formats: Tuple[str, ...] = ('png',), dpi: int = 300,
+                 rasterize_bars: bool = False):
+        """
+        :param output_dir: The directory the figures are written to.
+        :param formats: The file formats, e.g. 'png', 'svg' and 'pdf'. Default PNG.
+        :param dpi: The resolution of the raster formats and rasterized bars. Default 300.
+        :param rasterize_bars: Whether the bars are rasterized in SVG and PDF figures, which keeps large vector figures
+            small. Default False.
+        """
+        self.output_dir: str = output_dir
+        self.formats: Tuple[str, ...] = tuple(formats)
+        self.dpi: int = dpi
+        self.rasterize_bars: bool = rasterize_bars
+        self.render_times: Dict[str, float] = {}
+        self._figure: Union[Figure, None] = None
+        self._axes: list = []
+        self._legend = None
+
+    def render(self, mod_dict: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+               labels: Union[List[str], None], max_y: int, name: str,
+               annotation_track: Union[pd.Series, None] = None) -> List[str]:
+        """
+        Render a plot and write it in each of the formats.
+
+        :param mod_dict: The dictionary with the condition name and the count and percentage, and total count
+            DataFrames.
+        :param labels: The list of labels. If None, no legend will be shown.
+        :param max_y: The maximum y-value.
+        :param name: The file name of the figure without extension.
+        :param annotation_track: The region of each position. If None, only the positions are shown.
+        :return: The paths to the written files.
+        """
+        start_time: float = time.perf_counter()
+        self._prepare_axes(n_conditions=len(mod_dict))
+        self._legend = _draw_conditions(self._figure, self._axes, mod_dict=mod_dict, labels=labels, max_y=max_y,
+                                        rasterize_bars=self.rasterize_bars, annotation_track=annotation_track)
+        self._figure.tight_layout(pad=0.5)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        filepaths: List[str] = []
+        for file_format in self.formats:
+            filepath: str = os.path.join(self.output_dir, f"{name}.{file_format}")
+            self._figure.savefig(filepath, format=file_format, dpi=self.dpi)
+            filepaths.append(filepath)
+
+        render_time: float = time.perf_counter() - start_time
+        self.render_times[name] = render_time
+        print(f"Rendered {name} ({', '.join(self.formats)}) in {round(render_time, 2)} s")
+        return filepaths
+
+    def _prepare_axes(self, n_conditions: int):
+        """
+        Clear the axes of the previous plot, or create the figure if the number of conditions has changed.
+
+        :param n_conditions: The number of conditions, i.e. the number of axes.
+        """
+        if self._legend is not None:
+            self._legend.remove()
+            self._legend = None
+        if self._figure is not None and len(self._axes) == n_conditions:
+            for ax in self._axes:
+                ax.cla()
+            return
+
+        self._figure = Figure(figsize=FIGURE_SIZE)
+        FigureCanvasAgg(self._figure)
+        self._axes = list(self._figure.subplots(nrows=n_conditions, sharex='all', squeeze=False)[:, 0])
+        self._figure.text(0.03, 0.025, 'Position', ha='center', va='center')  # X-label
+        self._figure.text(0.02, 0.5, 'Percentage (Count)', ha='center', va='center', rotation='vertical')  # Y-label
+
+
+def _analyse_peptide_list(peptide_list: Tuple[str, str, str], modifications: Dict[float, str],
+                          modification_position: List[int], combine_function: Union[Callable, None],
+                          mass_tolerance: float = MASS_TOLERANCE, tolerance_unit: str = 'Da') \
+        -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Read a peptide list and find the modifications of the condition.
+
+    :param peptide_list: The tuple containing the name of the peptide list and the condition and the sheet name. If
+        sheet name is None, 'Sheet1' is used.
+    :param modifications: The dictionary with the modification mass and the modification name.
+    :param modification_position: The list of position available for modification.
+    :param combine_function: The function which can be used for combining columns etc.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
+    :return: The tuple containing the count, percentage and peptide count DataFrames.
+    """
+    hits: pd.DataFrame = read_workbook_sheet(f"{peptide_list[0]}.xlsx",
+                                             sheet_name=peptide_list[2] if peptide_list[2] is not None else 'Sheet1',
+                                             usecols=["V", "modifs", "from", "to", "seq"])
+
+    # Remove invalid peptides
+    hits = hits[hits['V'] == "Y"]
+    # Get the mods and the modifications percentages.
+    mod_df_raw, percentage_df_raw, peptide_count_df = _find_modifications(hits_df=hits,
+                                                                          positions=modification_position,
+                                                                          modification_dict=modifications,
+                                                                          mass_tolerance=mass_tolerance,
+                                                                          tolerance_unit=tolerance_unit)
+
+    # Combine if a combine function is given.
+    if combine_function is not None:
+        mod_df = combine_function(mod_df_raw)
+        percentage_df = combine_function(percentage_df_raw)
+    else:
+        mod_df = mod_df_raw
+        percentage_df = percentage_df_raw
+
+    mod_df.index = [int(idx) for idx in mod_df.index]
+    mod_df = mod_df.sort_index()
+    percentage_df.index = [int(idx) for idx in percentage_df.index]
+    percentage_df = percentage_df.sort_index()
+    peptide_count_df.index = [int(idx) for idx in peptide_count_df.index]
+    peptide_count_df = peptide_count_df.sort_index()
+
+    return mod_df, percentage_df, peptide_count_df
+
+
+# The functions of the analysis of a peptide list, whose code is part of the fingerprint of the cached results
+ANALYSIS_FUNCTIONS: List[Callable] = [_analyse_peptide_list, _find_modifications, _parse_and_filter_modifications,
+                                      _parse_modifications, _match_modification_masses, calculate_coverage,
+                                      _count_peptides]
+
+
+def analyse_peptide_lists(peptide_lists: List[Tuple[str, str, str]], modifications: Dict[float, str],
+                          modification_position: List[int], combine_function: Union[Callable, None],
+                          workers: Union[int, None] = 1, mass_tolerance: float = MASS_TOLERANCE,
+                          tolerance_unit: str = 'Da', cache_dir: Union[str, None] = None) \
+        -> Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+    """
+    Find the modifications of each peptide list, possibly in parallel worker processes. With a cache directory, only
+    the peptide lists whose workbook or analysis settings have changed since the last run are analysed.
+
+    :param peptide_lists: The list of tuples containing the name of the peptide list and the condition and the
+        sheet name. If sheet name is None, 'Sheet1' is used.
+    :param modifications: The dictionary with the modification mass and the modification name.
+    :param modification_position: The list of position available for modification.
+    :param combine_function: The function which can be used for combining columns etc. It must be defined at module
+        level when more than one worker is used.
+    :param workers: The number of worker processes. If 1, the peptide lists are analysed in this process. If None, one
+        worker per CPU is used. Default 1.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
+    :param cache_dir: The directory of the result cache. If None, all the peptide lists are analysed. Default None.
+    :return: The dictionary with the condition name and the count, percentage and peptide count DataFrames in the
+        order of the peptide lists.
+    """
+    results: list = [None] * len(peptide_lists)
+    fingerprints: list = [None] * len(peptide_lists)
+    if cache_dir is not None:
+        for list_idx, peptide_list in enumerate(peptide_lists):
+            fingerprints[list_idx] = analysis_fingerprint(
+                f"{peptide_list[0]}.xlsx", sheet_name=peptide_list[2] if peptide_list[2] is not None else 'Sheet1',
+                modifications=modifications, modification_position=modification_position,
+                combine_function=combine_function, mass_tolerance=mass_tolerance, tolerance_unit=tolerance_unit,
+                cache_dir=cache_dir, analysis_functions=ANALYSIS_FUNCTIONS)
+            results[list_idx] = load_result(cache_dir, fingerprint=fingerprints[list_idx])
+    stale: List[int] = [list_idx for list_idx, result in enumerate(results) if result is None]
+    if cache_dir is not None:
+        print(f"\tAnalysing {len(stale)} of {len(peptide_lists)} peptide lists, the rest are cached")
+
+    analyse = partial(_analyse_peptide_list, modifications=modifications,
+                      modification_position=modification_position, combine_function=combine_function,
+                      mass_tolerance=mass_tolerance, tolerance_unit=tolerance_unit)
+    if workers == 1 or len(stale) <= 1:
+        new_results: list = [analyse(peptide_lists[list_idx]) for list_idx in stale]
+    else:
+        # The results are returned in the order of the peptide lists
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            new_results = list(executor.map(analyse, [peptide_lists[list_idx] for list_idx in stale]))
+
+    for list_idx, result in zip(stale, new_results):
+        results[list_idx] = result
+        if cache_dir is not None:
+            store_result(cache_dir, fingerprint=fingerprints[list_idx], result=result)
+
+    modification_files: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]] = {}
+    for peptide_list, result in zip(peptide_lists, results):
+        modification_files[peptide_list[1]] = result
+    return modification_files
+
+
 def create_plots_from_peptide_lists(peptide_lists: List[Tuple[str, str, str]], modifications: Dict[float, str],
                                     modification_position: List[int], combine_function: Union[Callable, None],
-                                    labels: Union[List[str], None], max_y: int = 100):
+                                    labels: Union[List[str], None], max_y: int = 100, workers: Union[int, None] = 1,
+                                    mass_tolerance: float = MASS_TOLERANCE, tolerance_unit: str = 'Da',
+                                    renderer: Union[PlotRenderer, None] = None, name: str = 'modifications',
+                                    cache_dir: Union[str, None] = None,
+                                    annotation_track: Union[pd.Series, None] = None):
     """
     Create plots from the a list of peptide lists
 
@@ -159,36 +481,24 @@ def create_plots_from_peptide_lists(peptide_lists: List[Tuple[str, str, str]], m
     :param combine_function: The function which can be used for combining columns etc.
     :param labels: The labels to be used in the plot.
     :param max_y: The maximum y-value shown in the plot. Default 100.
+    :param workers: The number of worker processes used for reading and analysing the peptide lists. Default 1.
+    :param mass_tolerance: The tolerance for matching the modification masses. Default 0.001.
+    :param tolerance_unit: The unit of the tolerance, either 'Da' or 'ppm'. Default 'Da'.
+    :param renderer: The renderer used for writing the plot to files. If None, the plot is shown.
+    :param name: The file name of the plot when a renderer is used. Default 'modifications'.
+    :param cache_dir: The directory of the result cache. If None, all the peptide lists are analysed. Default None.
+    :param annotation_track: The region of each position, e.g. from read_annotation_track, which is shown below the
+        positions. If None, only the positions are shown.
     """
-    modification_files: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]] = {}
-    for peptide_list in peptide_lists:
-        hits: pd.DataFrame = pd.read_excel(io=f"{peptide_list[0]}.xlsx",
-                                           sheet_name=peptide_list[2] if peptide_list[2] is not None else 'Sheet1',
-                                           usecols=["V", "modifs", "from", "to", "seq"])
-
-        # Remove invalid peptides
-        hits = hits[hits['V'] == "Y"]
-        # Get the mods and the modifications percentages.
-        mod_df_raw, percentage_df_raw, peptide_count_df = _find_modifications(hits_df=hits,
-                                                                              positions=modification_position,
-                                                                              modification_dict=modifications)
-
-        # Combine if a combine function is given.
-        if combine_function is not None:
-            mod_df = combine_function(mod_df_raw)
-            percentage_df = combine_function(percentage_df_raw)
-        else:
-            mod_df = mod_df_raw
-            percentage_df = percentage_df_raw
-
-        mod_df.index = [int(idx) for idx in mod_df.index]
-        mod_df = mod_df.sort_index()
-        percentage_df.index = [int(idx) for idx in percentage_df.index]
-        percentage_df = percentage_df.sort_index()
-        peptide_count_df.index = [int(idx) for idx in peptide_count_df.index]
-        peptide_count_df = peptide_count_df.sort_index()
-
-        modification_files[peptide_list[1]] = (mod_df, percentage_df, peptide_count_df)
+    modification_files: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]] = \
+        analyse_peptide_lists(peptide_lists=peptide_lists, modifications=modifications,
+                              modification_position=modification_position, combine_function=combine_function,
+                              workers=workers, mass_tolerance=mass_tolerance, tolerance_unit=tolerance_unit,
+                              cache_dir=cache_dir)
 
     # Create the plots
-    _create_plot(mod_dict=modification_files, labels=labels, max_y=max_y)
+    if renderer is None:
+        _create_plot(mod_dict=modification_files, labels=labels, max_y=max_y, annotation_track=annotation_track)
+    else:
+        renderer.render(mod_dict=modification_files, labels=labels, max_y=max_y, name=name,
+                        annotation_track=annotation_track)
@@ -0,0 +1,126 @@
+"""
+Description: Cache of the analysed peptide lists, keyed by a fingerprint of all the inputs of the analysis.
+"""
+
+# Import packages
+import hashlib
+import json
+import os
+import sys
+import types
+from typing import Callable, Dict, List, Tuple, Union
+
+import pandas as pd
+
+# The file digests are shared with the MS1 cache in OtherScripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OtherScripts'))
+
+from FileDigest import file_digest  # noqa: E402
+
+# The version of the cached results. The code of the analysis functions is part of the fingerprint, but the version
+# must still be changed when other code the analysis depends on changes the results, e.g. WorkbookCache.
+CACHE_VERSION = 1
+
+
+def analysis_fingerprint(workbook_filepath: str, sheet_name: str, modifications: Dict[float, str],
+                         modification_position: List[int], combine_function: Union[Callable, None],
+                         mass_tolerance: float, tolerance_unit: str, cache_dir: str,
+                         analysis_functions: Union[List[Callable], None] = None) -> str:
+    """
+    Create the fingerprint of the analysis of a peptide list. The fingerprint changes when the content of the workbook,
+    the sheet, the modifications, the positions, the combine function, the tolerance or the code of the analysis
+    functions changes.
+    :param workbook_filepath: The path to the workbook.
+    :param sheet_name: The name of the sheet.
+    :param modifications: The dictionary with the modification mass and the modification name.
+    :param modification_position: The list of position available for modification.
+    :param combine_function: The function used for combining columns etc.
+    :param mass_tolerance: The tolerance for matching the modification masses.
+    :param tolerance_unit: The unit of the tolerance.
+    :param cache_dir: The cache directory.
+    :param analysis_functions: The functions of the analysis, whose code is part of the fingerprint, so the results of
+        the previous code are not used after the analysis is changed. If None, only the inputs are fingerprinted.
+    :return: The hex digest of the fingerprint.
+    """
+    inputs: dict = {
+        'version': CACHE_VERSION,
+        'workbook': file_digest(workbook_filepath, cache_dir=cache_dir),
+        'sheet': sheet_name,
+        'modifications': sorted([float(mod_mass), name] for mod_mass, name in modifications.items()),
+        'positions': [int(pos) for pos in modification_position],
+        'combine_function': _function_identity(combine_function),
+        'mass_tolerance': float(mass_tolerance),
+        'tolerance_unit': tolerance_unit,
+        'analysis_functions': [_function_identity(function) for function in analysis_functions or []]
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_result(cache_dir: str, fingerprint: str) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
+    """
+    Load the result of an analysis from the cache.
+    :param cache_dir: The cache directory.
+    :param fingerprint: The fingerprint of the analysis.
+    :return: The tuple containing the count, percentage and peptide count DataFrames. None if it is not cached.
+    """
+    result_filepath: str = os.path.join(cache_dir, f"{fingerprint}.pkl")
+    if not os.path.exists(result_filepath):
+        return None
+    try:
+        return pd.read_pickle(result_filepath)
+    except Exception as error:  # The entry may be truncated or written by an incompatible pandas version
+        print(f"\tWARN: Could not read the cached result {result_filepath}: {error}")
+        return None
+
+
+def store_result(cache_dir: str, fingerprint: str, result: Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]):
+    """
+    Store the result of an analysis in the cache. The result is written to a temporary file, which is moved into place
+    when it is complete.
+    :param cache_dir: The cache directory.
+    :param fingerprint: The fingerprint of the analysis.
+    :param result: The tuple containing the count, percentage and peptide count DataFrames.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    result_filepath: str = os.path.join(cache_dir, f"{fingerprint}.pkl")
+    temporary_filepath: str = f"{result_filepath}.tmp{os.getpid()}"
+    pd.to_pickle(result, temporary_filepath)
+    os.replace(temporary_filepath, result_filepath)
+
+
+def _function_identity(function: Union[Callable, None]) -> Union[dict, None]:
+    """
+    Get the identity of a function, i.e. its module, name and a hash of its byte code and constants, so an edited
+    function gets a new identity.
+    :param function: The function.
+    :return: The identity. None if no function is given.
+    """
+    if function is None:
+        return None
+    code = getattr(function, '__code__', None)
+    if code is None:
+        # E.g. a functools.partial, which is identified by its representation
+        return {'repr': repr(function)}
+    code_hash = hashlib.sha256()
+    _update_code_hash(code_hash, code)
+    return {'module': function.__module__, 'name': function.__qualname__, 'code': code_hash.hexdigest()}
+
+
+def _update_code_hash(code_hash, code: types.CodeType):
+    """
+    Add the byte code, names and constants of a code object to a hash. The code objects of nested functions, lambdas
+    and comprehensions are added in the same way, as their representation contains their memory address, which changes
+    on every run.
+    :param code_hash: The hash.
+    :param code: The code object.
+    """
+    code_hash.update(code.co_code)
+    code_hash.update(repr(code.co_names).encode('utf-8'))
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            _update_code_hash(code_hash, constant)
+        elif isinstance(constant, frozenset):
+            # The order of a set of strings changes with the hash seed of the run
+            code_hash.update(repr(sorted(repr(item) for item in constant)).encode('utf-8'))
+        else:
+            code_hash.update(repr(constant).encode('utf-8'))
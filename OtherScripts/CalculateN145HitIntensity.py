@@ -3,81 +3,146 @@ Description: Calculate hit intensities from 14N/15N hits
 """
 
 # Import packages
+from typing import Iterable, Tuple, Union
+
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from pyopenms.pyopenms_5 import MSExperiment, MzXMLFile, MSSpectrum
-
-
-def calculate_intensity(experiment: MSExperiment, n14_mz: float, n15_mz,
-                        sequence: str, charge: int, modification: str, mod_seq: str) -> pd.DataFrame:
-    hits: pd.DataFrame = pd.DataFrame(columns=['Sequence', 'Modifications', 'Charge', 'RT', 'Scan number',
-                                               '14N m/z (Exp)', '14N m/z (Thr)', '14N Intensity',
-                                               '14N m/z (Exp)', '15N m/z (Thr)', '15N Intensity',
-                                               'Ratio', 'ModSeq'])
-
-    tolerance = 0.01
-    for scan in experiment:
-        # Get peaks
-        n14_peak_index = scan.findNearest(n14_mz, tolerance / charge)
-        n15_peak_index = scan.findNearest(n15_mz, tolerance / charge)
-        if n14_peak_index != -1 and n15_peak_index != -1:
-            n14_peak = scan[n14_peak_index]
-            n15_peak = scan[n15_peak_index]
-
-            n14_int = n14_peak.getIntensity()
-            n15_int = n15_peak.getIntensity()
-
-            if n14_int == 0 and n15_int == 0:
-                continue
-
-            if n14_int == 0:
-                ratio = 0
-            else:
-                ratio = round(n15_int / n14_int, 3)
-
-            hits = hits.append(
-                pd.DataFrame([[sequence, modification, charge, scan.getRT(), scan.getNativeID().split('=')[1],
-                               n14_mz, n14_peak.getMZ(), n14_int, n15_mz, n15_peak.getMZ(), n15_int, ratio, mod_seq]],
-                             columns=hits.columns), ignore_index=True)
 
+from MS1Cache import open_ms1_scans
+from OutputWriter import SYNCHRONOUS_WRITER, OutputWriter, read_table
+from PeakPicking import AREA_COLUMNS, integrate_peaks
+from PeptideTable import take_categorical
+from ScanPreprocessing import PreprocessingSettings
+from XICExtraction import XICs, extract_xics
+
+INTENSITY_COLUMNS = ['Sequence', 'Modifications', 'Charge', 'RT', 'Scan number', '14N m/z (Thr)', '14N m/z (Exp)',
+                     '14N Intensity', '15N m/z (Thr)', '15N m/z (Exp)', '15N Intensity', 'Ratio', 'ModSeq']
+PEAK_AREA_COLUMNS = ['Sequence', 'Modifications', 'Charge', '14N m/z (Thr)', '15N m/z (Thr)'] + AREA_COLUMNS + \
+    ['ModSeq']
+
+
+def calculate_intensity(hit_list: pd.DataFrame, xics: XICs) -> pd.DataFrame:
+    """
+    Create the per scan intensity list from the chromatograms of the hits.
+    :param hit_list: The hit list.
+    :param xics: The chromatograms with one row per hit.
+    :return: The intensity list with a row for each hit and scan with both a 14N and a 15N peak. The strings repeated
+        for every scan of a hit are stored as categoricals.
+    """
+    # Keep the scans with both peaks, where at least one of the peaks has an intensity
+    found: np.ndarray = ~np.isnan(xics.n14_mz) & ~np.isnan(xics.n15_mz) & \
+        ((xics.n14_intensity != 0) | (xics.n15_intensity != 0))
+    hit_indices, scan_indices = np.nonzero(found)
+
+    n14_int: np.ndarray = xics.n14_intensity[hit_indices, scan_indices].astype(np.float64)
+    n15_int: np.ndarray = xics.n15_intensity[hit_indices, scan_indices].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios: np.ndarray = np.where(n14_int == 0, 0, np.round(n15_int / n14_int, 3))
+
+    hits: pd.DataFrame = pd.DataFrame({
+        'Sequence': take_categorical(hit_list['Sequence'], hit_indices),
+        'Modifications': take_categorical(hit_list['Modifications'], hit_indices),
+        'Charge': hit_list['Charge'].to_numpy(dtype=int)[hit_indices],
+        'RT': xics.rts[scan_indices],
+        'Scan number': xics.scan_ids[scan_indices],
+        '14N m/z (Thr)': hit_list['14N m/z'].to_numpy(dtype=float)[hit_indices],
+        '14N m/z (Exp)': xics.n14_mz[hit_indices, scan_indices],
+        '14N Intensity': n14_int,
+        '15N m/z (Thr)': hit_list['15N m/z'].to_numpy(dtype=float)[hit_indices],
+        '15N m/z (Exp)': xics.n15_mz[hit_indices, scan_indices],
+        '15N Intensity': n15_int,
+        'Ratio': ratios,
+        'ModSeq': take_categorical(hit_list['ModSeq'], hit_indices)
+    }, columns=INTENSITY_COLUMNS)
     return hits
 
 
-def read_ms_data(mzxml_filepath: str):
-    # Read mzXML file
-    print("Read mzXML file...")
-    exp: MSExperiment = MSExperiment()
-    MzXMLFile().load(mzxml_filepath, exp)
-    spec = []
-    for s in exp.getSpectra():
-        if s.getMSLevel() == 1:
-            spec.append(s)
-    exp.setSpectra(spec)
-    print("Done reading")
-    return exp
+def calculate_peak_areas(hit_list: pd.DataFrame, xics: XICs, smoothing_window: int = 5) -> pd.DataFrame:
+    """
+    Create the peak area list from the chromatographic peaks of the hits. The hit list has no retention times, so the
+    apex of each hit is the maximum of its chromatogram over the whole run, and a more intense peak of the same m/z
+    elsewhere in the run is chosen over the peak of the identification.
+    :param hit_list: The hit list.
+    :param xics: The chromatograms with one row per hit.
+    :param smoothing_window: The number of scans of the moving average used to find the peaks.
+    :return: The peak area list with a row for each hit with a peak.
+    """
+    peaks: pd.DataFrame = integrate_peaks(xics, smoothing_window=smoothing_window)
+    peak_areas: pd.DataFrame = pd.DataFrame({
+        'Sequence': hit_list['Sequence'].array,
+        'Modifications': hit_list['Modifications'].array,
+        'Charge': hit_list['Charge'].to_numpy(dtype=int),
+        '14N m/z (Thr)': hit_list['14N m/z'].to_numpy(dtype=float),
+        '15N m/z (Thr)': hit_list['15N m/z'].to_numpy(dtype=float),
+        **{column: peaks[column].to_numpy() for column in AREA_COLUMNS},
+        'ModSeq': hit_list['ModSeq'].array
+    }, columns=PEAK_AREA_COLUMNS)
+    return peak_areas[peak_areas['Apex RT'].notna()]
+
+
+def read_ms_data(mzxml_filepath: str, cache_dir: Union[str, None] = None,
+                 preprocessing: Union[PreprocessingSettings, None] = None) \
+        -> Iterable[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Read the MS1 scans of the mzXML file lazily or from the MS1 cache.
+    :param mzxml_filepath: The path to the mzXML.
+    :param cache_dir: The directory of the MS1 cache. If None, the mzXML file is read without caching.
+    :param preprocessing: The settings for centroiding the scans and removing the noise. If None, the raw scans are
+        read.
+    :return: The MS1 scans.
+    """
+    return open_ms1_scans(mzxml_filepath, cache_dir=cache_dir, preprocessing=preprocessing)
 
 
 def calculate_intensities(hit_list_filepath: str, mzxml_filepath: str,
-                          intensity_hit_list_filepath: str) -> pd.DataFrame:
-    hit_list: pd.DataFrame = pd.read_excel(hit_list_filepath, header=0)
-    ms_experiment = read_ms_data(mzxml_filepath=mzxml_filepath)
-
-    intensity_hitlist: pd.DataFrame = pd.DataFrame(columns=['Sequence', 'Modifications', 'Charge', 'RT', 'Scan number',
-                                                            '14N m/z (Exp)', '14N m/z (Thr)', '14N Intensity',
-                                                            '14N m/z (Exp)', '15N m/z (Thr)', '15N Intensity',
-                                                            'Ratio', 'ModSeq'])
-    hit_list['ModSeq'] = hit_list.apply(lambda x: create_mod_sequence_string(x['Sequence'], x['Modifications'],
-                                                                             x['Start']), axis=1)
-
-    for _, hit in tqdm(hit_list.iterrows(), total=hit_list.shape[0]):
-        hit_scans: pd.DataFrame = calculate_intensity(experiment=ms_experiment, n14_mz=float(hit['14N m/z']),
-                                                      n15_mz=float(hit['15N m/z']), sequence=hit['Sequence'],
-                                                      charge=int(hit['Charge']), modification=hit['Modifications'],
-                                                      mod_seq=hit['ModSeq'])
-        intensity_hitlist = intensity_hitlist.append(hit_scans, ignore_index=True)
+                          intensity_hit_list_filepath: str, tolerance: float = 0.01,
+                          cache_dir: Union[str, None] = None,
+                          preprocessing: Union[PreprocessingSettings, None] = None, tolerance_unit: str = 'Da',
+                          isotopes: int = 0, per_scan: bool = False, hit_list: Union[pd.DataFrame, None] = None,
+                          writer: OutputWriter = SYNCHRONOUS_WRITER) -> pd.DataFrame:
+    """
+    Calculate the intensities of the hits and write them to a file.
+    :param hit_list_filepath: The path to the hit list.
+    :param mzxml_filepath: The path to the mzXML.
+    :param intensity_hit_list_filepath: The path to the file of the intensities. The extension is replaced by the one of
+        the output format.
+    :param tolerance: The tolerance. Default is 0.01
+    :param cache_dir: The directory of the MS1 cache. If None, the mzXML file is read without caching.
+    :param preprocessing: The settings for centroiding the scans and removing the noise. If None, the raw scans are
+        searched.
+    :param tolerance_unit: The unit of the tolerance, either 'Da', where the tolerance is divided by the charge, or
+        'ppm'. Default 'Da'.
+    :param isotopes: The number of isotope peaks summed with the monoisotopic peak. Default 0.
+    :param per_scan: If True, a row is written for each hit and scan with both peaks. Otherwise the chromatographic
+        peak of each hit is integrated and a row is written for each hit. Default False. The hits have no retention
+        times, so the chromatograms cover the whole run and the apex is the most intense peak of the run.
+    :param hit_list: The hit list, e.g. from find_hits. If None, the hit list is read from hit_list_filepath.
+    :param writer: The writer of the intensities. Default Parquet written at once.
+    :return: The intensity list indexed by the modified sequence.
+    """
+    hit_list = read_table(hit_list_filepath) if hit_list is None else hit_list.copy()
+
+    hit_list['ModSeq'] = pd.Categorical([create_mod_sequence_string(sequence, modifications, start)
+                                         for sequence, modifications, start in zip(hit_list['Sequence'],
+                                                                                   hit_list['Modifications'],
+                                                                                   hit_list['Start'])])
+
+    # Extract the chromatograms of all hits at once while reading the mzXML file
+    print("Read mzXML file...")
+    xics: XICs = extract_xics(read_ms_data(mzxml_filepath=mzxml_filepath, cache_dir=cache_dir,
+                                           preprocessing=preprocessing),
+                              n14_mzs=hit_list['14N m/z'].to_numpy(dtype=float),
+                              n15_mzs=hit_list['15N m/z'].to_numpy(dtype=float),
+                              charges=hit_list['Charge'].to_numpy(dtype=int), tolerance=tolerance,
+                              tolerance_unit=tolerance_unit, isotopes=isotopes)
+    print("Done reading")
+    if per_scan:
+        intensity_hitlist: pd.DataFrame = calculate_intensity(hit_list=hit_list, xics=xics)
+    else:
+        intensity_hitlist = calculate_peak_areas(hit_list=hit_list, xics=xics)
 
     intensity_hitlist = intensity_hitlist.set_index(keys=['ModSeq'], append=False)
-    intensity_hitlist.to_excel(intensity_hit_list_filepath)
+    writer.write(intensity_hitlist, intensity_hit_list_filepath)
     return intensity_hitlist
 
 
@@ -96,10 +161,11 @@ def create_mod_sequence_string(sequence: str, modifications: str, peptide_start:
 
 
 if __name__ == '__main__':
-    hit_list_path = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_trypsin_rCRT14.xlsx"
+    hit_list_path = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_trypsin_rCRT14.parquet"
     mzxml_path = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\mzXML\EXP3_01353_VM_tryp_mix_rCrt14.mzXML"
     intensity_hit_list_path = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\HitsIntensity" \
-                              r"\Hit_intensity_Trypsin_rCrt14.xlsx"
+                              r"\Hit_intensity_Trypsin_rCrt14.parquet"
+    ms1_cache_dir = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\mzXML\MS1Cache"
 
     hit_df = calculate_intensities(hit_list_filepath=hit_list_path, mzxml_filepath=mzxml_path,
-                                   intensity_hit_list_filepath=intensity_hit_list_path)
+                                   intensity_hit_list_filepath=intensity_hit_list_path, cache_dir=ms1_cache_dir)
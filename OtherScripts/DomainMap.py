@@ -0,0 +1,108 @@
+"""
+Description: Region annotation of peptides from the domain boundaries of the proteins
+"""
+
+# Import packages
+import os
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+DOMAINS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Domains.csv')
+DEFAULT_PROTEIN = 'CRT'
+
+
+class DomainMap:
+    """
+    The regions of a protein with a lookup array holding the region of every residue. Positions before the first
+    residue get the first region and positions after the last residue get the last region.
+    """
+
+    def __init__(self, protein: str, domains: pd.DataFrame):
+        """
+        :param protein: The name of the protein.
+        :param domains: The domains with the columns 'Region', 'Start' and 'End', where the domains cover the protein
+            from residue 1 without gaps or overlaps.
+        """
+        domains = domains.sort_values('Start', kind='mergesort').reset_index(drop=True)
+        starts: np.ndarray = domains['Start'].to_numpy(dtype=np.int64)
+        ends: np.ndarray = domains['End'].to_numpy(dtype=np.int64)
+        if domains.empty or starts[0] != 1 or np.any(ends < starts) or np.any(starts[1:] != ends[:-1] + 1):
+            raise ValueError(f"The domains of {protein} must cover the protein from residue 1 without gaps or "
+                             f"overlaps.")
+
+        self.protein: str = protein
+        self.domains: pd.DataFrame = domains[['Region', 'Start', 'End']]
+        # Regions with the same name, e.g. the two parts of the core, share a code
+        self.region_names: List[str] = list(pd.unique(domains['Region']))
+        region_codes: np.ndarray = pd.Index(self.region_names).get_indexer(domains['Region'])
+        # The region of every residue, where index 0 is before the first residue
+        self.residue_regions: np.ndarray = np.concatenate([region_codes[:1],
+                                                           np.repeat(region_codes, ends - starts + 1)])
+        # The region of a peptide starting in one region and ending in another region
+        self.region_pairs: np.ndarray = np.array([[start if start == end else f"{start};{end}"
+                                                   for end in self.region_names] for start in self.region_names],
+                                                 dtype=object)
+
+    def __len__(self) -> int:
+        return self.residue_regions.size - 1
+
+    def region_codes(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Get the region codes of residues, i.e. the indices in region_names.
+        :param positions: The residue positions.
+        :return: The region codes.
+        """
+        return self.residue_regions[np.clip(np.asarray(positions, dtype=np.int64), 0, len(self))]
+
+    def regions_at(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Get the regions of residues.
+        :param positions: The residue positions.
+        :return: The region names.
+        """
+        return np.array(self.region_names, dtype=object)[self.region_codes(positions)]
+
+    def regions(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Get the regions of peptides from the regions of their first and last residue.
+        :param starts: The start positions.
+        :param ends: The end positions.
+        :return: The regions, e.g. 'Core' or 'Core;P' for a peptide spanning two regions.
+        """
+        return self.region_pairs[self.region_codes(starts), self.region_codes(ends)]
+
+    def annotation_track(self) -> pd.Series:
+        """
+        Get the region of every residue as an annotation track.
+        :return: The region names indexed by position.
+        """
+        positions: np.ndarray = np.arange(1, len(self) + 1)
+        return pd.Series(self.regions_at(positions), index=pd.Index(positions, name='Position'), name='Region')
+
+
+def load_domain_maps(domains_filepath: str = DOMAINS_FILE) -> Dict[str, DomainMap]:
+    """
+    Load the domain maps of all the proteins in a domain file.
+    :param domains_filepath: The CSV file with the columns 'Protein', 'Region', 'Start' and 'End'.
+    :return: The dictionary with the protein name and the domain map.
+    """
+    domains: pd.DataFrame = pd.read_csv(domains_filepath)
+    return {protein: DomainMap(protein, protein_domains) for protein, protein_domains
+            in domains.groupby('Protein', sort=False)}
+
+
+@lru_cache(maxsize=None)
+def load_domain_map(protein: str = DEFAULT_PROTEIN, domains_filepath: str = DOMAINS_FILE) -> DomainMap:
+    """
+    Load the domain map of a protein. The domain map is loaded once for each protein and file.
+    :param protein: The name of the protein. Default calreticulin.
+    :param domains_filepath: The CSV file with the domains.
+    :return: The domain map.
+    """
+    domain_maps: Dict[str, DomainMap] = load_domain_maps(domains_filepath)
+    if protein not in domain_maps:
+        raise KeyError(f"{protein} is not in {domains_filepath}.")
+    return domain_maps[protein]
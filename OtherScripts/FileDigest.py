@@ -0,0 +1,52 @@
+"""
+Description: Content digests of input files, which are only recomputed when a file changes
+"""
+
+# Import packages
+import hashlib
+import json
+import os
+import threading
+
+# The directory of the digest files in a cache directory
+SOURCES_DIR = 'sources'
+
+
+def file_digest(filepath: str, cache_dir: str) -> str:
+    """
+    Get the SHA-256 digest of the file content. The digest is stored with the size and modification time of the file,
+    so an unchanged file is only hashed once. Every file has its own digest file, which is replaced in one step, so
+    processes using the same cache never lose or read half of each other's digests.
+    :param filepath: The path to the file.
+    :param cache_dir: The cache directory.
+    :return: The hex digest.
+    """
+    source_key: str = os.path.abspath(filepath)
+    sources_dir: str = os.path.join(cache_dir, SOURCES_DIR)
+    source_filepath: str = os.path.join(sources_dir,
+                                        hashlib.sha256(source_key.encode('utf-8')).hexdigest()[:32] + '.json')
+    source: dict = {}
+    try:
+        with open(source_filepath, 'r') as source_file:
+            source = json.load(source_file)
+    except (OSError, ValueError):
+        # A missing or unreadable digest file is the same as a file not hashed yet
+        pass
+
+    file_stat = os.stat(filepath)
+    if source.get('source') == source_key and source.get('size') == file_stat.st_size and \
+            source.get('mtime_ns') == file_stat.st_mtime_ns:
+        return source['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b''):
+            sha256.update(block)
+    source = {'source': source_key, 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns,
+              'sha256': sha256.hexdigest()}
+    os.makedirs(sources_dir, exist_ok=True)
+    temporary_filepath: str = f"{source_filepath}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(temporary_filepath, 'w') as source_file:
+        json.dump(source, source_file, indent=1)
+    os.replace(temporary_filepath, source_filepath)
+    return source['sha256']
@@ -2,46 +2,43 @@
 Description: Find peptide which matches across the different conditions
 """
 # Import packages
+from typing import Dict, Tuple
+
 import pandas as pd
-from tqdm import tqdm
-
-
-def find_matching_hits(hits37: pd.DataFrame, hits42: pd.DataFrame, hits42zn: pd.DataFrame, output: str) -> pd.DataFrame:
-    hit_list: pd.DataFrame = pd.DataFrame(columns=['Sequence', 'Modifications', 'Start', 'End', 'Charge',
-                                                   '14N m/z', '15N m/z',
-                                                   '14N Mass (Exp)', '15N Mass (Exp)'])
-    for _, hit37 in tqdm(hits37.iterrows(), total=hits37.shape[0]):
-        for _, hit42 in hits42.iterrows():
-            if hit37['Sequence'] == hit42['Sequence'] and \
-                    hit37['Modifications'] == hit42['Modifications'] and \
-                    hit37['Start'] == hit42['Start']:
-                for _, hit42zn in hits42zn.iterrows():
-                    if hit37['Sequence'] == hit42['Sequence'] == hit42zn['Sequence'] and \
-                            hit37['Modifications'] == hit42['Modifications'] == hit42zn['Modifications'] and \
-                            hit37['Start'] == hit42['Start'] == hit42zn['Start']:
-                        hit_list = hit_list.append(pd.DataFrame([[hit37['Sequence'], hit37['Modifications'],
-                                                                  hit37['Start'], hit37['End'], hit37['Charge'],
-                                                                  hit37['14N m/z'], hit37['15N m/z'],
-                                                                  hit37['14N Mass (Exp)'], hit37['15N Mass (Exp)']]],
-                                                                columns=['Sequence', 'Modifications', 'Start', 'End',
-                                                                         'Charge', '14N m/z', '15N m/z',
-                                                                         '14N Mass (Exp)',
-                                                                         '15N Mass (Exp)']),
-                                                   ignore_index=True)
-                hit_list = hit_list.drop_duplicates(subset=['Sequence', 'Modifications'])
-                hit_list = hit_list.sort_values(by=['Start'])
-                hit_list = hit_list.reset_index(drop=True)
-                hit_list.to_excel(output, sheet_name="List")
+
+from HitMatching import match_conditions, finalise_hit_list
+from OutputWriter import SYNCHRONOUS_WRITER, OutputWriter, read_table
+
+
+def find_matching_hits(hits: Dict[str, pd.DataFrame], output: str, how: str = 'intersection',
+                       writer: OutputWriter = SYNCHRONOUS_WRITER) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Find the hits matching across the conditions on sequence, modifications and start position.
+    :param hits: The dictionary with the condition name and the hit list of the condition.
+    :param output: The output filepath. The matching hits are written to the sheet 'List' and the presence matrix to the
+        sheet 'Presence', which is a separate file with the suffix '_Presence' in Parquet and CSV.
+    :param how: 'intersection' for hits found in all conditions or 'union' for hits found in any condition.
+    :param writer: The writer of the output. Default Parquet written at once.
+    :return: The tuple containing the matching hits and the presence matrix used for the Venn plots.
+    """
+    hit_list, presence = match_conditions(conditions=hits, keys=['Sequence', 'Modifications', 'Start'], how=how)
+    hit_list = hit_list[['Sequence', 'Modifications', 'Start', 'End', 'Charge', '14N m/z', '15N m/z',
+                         '14N Mass (Exp)', '15N Mass (Exp)']]
+    hit_list = finalise_hit_list(hit_list, unique_columns=['Sequence', 'Modifications'], sort_column='Start')
+
+    # Write the result once
+    writer.write_sheets({"List": hit_list, "Presence": presence}, output)
+
+    return hit_list, presence
 
 
 if __name__ == '__main__':
-    hits37_df: pd.DataFrame = pd.read_excel(io=r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_37.xlsx",
-                                            sheet_name="List")
-    hits42_df: pd.DataFrame = pd.read_excel(io=r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_42.xlsx",
-                                            sheet_name="List")
-    hits42_zn_df: pd.DataFrame = pd.read_excel(io=r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_42_Zn"
-                                                  r".xlsx",
-                                               sheet_name="List")
-    output_file: str = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\MatchingHits.xlsx"
-    matching_hits: pd.DataFrame = find_matching_hits(hits37=hits37_df, hits42=hits42_df, hits42zn=hits42_zn_df,
-                                                     output=output_file)
+    hit_files: Dict[str, str] = {
+        '37': r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_37.parquet",
+        '42': r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_42.parquet",
+        '42_Zn': r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\hits_42_Zn.parquet"
+    }
+    output_file: str = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\Hits\MatchingHits.parquet"
+    hits_df: Dict[str, pd.DataFrame] = {condition: read_table(hit_file, sheet_name="List")
+                                        for condition, hit_file in hit_files.items()}
+    matching_hits, presence_matrix = find_matching_hits(hits=hits_df, output=output_file)
@@ -0,0 +1,132 @@
+"""
+Description: Matching engine for joining 14N and 15N peptide lists
+"""
+
+# Import packages
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from PeptideTable import concat_peptides, peptide_keys
+
+
+def match_labelled_peptides(n14: pd.DataFrame, n15: pd.DataFrame, keys: List[str],
+                            n15_columns: Union[Dict[str, str], None] = None) -> pd.DataFrame:
+    """
+    Match the 14N peptides with the 15N peptides using a join on the given key columns. The keys are encoded as one
+    integer per row, so the join compares integers rather than strings.
+
+    Each 14N row is paired with the first 15N row with the same key, which is the pair the previous nested loop ended
+    up keeping after removing duplicates. The 14N rows are returned in their original order. Rows with a missing key
+    value never match, as in the nested loop.
+    :param n14: The 14N peptide list.
+    :param n15: The 15N peptide list.
+    :param keys: The columns which must be equal for the 14N and 15N peptide to match, e.g. sequence, modifications
+        and charge.
+    :param n15_columns: The dictionary with the 15N columns to add to the result and their new names. If None, only the
+        14N columns are returned.
+    :return: The matched 14N rows with the requested 15N columns.
+    """
+    n15_columns = n15_columns if n15_columns is not None else {}
+    n14_keys, n15_keys = peptide_keys([n14, n15], keys)
+    # Only keep the first 15N peptide for each key. np.unique returns the first row of each key.
+    n15_rows: np.ndarray = np.flatnonzero(n15_keys >= 0)
+    first_keys, first_idx = np.unique(n15_keys[n15_rows], return_index=True)
+    n15_rows = n15_rows[first_idx]
+
+    # Look up the key of every 14N peptide among the sorted 15N keys, which keeps the 14N order
+    positions: np.ndarray = np.searchsorted(first_keys, n14_keys)
+    found: np.ndarray = positions < first_keys.size
+    found[found] = first_keys[positions[found]] == n14_keys[found]
+    matched: np.ndarray = np.flatnonzero(found)
+    n15_matches: pd.DataFrame = n15.iloc[n15_rows[positions[matched]]][list(n15_columns)].rename(columns=n15_columns)
+    matches: pd.DataFrame = pd.concat([n14.iloc[matched].reset_index(drop=True), n15_matches.reset_index(drop=True)],
+                                      axis=1)
+    return matches
+
+
+def finalise_hit_list(hit_list: pd.DataFrame, unique_columns: List[str], sort_column: str) -> pd.DataFrame:
+    """
+    Remove duplicates, sort the hits by their position and reset the index. A stable sort is used, so hits with the
+    same position keep the order they were found in.
+    :param hit_list: The hit list.
+    :param unique_columns: The columns identifying unique peptides.
+    :param sort_column: The column to sort the hits by.
+    :return: The cleaned hit list.
+    """
+    hit_list = hit_list.drop_duplicates(subset=unique_columns)
+    hit_list = hit_list.sort_values(by=[sort_column], kind='mergesort')
+    hit_list = hit_list.reset_index(drop=True)
+    return hit_list
+
+
+def build_presence_matrix(conditions: Dict[str, pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """
+    Create the presence matrix with one row per unique peptide and one boolean column per condition.
+    :param conditions: The dictionary with the condition name and the hit list of the condition.
+    :param keys: The columns identifying a peptide, e.g. sequence, modifications and start position.
+    :return: The presence matrix indexed by the key columns with the conditions as columns.
+    """
+    return _presence(conditions, keys)[0]
+
+
+def match_conditions(conditions: Dict[str, pd.DataFrame], keys: List[str], how: str = 'intersection') \
+        -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Find the peptides which are found in all (intersection) or any (union) of the conditions.
+
+    The membership of every peptide is found in one pass over all the conditions. The data of each matching peptide is
+    taken from the first condition, and the first row within that condition, in which it is found.
+    :param conditions: The dictionary with the condition name and the hit list of the condition.
+    :param keys: The columns identifying a peptide, e.g. sequence, modifications and start position.
+    :param how: 'intersection' for peptides found in all conditions or 'union' for peptides found in any condition.
+    :return: The tuple containing the matching hits and the presence matrix for all peptides.
+    """
+    if how not in ('intersection', 'union'):
+        raise ValueError(f"'how' must be 'intersection' or 'union', not '{how}'.")
+
+    presence, first_rows, found = _presence(conditions, keys)
+    matching: np.ndarray = found.all(axis=1) if how == 'intersection' else found.any(axis=1)
+    # Get the first row of each matching peptide in the condition order
+    all_hits: pd.DataFrame = concat_peptides(conditions.values())
+    hit_list: pd.DataFrame = all_hits.iloc[np.sort(first_rows[matching])].reset_index(drop=True)
+    return hit_list, presence
+
+
+def _presence(conditions: Dict[str, pd.DataFrame], keys: List[str]) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """
+    Find the conditions of every unique peptide from the integer keys of the peptides.
+    :param conditions: The dictionary with the condition name and the hit list of the condition.
+    :param keys: The columns identifying a peptide.
+    :return: The tuple containing the presence matrix sorted by the key values, and for every unique peptide in the
+        order of its key the first row in the concatenated hit lists and whether it is found in each condition.
+    """
+    tables: List[pd.DataFrame] = list(conditions.values())
+    condition_keys: List[np.ndarray] = peptide_keys(tables, keys)
+    all_keys: np.ndarray = np.concatenate(condition_keys) if tables else np.zeros(0, dtype=np.int64)
+    condition_idx: np.ndarray = np.repeat(np.arange(len(tables)), [len(table) for table in tables])
+
+    rows: np.ndarray = np.flatnonzero(all_keys >= 0)
+    _, first_idx, peptide_idx = np.unique(all_keys[rows], return_index=True, return_inverse=True)
+    found: np.ndarray = np.zeros((first_idx.size, len(tables)), dtype=bool)
+    found[peptide_idx.ravel(), condition_idx[rows]] = True
+    first_rows: np.ndarray = rows[first_idx]
+
+    key_values: pd.DataFrame = pd.concat([table[keys] for table in tables], ignore_index=True).iloc[first_rows] \
+        if tables else pd.DataFrame(columns=keys)
+    index: pd.Index = pd.MultiIndex.from_frame(key_values) if len(keys) > 1 else pd.Index(key_values[keys[0]],
+                                                                                           name=keys[0])
+    presence: pd.DataFrame = pd.DataFrame(found, index=index, columns=list(conditions)).sort_index()
+    return presence, first_rows, found
+
+
+def venn_subset_sizes(presence: pd.DataFrame) -> Dict[str, int]:
+    """
+    Count the peptides in each region of a Venn diagram of the presence matrix.
+    :param presence: The presence matrix from build_presence_matrix.
+    :return: The dictionary with the region id, e.g. '101' for the first and third condition only, and the number of
+        peptides in the region. The format matches the subsets accepted by matplotlib_venn.venn2 and venn3.
+    """
+    region_ids: pd.Series = presence.astype(int).astype(str).agg(''.join, axis=1)
+    return region_ids.value_counts().to_dict()
@@ -0,0 +1,302 @@
+"""
+Description: Stage timers, row counts, peak memory and optional profiling of the workflow scripts
+"""
+
+# Import packages
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Union
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# The interval in seconds at which the RSS is sampled on platforms where the peak RSS cannot be reset
+SAMPLE_INTERVAL = 0.005
+
+
+class StageRecord:
+    """
+    The measurements of a stage. The rows are set by the code running the stage. The RSS is measured at the start and
+    the end of the stage, and the peak RSS is the highest RSS during the stage.
+    """
+    __slots__ = ('stage', 'seconds', 'rows', 'start_rss_mb', 'end_rss_mb', 'delta_rss_mb', 'peak_rss_mb',
+                 'traced_peak_mb')
+
+    def __init__(self, stage: str):
+        self.stage: str = stage
+        self.seconds: float = 0.0
+        self.rows: Union[int, None] = None
+        self.start_rss_mb: Union[float, None] = None
+        self.end_rss_mb: Union[float, None] = None
+        self.delta_rss_mb: Union[float, None] = None
+        self.peak_rss_mb: Union[float, None] = None
+        self.traced_peak_mb: Union[float, None] = None
+
+    def to_dict(self) -> dict:
+        """
+        Get the measurements as a dictionary.
+        :return: The dictionary.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# The record of the stages when the instrumentation is disabled, which is never stored
+_DISABLED_RECORD = StageRecord('disabled')
+
+
+class Instrumentation:
+    """
+    The instrumentation of a run. Every stage is timed with a context manager, e.g.
+
+        with instrumentation.stage('parse') as stage:
+            peptides = read_tandem_result_file(tandem_file)
+            stage.rows = len(peptides)
+
+    When disabled, stage only returns a shared record, so the instrumentation can be left in the code.
+    """
+
+    def __init__(self, name: str, enabled: bool = True, verbose: bool = False, profile: bool = False,
+                 trace_memory: bool = False):
+        """
+        :param name: The name of the run, e.g. the script or the sample.
+        :param enabled: Whether the stages are measured.
+        :param verbose: Whether the measurements are printed at the end of each stage.
+        :param profile: Whether the run is profiled with cProfile.
+        :param trace_memory: Whether the Python allocations are traced with tracemalloc, which is slow.
+        """
+        self.name: str = name
+        self.enabled: bool = enabled
+        self.verbose: bool = verbose
+        self.records: List[StageRecord] = []
+        self.started: str = datetime.now().isoformat(timespec='seconds')
+        self._start_time: float = time.perf_counter()
+        self._profiler: Union[cProfile.Profile, None] = cProfile.Profile() if enabled and profile else None
+        self._trace_memory: bool = enabled and trace_memory
+        if self._profiler is not None:
+            self._profiler.enable()
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[StageRecord]:
+        """
+        Measure a stage.
+        :param stage: The name of the stage.
+        :return: The record of the stage, where the number of output rows can be set.
+        """
+        if not self.enabled:
+            yield _DISABLED_RECORD
+            return
+
+        record: StageRecord = StageRecord(stage)
+        if self._trace_memory:
+            tracemalloc.reset_peak()
+        record.start_rss_mb = current_rss_mb()
+        stage_peak: _StagePeak = _StagePeak()
+        start_time: float = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = round(time.perf_counter() - start_time, 6)
+            record.end_rss_mb = current_rss_mb()
+            record.peak_rss_mb = stage_peak.stop()
+            if record.start_rss_mb is not None and record.end_rss_mb is not None:
+                record.delta_rss_mb = round(record.end_rss_mb - record.start_rss_mb, 3)
+                record.peak_rss_mb = max(record.peak_rss_mb or 0.0, record.start_rss_mb, record.end_rss_mb)
+            if self._trace_memory:
+                record.traced_peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+            self.records.append(record)
+            if self.verbose:
+                rows: str = '' if record.rows is None else f", {record.rows} rows"
+                memory: str = '' if record.peak_rss_mb is None else f", peak RSS {round(record.peak_rss_mb)} MB"
+                if record.delta_rss_mb is not None:
+                    memory += f" ({record.delta_rss_mb:+.0f} MB)"
+                print(f"[{self.name}] {stage}: {round(record.seconds, 2)} s{rows}{memory}")
+
+    def stop(self):
+        """
+        Stop the profiling and the memory tracing.
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def report(self, top: int = 30) -> dict:
+        """
+        Create the report of the run.
+        :param top: The number of functions with the highest cumulative time in the profile.
+        :return: The report.
+        """
+        report: dict = {'name': self.name, 'started': self.started,
+                        'total_seconds': round(time.perf_counter() - self._start_time, 6),
+                        'process_peak_rss_mb': peak_rss_mb(), 'stages': [record.to_dict() for record in self.records]}
+        if self._profiler is not None:
+            report['profile'] = profile_summary(self._profiler, top=top)
+        return report
+
+    def write_report(self, report_filepath: str, top: int = 30) -> dict:
+        """
+        Stop the instrumentation and write the report of the run to a JSON file.
+        :param report_filepath: The path to the JSON file.
+        :param top: The number of functions with the highest cumulative time in the profile.
+        :return: The report.
+        """
+        self.stop()
+        report: dict = self.report(top=top)
+        with open(report_filepath, 'w') as report_file:
+            json.dump(report, report_file, indent=1)
+        return report
+
+
+def current_rss_mb() -> Union[float, None]:
+    """
+    Get the current resident set size of the process in MB.
+    :return: The RSS. None if it cannot be measured on this platform.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm_file:
+            return round(int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 3)
+    except (OSError, ValueError, AttributeError, IndexError):
+        pass
+    if psutil is not None:
+        return round(psutil.Process().memory_info().rss / 2 ** 20, 3)
+    return None
+
+
+def peak_rss_mb() -> Union[float, None]:
+    """
+    Get the peak resident set size of the process in MB since it started, including the peaks before the stages reset
+    the peak RSS.
+    :return: The peak RSS. None if it cannot be measured on this platform.
+    """
+    peak: Union[float, None] = None
+    if resource is not None:
+        # ru_maxrss is in kB on Linux and in bytes on macOS
+        max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = round(max_rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 3)
+    elif psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        # Windows reports the peak working set, other platforms only the current RSS
+        peak = round(getattr(memory_info, 'peak_wset', memory_info.rss) / 2 ** 20, 3)
+    if _StagePeak.peak_before_reset is not None:
+        peak = max(peak or 0.0, _StagePeak.peak_before_reset)
+    return peak
+
+
+class _StagePeak:
+    """
+    The peak RSS of the process during a stage. On Linux the peak RSS of the process (VmHWM) is reset at the start of
+    the stage and read at the end. Elsewhere the RSS is sampled in a thread, which can miss short spikes.
+    """
+    # The peak RSS of the process before the last reset, which is otherwise lost
+    peak_before_reset: Union[float, None] = None
+    # The stages which are running, whose peak must survive the reset by a nested stage
+    _running: List['_StagePeak'] = []
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.peak_mb: Union[float, None] = None
+        self._stop_event: Union[threading.Event, None] = None
+        self._thread: Union[threading.Thread, None] = None
+        with _StagePeak._lock:
+            self._resettable: bool = _reset_peak_rss()
+            _StagePeak._running.append(self)
+        if not self._resettable and current_rss_mb() is not None:
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._sample, name='StagePeakRSS', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> Union[float, None]:
+        """
+        Stop measuring.
+        :return: The peak RSS during the stage in MB. None if it cannot be measured on this platform.
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+        with _StagePeak._lock:
+            if self._resettable:
+                self._update(_read_vm_hwm_mb())
+            _StagePeak._running.remove(self)
+        return self.peak_mb
+
+    def _sample(self):
+        """
+        Sample the RSS until the stage stops.
+        """
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            self._update(current_rss_mb())
+
+    def _update(self, rss_mb: Union[float, None]):
+        """
+        Raise the peak to the RSS.
+        :param rss_mb: The RSS in MB.
+        """
+        if rss_mb is not None:
+            self.peak_mb = rss_mb if self.peak_mb is None else max(self.peak_mb, rss_mb)
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS of the process on Linux. The peak before the reset is kept for peak_rss_mb and for the stages
+    which are running. Must be called with the lock of _StagePeak.
+    :return: True if the peak RSS was reset.
+    """
+    peak_mb: Union[float, None] = _read_vm_hwm_mb()
+    if peak_mb is None:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+    except OSError:
+        return False
+    _StagePeak.peak_before_reset = max(_StagePeak.peak_before_reset or 0.0, peak_mb)
+    for stage_peak in _StagePeak._running:
+        stage_peak._update(peak_mb)
+    return True
+
+
+def _read_vm_hwm_mb() -> Union[float, None]:
+    """
+    Read the peak RSS of the process since the last reset on Linux.
+    :return: The peak RSS in MB. None if it cannot be read.
+    """
+    try:
+        with open('/proc/self/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 2 ** 10, 3)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def profile_summary(profiler: cProfile.Profile, top: int = 30) -> List[dict]:
+    """
+    Summarise a profile by the functions with the highest cumulative time.
+    :param profiler: The profiler.
+    :param top: The number of functions.
+    :return: The functions with the number of calls and the total and cumulative time.
+    """
+    stats: pstats.Stats = pstats.Stats(profiler, stream=io.StringIO())
+    functions: list = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+    return [{'function': f"{filename}:{line}({function_name})", 'calls': calls, 'total_seconds': round(total, 6),
+             'cumulative_seconds': round(cumulative, 6)}
+            for (filename, line, function_name), (_, calls, total, cumulative, _) in functions]
@@ -0,0 +1,55 @@
+"""
+Description: Calculate the all-14N and all-15N masses of peptides
+"""
+
+# Import packages
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+from pyteomics import mass
+
+from ModificationRegistry import STANDARD_REGISTRY, ModificationRegistry
+
+# The mass difference between 15N and 14N, between 13C and 12C and the proton mass
+N15_DELTA: float = mass.nist_mass['N'][15][0] - mass.nist_mass['N'][14][0]
+C13_DELTA: float = mass.nist_mass['C'][13][0] - mass.nist_mass['C'][12][0]
+PROTON_MASS: float = mass.nist_mass['H+'][0][0]
+
+
+@lru_cache(maxsize=None)
+def calculate_neutral_masses(sequence: str,
+                             registry: ModificationRegistry = STANDARD_REGISTRY) -> Tuple[float, float]:
+    """
+    Calculate the monoisotopic mass of the peptide with only 14N and only 15N. The 15N mass is the 14N mass plus the
+    number of nitrogen atoms times the mass difference between 15N and 14N. The result is cached by sequence and
+    registry.
+    :param sequence: The (modified) sequence.
+    :param registry: The modified residues of the sequence. Default no modifications.
+    :return: The tuple containing the 14N and the 15N mass.
+    """
+    composition = mass.Composition(sequence=sequence, aa_comp=registry.aa_comp)
+    n14_mass: float = mass.calculate_mass(composition=composition)
+    n15_mass: float = n14_mass + composition['N'] * N15_DELTA
+    return n14_mass, n15_mass
+
+
+def calculate_mz(sequence: str, charges: np.ndarray,
+                 registry: ModificationRegistry = STANDARD_REGISTRY) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the 14N and 15N m/z of the peptide for several charges at once.
+    :param sequence: The (modified) sequence.
+    :param charges: The charges.
+    :param registry: The modified residues of the sequence. Default no modifications.
+    :return: The tuple containing the 14N and 15N m/z for each charge.
+    """
+    n14_mass, n15_mass = calculate_neutral_masses(sequence, registry)
+    charges = np.asarray(charges, dtype=np.float64)
+    return (n14_mass + charges * PROTON_MASS) / charges, (n15_mass + charges * PROTON_MASS) / charges
+
+
+def clear_cache():
+    """
+    Clear the cached masses, e.g. to free the memory of the masses of many sequences.
+    """
+    calculate_neutral_masses.cache_clear()
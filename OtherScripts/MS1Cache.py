@@ -0,0 +1,204 @@
+"""
+Description: On-disk cache of the decoded MS1 scans of mzXML files
+"""
+
+# Import packages
+import json
+import os
+import shutil
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from FileDigest import file_digest
+from MS1Index import MS1Index
+from MzXMLReader import iter_ms1_scans
+from ScanPreprocessing import PreprocessingSettings, preprocess_scans, summarise_peak_counts
+
+CACHE_VERSION = 3
+
+
+def open_ms1_scans(mzxml_filepath: str, cache_dir: Union[str, None] = None,
+                   preprocessing: Union[PreprocessingSettings, None] = None) \
+        -> Iterable[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Open the MS1 scans of a mzXML file, either by streaming the file or from the cache.
+    :param mzxml_filepath: The path to the mzXML.
+    :param cache_dir: The cache directory. If None, the scans are streamed from the mzXML file.
+    :param preprocessing: The settings for centroiding the scans and removing the noise. If None, the raw scans are
+        used.
+    :return: The MS1 scans as tuples containing the scan number, the retention time and the m/z and intensity arrays.
+    """
+    if cache_dir is None:
+        if preprocessing is None:
+            return iter_ms1_scans(mzxml_filepath)
+        return _stream_preprocessed_scans(mzxml_filepath, preprocessing=preprocessing)
+    return load_ms1_index(mzxml_filepath, cache_dir=cache_dir, preprocessing=preprocessing)
+
+
+def load_ms1_index(mzxml_filepath: str, cache_dir: str,
+                   preprocessing: Union[PreprocessingSettings, None] = None) -> MS1Index:
+    """
+    Load the MS1 index of a mzXML file from the cache. The cache entry is created on the first call by decoding the
+    file once. The peak arrays are memory mapped, so the peaks of a scan are read from disk when used. The preprocessed
+    scans are stored in their own entry for each preprocessing setting.
+    :param mzxml_filepath: The path to the mzXML.
+    :param cache_dir: The cache directory.
+    :param preprocessing: The settings for centroiding the scans and removing the noise. If None, the raw scans are
+        used.
+    :return: The MS1 index.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    digest: str = file_digest(mzxml_filepath, cache_dir=cache_dir)
+    entry_dir: str = os.path.join(cache_dir, digest if preprocessing is None else f"{digest}-{preprocessing.key()}")
+
+    ms1_index: Union[MS1Index, None] = _open_entry(entry_dir, digest=digest, preprocessing=preprocessing)
+    if ms1_index is None:
+        print(f"\tCaching the MS1 scans of {mzxml_filepath}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        _write_entry(mzxml_filepath, entry_dir=entry_dir, digest=digest, preprocessing=preprocessing)
+        ms1_index = _open_entry(entry_dir, digest=digest, preprocessing=preprocessing)
+    return ms1_index
+
+
+def _stream_preprocessed_scans(mzxml_filepath: str, preprocessing: PreprocessingSettings) \
+        -> Iterator[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Stream the preprocessed MS1 scans of a mzXML file and print the number of peaks before and after the preprocessing.
+    :param mzxml_filepath: The path to the mzXML.
+    :param preprocessing: The preprocessing settings.
+    :return: The iterator over the preprocessed scans.
+    """
+    peak_counts: List[Tuple[int, int]] = []
+    yield from preprocess_scans(iter_ms1_scans(mzxml_filepath), preprocessing, peak_counts=peak_counts)
+    print(f"\tPreprocessed {summarise_peak_counts(peak_counts)}")
+
+
+def _write_entry(mzxml_filepath: str, entry_dir: str, digest: str,
+                 preprocessing: Union[PreprocessingSettings, None] = None):
+    """
+    Decode the MS1 scans of the mzXML file and write them to a cache entry. The peaks are appended to the peak files
+    scan by scan, sorted by m/z, and the entry is moved into place when it is complete. Scans which are not in
+    retention time order are sorted once here, so the entry can always be opened without copying the peaks.
+    :param mzxml_filepath: The path to the mzXML.
+    :param entry_dir: The directory of the cache entry.
+    :param digest: The digest of the mzXML file.
+    :param preprocessing: The preprocessing settings of the scans. If None, the raw scans are written.
+    """
+    temporary_dir: str = f"{entry_dir}.tmp{os.getpid()}"
+    os.makedirs(temporary_dir, exist_ok=True)
+
+    scan_ids: list = []
+    rts: list = []
+    peak_counts: list = []
+    scans: Iterable[Tuple[str, float, np.ndarray, np.ndarray]] = iter_ms1_scans(mzxml_filepath)
+    preprocessed_counts: List[Tuple[int, int]] = []
+    if preprocessing is not None:
+        scans = preprocess_scans(scans, preprocessing, peak_counts=preprocessed_counts)
+    with open(os.path.join(temporary_dir, 'mz.bin'), 'wb') as mz_file, \
+            open(os.path.join(temporary_dir, 'intensity.bin'), 'wb') as intensity_file:
+        for scan_id, rt, mz, intensity in scans:
+            mz = np.asarray(mz, dtype=np.float64)
+            intensity = np.asarray(intensity, dtype=np.float64)
+            if np.any(np.diff(mz) < 0):
+                peak_order: np.ndarray = np.argsort(mz, kind='mergesort')
+                mz, intensity = mz[peak_order], intensity[peak_order]
+            scan_ids.append(scan_id)
+            rts.append(rt)
+            peak_counts.append(mz.size)
+            mz_file.write(np.ascontiguousarray(mz).tobytes())
+            intensity_file.write(np.ascontiguousarray(intensity).tobytes())
+
+    offsets: np.ndarray = np.zeros(len(peak_counts) + 1, dtype=np.int64)
+    np.cumsum(peak_counts, out=offsets[1:])
+    if np.any(np.diff(rts) < 0):
+        scan_ids, rts, offsets = _sort_entry_scans(temporary_dir, scan_ids, rts, offsets)
+    np.save(os.path.join(temporary_dir, 'scan_ids.npy'), np.array(scan_ids, dtype=str))
+    np.save(os.path.join(temporary_dir, 'rts.npy'), np.array(rts, dtype=np.float64))
+    np.save(os.path.join(temporary_dir, 'offsets.npy'), offsets)
+    with open(os.path.join(temporary_dir, 'meta.json'), 'w') as meta_file:
+        json.dump({'version': CACHE_VERSION, 'sha256': digest, 'scans': len(scan_ids), 'peaks': int(offsets[-1]),
+                   'preprocessing': preprocessing.to_dict() if preprocessing is not None else None},
+                  meta_file, indent=1)
+    if preprocessing is not None:
+        print(f"\tPreprocessed {summarise_peak_counts(preprocessed_counts)}")
+    try:
+        os.replace(temporary_dir, entry_dir)
+    except OSError:
+        # Another run has created the entry in the meantime
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+
+
+def _sort_entry_scans(entry_dir: str, scan_ids: list, rts: list, offsets: np.ndarray) \
+        -> Tuple[list, list, np.ndarray]:
+    """
+    Rewrite the peak files of an entry with the scans in retention time order. The peaks are copied scan by scan from
+    the memory mapped files, so only one scan is held in memory.
+    :param entry_dir: The directory of the entry being written.
+    :param scan_ids: The scan numbers in file order.
+    :param rts: The retention times in file order.
+    :param offsets: The peak offsets in file order.
+    :return: The tuple containing the scan numbers, the retention times and the peak offsets in retention time order.
+    """
+    rt_order: np.ndarray = np.argsort(np.asarray(rts, dtype=np.float64), kind='mergesort')
+    for peak_filename in ('mz.bin', 'intensity.bin'):
+        peak_filepath: str = os.path.join(entry_dir, peak_filename)
+        peaks: np.ndarray = _open_peak_file(peak_filepath, int(offsets[-1]))
+        with open(f"{peak_filepath}.sorted", 'wb') as sorted_file:
+            for scan_idx in rt_order:
+                sorted_file.write(peaks[offsets[scan_idx]:offsets[scan_idx + 1]].tobytes())
+        del peaks
+        os.replace(f"{peak_filepath}.sorted", peak_filepath)
+
+    sorted_offsets: np.ndarray = np.zeros(offsets.size, dtype=np.int64)
+    np.cumsum(np.diff(offsets)[rt_order], out=sorted_offsets[1:])
+    return [scan_ids[idx] for idx in rt_order], [rts[idx] for idx in rt_order], sorted_offsets
+
+
+def _open_entry(entry_dir: str, digest: str,
+                preprocessing: Union[PreprocessingSettings, None] = None) -> Union[MS1Index, None]:
+    """
+    Open and validate a cache entry.
+    :param entry_dir: The directory of the cache entry.
+    :param digest: The digest of the mzXML file.
+    :param preprocessing: The expected preprocessing settings of the scans. If None, the scans must be raw.
+    :return: The MS1 index. None if the entry does not exist or is invalid.
+    """
+    meta_filepath: str = os.path.join(entry_dir, 'meta.json')
+    if not os.path.exists(meta_filepath):
+        return None
+    try:
+        with open(meta_filepath, 'r') as meta_file:
+            meta: dict = json.load(meta_file)
+        if meta['version'] != CACHE_VERSION or meta['sha256'] != digest or \
+                meta.get('preprocessing') != (preprocessing.to_dict() if preprocessing is not None else None):
+            return None
+
+        scan_ids: np.ndarray = np.load(os.path.join(entry_dir, 'scan_ids.npy'))
+        rts: np.ndarray = np.load(os.path.join(entry_dir, 'rts.npy'))
+        offsets: np.ndarray = np.load(os.path.join(entry_dir, 'offsets.npy'))
+        if not (scan_ids.size == rts.size == offsets.size - 1 == meta['scans'] and offsets[-1] == meta['peaks']):
+            return None
+        mz: np.ndarray = _open_peak_file(os.path.join(entry_dir, 'mz.bin'), meta['peaks'])
+        intensity: np.ndarray = _open_peak_file(os.path.join(entry_dir, 'intensity.bin'), meta['peaks'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # The scans are sorted by retention time when the entry is written
+    if np.any(np.diff(rts) < 0):
+        return None
+    return MS1Index(scan_ids=scan_ids, rts=rts, offsets=offsets, mz=mz, intensity=intensity)
+
+
+def _open_peak_file(filepath: str, n_peaks: int) -> np.ndarray:
+    """
+    Memory map a peak file.
+    :param filepath: The path to the peak file.
+    :param n_peaks: The expected number of peaks.
+    :return: The read-only memory mapped array.
+    """
+    if os.path.getsize(filepath) != n_peaks * np.dtype(np.float64).itemsize:
+        raise ValueError(f"{filepath} does not contain {n_peaks} peaks.")
+    if n_peaks == 0:
+        return np.empty(0)
+    return np.memmap(filepath, dtype=np.float64, mode='r', shape=(n_peaks,))
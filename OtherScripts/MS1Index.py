@@ -0,0 +1,133 @@
+"""
+Description: Retention time index of the MS1 scans in a run
+"""
+
+# Import packages
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+from MzXMLReader import iter_ms1_scans
+
+
+class MS1Index:
+    """
+    The MS1 scans of a run sorted by retention time. The peaks of all scans are stored in two concatenated arrays sorted
+    by m/z within each scan, and the peaks of scan i are found between offsets[i] and offsets[i + 1].
+    """
+
+    def __init__(self, scan_ids: np.ndarray, rts: np.ndarray, offsets: np.ndarray, mz: np.ndarray,
+                 intensity: np.ndarray):
+        """
+        Create the index from the scan table and the concatenated peak arrays.
+        :param scan_ids: The scan numbers.
+        :param rts: The retention times of the scans in seconds (sorted ascending).
+        :param offsets: The offset of the first peak of each scan followed by the total number of peaks.
+        :param mz: The m/z values of all the peaks.
+        :param intensity: The intensities of all the peaks.
+        """
+        self.scan_ids = scan_ids
+        self.rts = rts
+        self.offsets = offsets
+        self.mz = mz
+        self.intensity = intensity
+
+    @classmethod
+    def from_scans(cls, scans: Iterable[Tuple[str, float, np.ndarray, np.ndarray]]) -> 'MS1Index':
+        """
+        Create the index from MS1 scans.
+        :param scans: The scans as tuples containing the scan number, the retention time and the m/z and intensity
+            arrays.
+        :return: The index.
+        """
+        scan_ids: list = []
+        rts: list = []
+        mz_arrays: list = []
+        intensity_arrays: list = []
+        for scan_id, rt, mz, intensity in scans:
+            mz = np.asarray(mz, dtype=np.float64)
+            intensity = np.asarray(intensity, dtype=np.float64)
+            # Sort the peaks by m/z
+            order = np.argsort(mz, kind='mergesort')
+            scan_ids.append(str(scan_id))
+            rts.append(rt)
+            mz_arrays.append(mz[order])
+            intensity_arrays.append(intensity[order])
+
+        # Sort the scans by retention time
+        rt_order = np.argsort(np.asarray(rts, dtype=np.float64), kind='mergesort')
+        peak_counts = np.array([mz_arrays[idx].size for idx in rt_order], dtype=np.int64)
+        offsets = np.zeros(len(rt_order) + 1, dtype=np.int64)
+        np.cumsum(peak_counts, out=offsets[1:])
+        return cls(scan_ids=np.array([scan_ids[idx] for idx in rt_order], dtype=str),
+                   rts=np.asarray(rts, dtype=np.float64)[rt_order],
+                   offsets=offsets,
+                   mz=np.concatenate([mz_arrays[idx] for idx in rt_order]) if len(rt_order) else np.empty(0),
+                   intensity=np.concatenate([intensity_arrays[idx] for idx in rt_order]) if len(rt_order)
+                   else np.empty(0))
+
+    @classmethod
+    def from_mzxml(cls, mzxml_filepath: str) -> 'MS1Index':
+        """
+        Create the index from the MS1 scans of a mzXML file.
+        :param mzxml_filepath: The path to the mzXML.
+        :return: The index.
+        """
+        return cls.from_scans(iter_ms1_scans(mzxml_filepath))
+
+    def __len__(self) -> int:
+        return self.rts.size
+
+    def __iter__(self) -> Iterator[Tuple[str, float, np.ndarray, np.ndarray]]:
+        """
+        Iterate over the scans in retention time order in the same format as MzXMLReader.iter_ms1_scans.
+        :return: The iterator over tuples containing the scan number, the retention time and the m/z and intensity
+            arrays.
+        """
+        for scan_index in range(len(self)):
+            yield (self.scan_ids[scan_index], float(self.rts[scan_index])) + self.peaks(scan_index)
+
+    def peaks(self, scan_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the peaks of a scan.
+        :param scan_index: The index of the scan in the retention time order.
+        :return: The tuple containing the m/z and intensity arrays of the scan.
+        """
+        start, end = self.offsets[scan_index], self.offsets[scan_index + 1]
+        return self.mz[start:end], self.intensity[start:end]
+
+    def find_scans(self, rts: np.ndarray, rt_tolerance: float) -> np.ndarray:
+        """
+        Find the scans closest to the given retention times using binary search.
+        :param rts: The retention times in seconds.
+        :param rt_tolerance: The maximum difference in seconds between the retention time and the scan.
+        :return: The index of the closest scan for each retention time. -1 if no scan is within the tolerance.
+        """
+        return find_nearest(self.rts, np.asarray(rts, dtype=np.float64), rt_tolerance)
+
+    def find_scan(self, rt: float, rt_tolerance: float) -> int:
+        """
+        Find the scan closest to the given retention time using binary search.
+        :param rt: The retention time in seconds.
+        :param rt_tolerance: The maximum difference in seconds between the retention time and the scan.
+        :return: The index of the closest scan. -1 if no scan is within the tolerance.
+        """
+        return int(self.find_scans(np.array([rt]), rt_tolerance)[0])
+
+
+def find_nearest(values: np.ndarray, targets: np.ndarray, tolerance) -> np.ndarray:
+    """
+    Find the nearest value for each target in a sorted array, in the same way as MSSpectrum.findNearest.
+    :param values: The sorted values, e.g. the m/z values of a scan.
+    :param targets: The target values.
+    :param tolerance: The maximum distance between the target and the value. Either a scalar or one per target.
+    :return: The index of the nearest value for each target. -1 if no value is within the tolerance.
+    """
+    if values.size == 0:
+        return np.full(targets.shape, -1, dtype=np.int64)
+    # Compare the values to the left and right of the insertion point
+    right = np.clip(np.searchsorted(values, targets), 0, values.size - 1)
+    left = np.clip(right - 1, 0, values.size - 1)
+    use_left = np.abs(targets - values[left]) <= np.abs(values[right] - targets)
+    nearest = np.where(use_left, left, right)
+    return np.where(np.abs(values[nearest] - targets) <= tolerance, nearest, -1)
@@ -0,0 +1,105 @@
+"""
+Description: Immutable registry of the modified residues used for the modified sequences and the masses
+"""
+
+# Import packages
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pyteomics import mass
+
+# The default tolerance in Da for matching the modification masses of the search results
+MASS_TOLERANCE: float = 0.01
+
+
+@dataclass(frozen=True)
+class Modification:
+    """
+    A modified residue, which is written as the prefix followed by the residue in modified sequences, e.g. 'oxM'.
+    """
+    prefix: str
+    residue: str
+    mass: float
+    # The elemental composition added to the residue as sorted (element, count) pairs
+    composition: Tuple[Tuple[str, int], ...]
+
+
+@dataclass(frozen=True)
+class ModificationRegistry:
+    """
+    The modified residues. The registry is immutable and hashable, so it can be used as a cache key and sent to worker
+    processes. The amino acid compositions including the modified residues and the mass lookup are created once when
+    the registry is created.
+    """
+    modifications: Tuple[Modification, ...] = ()
+    tolerance: float = MASS_TOLERANCE
+    _aa_comp: Dict[str, mass.Composition] = field(init=False, repr=False, compare=False)
+    _masses: Dict[str, Tuple[np.ndarray, Tuple[str, ...]]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        aa_comp: Dict[str, mass.Composition] = dict(mass.std_aa_comp)
+        for modification in self.modifications:
+            aa_comp[f"{modification.prefix}{modification.residue}"] = \
+                mass.std_aa_comp[modification.residue] + mass.Composition(dict(modification.composition))
+
+        # The modification masses of each residue sorted by mass
+        masses: Dict[str, Tuple[np.ndarray, Tuple[str, ...]]] = {}
+        for residue in sorted({modification.residue for modification in self.modifications}):
+            residue_modifications = sorted([modification for modification in self.modifications
+                                            if modification.residue == residue], key=lambda mod: mod.mass)
+            masses[residue] = (np.array([modification.mass for modification in residue_modifications]),
+                               tuple(modification.prefix for modification in residue_modifications))
+        object.__setattr__(self, '_aa_comp', aa_comp)
+        object.__setattr__(self, '_masses', masses)
+
+    def __getstate__(self) -> dict:
+        # The lookups are recreated when unpickled
+        return {'modifications': self.modifications, 'tolerance': self.tolerance}
+
+    def __setstate__(self, state: dict):
+        object.__setattr__(self, 'modifications', state['modifications'])
+        object.__setattr__(self, 'tolerance', state['tolerance'])
+        self.__post_init__()
+
+    @classmethod
+    def from_csv(cls, mod_csv_filepath: str, tolerance: float = MASS_TOLERANCE) -> 'ModificationRegistry':
+        """
+        Create the registry from a modification CSV with the columns 'Prefix', 'Residue', 'Composition' and 'Mass'.
+        :param mod_csv_filepath: The path to the modification CSV.
+        :param tolerance: The tolerance in Da for matching the modification masses. Default 0.01.
+        :return: The registry.
+        """
+        mod_csv: pd.DataFrame = pd.read_csv(filepath_or_buffer=mod_csv_filepath)
+        modifications = tuple(Modification(prefix=str(prefix), residue=str(residue), mass=float(mod_mass),
+                                            composition=tuple(sorted(mass.Composition(formula=formula).items())))
+                              for prefix, residue, formula, mod_mass
+                              in zip(mod_csv['Prefix'], mod_csv['Residue'], mod_csv['Composition'], mod_csv['Mass']))
+        return cls(modifications=modifications, tolerance=tolerance)
+
+    @property
+    def aa_comp(self) -> Dict[str, mass.Composition]:
+        """
+        The amino acid compositions including the modified residues, which must not be changed.
+        """
+        return self._aa_comp
+
+    def find_prefix(self, residue: str, modification_mass: float) -> Union[str, None]:
+        """
+        Find the modification of a residue with the closest mass within the tolerance.
+        :param residue: The residue.
+        :param modification_mass: The mass change of the modification.
+        :return: The prefix of the modification. None if the residue has no modification with the mass.
+        """
+        if residue not in self._masses:
+            return None
+        masses, prefixes = self._masses[residue]
+        closest: int = int(np.argmin(np.abs(masses - modification_mass)))
+        if abs(masses[closest] - modification_mass) > self.tolerance:
+            return None
+        return prefixes[closest]
+
+
+# The registry without modifications
+STANDARD_REGISTRY = ModificationRegistry()
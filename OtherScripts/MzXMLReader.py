@@ -0,0 +1,92 @@
+"""
+Description: Streaming reader for the MS1 scans in mzXML files
+"""
+
+# Import packages
+import base64
+import re
+import zlib
+from typing import Iterator, Tuple
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+
+DURATION_PATTERN = re.compile(r'^-?P(?:T)?(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?$')
+
+
+def iter_ms1_scans(mzxml_filepath: str) -> Iterator[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Read the MS1 scans of a mzXML file one at a time. Only the peaks of MS1 scans are decoded and every scan is
+    discarded once it has been read, so the memory use does not depend on the size of the file.
+    :param mzxml_filepath: The path to the mzXML.
+    :return: The iterator over tuples containing the scan number, the retention time in seconds and the m/z and
+        intensity arrays sorted by m/z.
+    """
+    # The open scans and elements, as scans can be nested in other scans
+    scans: list = []
+    elements: list = []
+    for event, element in iterparse(mzxml_filepath, events=('start', 'end')):
+        tag = _local_name(element.tag)
+        if event == 'start':
+            elements.append(element)
+            if tag == 'scan':
+                scans.append(element.attrib)
+            continue
+
+        elements.pop()
+        if tag == 'peaks' and scans and scans[-1].get('msLevel') == '1':
+            scan = scans[-1]
+            mz, intensity = _decode_peaks(element)
+            yield scan['num'], _parse_retention_time(scan.get('retentionTime', 'PT0S')), mz, intensity
+        elif tag == 'scan':
+            scans.pop()
+            # Discard the scan
+            element.clear()
+            if elements:
+                elements[-1].remove(element)
+
+
+def _local_name(tag: str) -> str:
+    """
+    Remove the namespace from a tag.
+    :param tag: The tag.
+    :return: The tag without namespace.
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_retention_time(retention_time: str) -> float:
+    """
+    Convert the retention time duration, e.g. 'PT123.4S', to seconds.
+    :param retention_time: The retention time as a xs:duration.
+    :return: The retention time in seconds.
+    """
+    match = DURATION_PATTERN.match(retention_time.strip())
+    if match is None:
+        raise ValueError(f"Could not parse the retention time '{retention_time}'.")
+    hours, minutes, seconds = (float(match.group(group) or 0) for group in ('hours', 'minutes', 'seconds'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _decode_peaks(peaks_element) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode the base64 encoded and possibly zlib compressed peaks of a scan.
+    :param peaks_element: The peaks element.
+    :return: The tuple containing the m/z and intensity arrays sorted by m/z.
+    """
+    attributes = peaks_element.attrib
+    if not peaks_element.text:
+        return np.empty(0), np.empty(0)
+    data: bytes = base64.b64decode(peaks_element.text)
+    if attributes.get('compressionType', 'none') == 'zlib':
+        data = zlib.decompress(data)
+    byte_order: str = '<' if attributes.get('byteOrder', 'network') == 'little' else '>'
+    precision: str = 'f8' if attributes.get('precision', '32') == '64' else 'f4'
+    pairs: np.ndarray = np.frombuffer(data, dtype=f"{byte_order}{precision}").reshape(-1, 2)
+
+    mz: np.ndarray = pairs[:, 0].astype(np.float64)
+    intensity: np.ndarray = pairs[:, 1].astype(np.float64)
+    if mz.size > 1 and np.any(mz[1:] < mz[:-1]):
+        order = np.argsort(mz, kind='mergesort')
+        mz, intensity = mz[order], intensity[order]
+    return mz, intensity
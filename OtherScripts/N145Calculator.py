@@ -3,134 +3,160 @@ Description: Calculate the ratio between 14N and 15N peaks
 """
 # Import packages
 import time
+from typing import Union
 
-from N145CalculatorUtilities import create_modified_sequence, create_modification_list, calculate_intensities, \
-    calculate_mass
+from N145CalculatorUtilities import create_modification_list, calculate_masses, calculate_peak_areas
+import numpy as np
 import pandas as pd
-import pyteomics
-from pyteomics import tandem
 
+from DomainMap import DomainMap, load_domain_map
+from Instrumentation import Instrumentation
+from MS1Cache import load_ms1_index
+from OutputWriter import write_table
+from ModificationRegistry import STANDARD_REGISTRY, ModificationRegistry
+from TandemReader import read_tandem_peptides
 
-def read_tandem_result_file(tandem_result_filepath: str) -> pd.DataFrame:
+
+def read_tandem_result_file(tandem_result_filepath: str, fdr: Union[float, None] = 0.05,
+                            parquet_filepath: Union[str, None] = None,
+                            registry: ModificationRegistry = STANDARD_REGISTRY) -> pd.DataFrame:
     """
     Read the X!Tandem result file.
     :param tandem_result_filepath: The X!Tandem result file file path.
+    :param fdr: The false discovery rate of the target-decoy filtering. If None, all the PSMs are kept. Default 0.05.
+    :param parquet_filepath: The Parquet file the peptides are also written to. If None, no file is written.
+    :param registry: The modified residues of the modified sequences. Default no modifications.
     :return: The peptide dataframe.
     """
-    # Create dataframe
-    peptide_df: pd.DataFrame = pd.DataFrame(columns=['Sequence', 'ModSequence', 'Charge', 'Start', 'End', 'RT',
-                                                     '14N mass', '14N mz (Thr)', '15N mass', '15N mz (Thr)',
-                                                     'Modifications'])
-    # Read tandem result file
-    tandem_result = pyteomics.tandem.filter(tandem_result_filepath, fdr=0.05)
-
-    for result in tandem_result:
-        for protein in result['protein']:
-            # Handle peptide modification
-            mod_sequence = protein['peptide']['seq']
-            modification_str = None
-            if 'aa' in protein['peptide']:
-                mod_sequence = create_modified_sequence(protein['peptide']['seq'], protein['peptide']['start'],
-                                                        protein['peptide']['aa'])
-
-                modification_str = ", ".join([f"{mod['type']}{mod['at']}@{mod['modified']}" for mod
-                                              in protein['peptide']['aa']])
-
-            # Add row with sequence to the dataframe
-            peptide_df = peptide_df.append(pd.DataFrame([[protein['peptide']['seq'], mod_sequence, result['z'],
-                                                          protein['peptide']['start'], protein['peptide']['end'],
-                                                          result['rt'], modification_str]],
-                                                        columns=['Sequence', 'ModSequence', 'Charge', 'Start', 'End',
-                                                                 'RT', 'Modifications']),
-                                           ignore_index=True)
-    peptide_df.to_excel('test.xlsx')
-
-    return peptide_df
-
-
-def setup_df(df: pd.DataFrame, min_mz: float) -> pd.DataFrame:
+    return read_tandem_peptides(tandem_result_filepath, fdr=fdr, parquet_filepath=parquet_filepath, registry=registry)
+
+
+def setup_df(df: pd.DataFrame, min_mz: float, domain_map: Union[DomainMap, None] = None,
+             registry: ModificationRegistry = STANDARD_REGISTRY,
+             debug_filepath: Union[str, None] = None) -> pd.DataFrame:
+    """
+    Remove the duplicated modified sequences and annotate the peptides.
+    :param df: The peptide dataframe.
+    :param min_mz: The minimum m/z.
+    :param domain_map: The domain map of the protein. If None, the domains of calreticulin are used.
+    :param registry: The modified residues of the modified sequences. Default no modifications.
+    :param debug_filepath: The path the peptides without duplicates are written to, e.g. 'filter_test.xlsx'. If None,
+        nothing is written.
+    :return: The annotated peptides without the modified sequence.
+    """
     # Clean the data
     df = df.drop_duplicates(subset=['ModSequence'], keep='first')
     df = df.reset_index(drop=True)
-    df.to_excel('filter_test.xlsx')
+    if debug_filepath is not None:
+        write_table(df, debug_filepath)
+    return annotate_peptides(df, min_mz, domain_map=domain_map, registry=registry)
+
+
+def annotate_peptides(df: pd.DataFrame, min_mz: float, domain_map: Union[DomainMap, None] = None,
+                      registry: ModificationRegistry = STANDARD_REGISTRY) -> pd.DataFrame:
+    """
+    Add the region and the 14N and 15N masses and m/z to the peptides, and remove the peptides below the minimum m/z.
+    :param df: The peptide dataframe.
+    :param min_mz: The minimum m/z.
+    :param domain_map: The domain map of the protein. If None, the domains of calreticulin are used.
+    :param registry: The modified residues of the modified sequences. Default no modifications.
+    :return: The annotated peptides without the modified sequence.
+    """
+    df = df.copy()
     # Add region information
-    df['StartEnd'] = df.apply(lambda x: (x['Start'], x['End']), axis=1)
-    df['Region'] = df['StartEnd'].map(get_region)
+    df['Region'] = pd.Categorical(get_regions(df['Start'].to_numpy(), df['End'].to_numpy(), domain_map=domain_map))
     # Calculate the 14N and 15N masses along with m/z
-    df['SeqCharge'] = df.apply(lambda x: (x['ModSequence'], x['Charge'], min_mz), axis=1)
-    df['14N mass'], df['14N mz (Thr)'], df['15N mass'], df['15N mz (Thr)'] = \
-        zip(*df['SeqCharge'].map(calculate_mass))
+    masses: pd.DataFrame = calculate_masses(df['ModSequence'], df['Charge'], minimum_mz=min_mz,
+                                            registry=registry)
+    for column in masses.columns:
+        df[column] = masses[column].to_numpy()
     df = df[df['15N mz (Thr)'] != 0]
 
     # Remove unnecessary columns
-    del df['SeqCharge']
     del df['ModSequence']
-    del df['StartEnd']
 
     return df
 
 
+def get_regions(starts: np.ndarray, ends: np.ndarray, domain_map: Union[DomainMap, None] = None) -> np.ndarray:
+    """
+    Get the regions of the peptides from the regions of their first and last residue.
+    :param starts: The start positions.
+    :param ends: The end positions.
+    :param domain_map: The domain map of the protein. If None, the domains of calreticulin are used.
+    :return: The regions, e.g. 'Core' or 'Core;P' for a peptide spanning two regions.
+    """
+    if domain_map is None:
+        domain_map = load_domain_map()
+    return domain_map.regions(starts, ends)
+
+
 def get_region(start_end: tuple) -> str:
-    start_region = get_region_from_position(start_end[0])
-    end_region = get_region_from_position(start_end[1])
-    if start_region == end_region:
-        return start_region
-    else:
-        return f"{start_region};{end_region}"
+    return str(get_regions(np.array([start_end[0]]), np.array([start_end[1]]))[0])
 
 
 def get_region_from_position(pos: int) -> str:
-    if pos < 17:
-        # No peptide should be in this region
-        return "Signal"
-    elif pos < 204:
-        return "Core"
-    elif pos < 305:
-        return "P"
-    elif pos < 336:
-        return "Core"
-    else:
-        return "C"
+    # No peptide should be in the signal region
+    return str(load_domain_map().regions_at(np.array([pos]))[0])
 
 
 # Entry point
 if __name__ == '__main__':
     tolerance = 0.01
+    rt_window = 30.0
     minimum_mz = 500
+    profile = False
 
     tandem_file = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\XTandem\EXP3_01258_VM_mix_37.xml"
     mzxml_file = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\mzXML\EXP3_01258_VM.mzXML"
-    excel_result_file = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\ratios.xlsx"
+    result_file = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\ratios.parquet"
+    ms1_cache_dir = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\mzXML\MS1Cache"
+    report_file = r"C:\Users\Mads\Desktop\ISA_Spring_2021\Autodigestion\ratios_report.json"
 
     start_time = time.time()
+    instrumentation = Instrumentation('N145Calculator', verbose=True, profile=profile)
 
     # Create modification list
     print("Create modification list")
-    create_modification_list("Modifications.csv")
+    modification_registry = create_modification_list("Modifications.csv")
 
     # Read the X!Tandem result file
     print("Read X!Tandem file")
-    peptides_raw: pd.DataFrame = read_tandem_result_file(tandem_file)
+    with instrumentation.stage('parse') as stage:
+        peptides_raw: pd.DataFrame = read_tandem_result_file(tandem_file, registry=modification_registry)
+        stage.rows = len(peptides_raw)
 
     # Setup dataframe
     print("Setup dataframe")
-    peptides: pd.DataFrame = setup_df(peptides_raw, minimum_mz)
-
-    # Calculate the intensities
-    print("Calculate intensities")
-    peptides = calculate_intensities(peptides, mzxml_file, tolerance=tolerance)
+    with instrumentation.stage('mass') as stage:
+        peptides: pd.DataFrame = setup_df(peptides_raw, minimum_mz, registry=modification_registry)
+        stage.rows = len(peptides)
+
+    # Cache the MS1 scans
+    print("Load MS1 scans")
+    with instrumentation.stage('ms1 load') as stage:
+        stage.rows = len(load_ms1_index(mzxml_file, cache_dir=ms1_cache_dir))
+
+    # Integrate the 14N and 15N peaks
+    print("Calculate peak areas")
+    with instrumentation.stage('intensity') as stage:
+        peptides = calculate_peak_areas(peptides, mzxml_file, tolerance=tolerance, rt_window=rt_window,
+                                        cache_dir=ms1_cache_dir)
+        stage.rows = len(peptides)
 
     # Reorder columns
-    print("Reorder columns before creating Excel-file")
-    peptides = peptides[['Sequence', 'Charge', 'Start', 'End', 'Modifications', 'RT', 'Scan number', '14N mass',
-                         '14N mz (Thr)', '14N mz (Exp)', '14N Int', '15N mass', '15N mz (Thr)', '15N mz (Exp)',
-                         '15N Int', 'Ratio', 'Region']]
+    print("Reorder columns before writing the result")
+    peptides = peptides[['Sequence', 'Charge', 'Start', 'End', 'Modifications', 'RT', '14N mass', '14N mz (Thr)',
+                         '15N mass', '15N mz (Thr)', 'Apex RT', 'Start RT', 'End RT', 'Scans', '14N Area',
+                         '15N Area', 'Area ratio', 'Region']]
     peptides = peptides.reset_index(drop=True)
 
-    # Write the data to the Excel-file
-    print("Write result to Excel-file")
-    peptides.to_excel(excel_result_file)
+    # Write the data to a Parquet file, or an Excel file with output_format='xlsx'
+    print("Write result")
+    with instrumentation.stage('write') as stage:
+        write_table(peptides, result_file)
+        stage.rows = len(peptides)
 
+    instrumentation.write_report(report_file)
     run_time = time.time() - start_time
     print("Done in {} seconds ({} minutes).".format(round(run_time, 2), round(run_time/60, 2)))
-
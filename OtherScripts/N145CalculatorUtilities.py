@@ -3,44 +3,47 @@ Description: Utilities for the 14N/15N calculator
 """
 
 # Import packages
-import math
+from typing import Union
 
+import numpy as np
 import pandas as pd
 import pyteomics
-from pyopenms.pyopenms_5 import MzXMLFile, MSExperiment
-from pyteomics import mass
 
-modifications: dict = {}
+from IsotopeMass import PROTON_MASS, calculate_mz, calculate_neutral_masses
+from MS1Cache import open_ms1_scans
+from ModificationRegistry import MASS_TOLERANCE, STANDARD_REGISTRY, ModificationRegistry
+from ScanPreprocessing import PreprocessingSettings
+from PeakPicking import AREA_COLUMNS, integrate_peaks
+from XICExtraction import XICs, envelope_targets, extract_xics, match_envelopes, peak_tolerances
 
 
-def create_modification_list(mod_csv_filepath: str):
+def create_modification_list(mod_csv_filepath: str, tolerance: float = MASS_TOLERANCE) -> ModificationRegistry:
     """
-    Add modifications to the dictionary.
+    Create the registry of the modified residues. The standard amino acid compositions of pyteomics are not changed.
     :param mod_csv_filepath: The path to the Modification CSV.
-    :return:
+    :param tolerance: The tolerance in Da for matching the modification masses of the search results. Default 0.01.
+    :return: The modification registry.
     """
-    # Read modification CSV
-    mod_csv: pd.DataFrame = pd.read_csv(filepath_or_buffer=mod_csv_filepath)
-    for _, row in mod_csv.iterrows():
-        mass.std_aa_comp[f"{row['Prefix']}{row['Residue']}"] = mass.std_aa_comp[row['Residue']] + \
-                                                               mass.Composition(formula=row['Composition'])
-        modifications[(row['Residue'], row['Mass'])] = row['Prefix']
+    return ModificationRegistry.from_csv(mod_csv_filepath, tolerance=tolerance)
 
 
-def create_modified_sequence(sequence: str, seq_start: int, mods: list) -> str:
+def create_modified_sequence(sequence: str, seq_start: int, mods: list,
+                             registry: ModificationRegistry = STANDARD_REGISTRY) -> str:
     """
     Create the modified sequence.
     :param sequence: The sequence.
     :param seq_start: The position of the first residue to calculate the positions of modified residues.
     :param mods: The modifications with residue, position and mass change.
+    :param registry: The modified residues. Default no modifications.
     :return: The modified sequence.
     """
     # Convert sequence to residues
     residues = list(sequence)
     for mod in mods:
-        if (mod['type'], mod['modified']) in modifications:
+        prefix: Union[str, None] = registry.find_prefix(mod['type'], mod['modified'])
+        if prefix is not None:
             mod_index = mod['at'] - seq_start
-            residues[mod_index] = f"{modifications[(mod['type'], mod['modified'])]}{residues[mod_index]}"
+            residues[mod_index] = f"{prefix}{residues[mod_index]}"
         else:
             print(f"\tWARN: {mod['modified']}@{mod['type']} is not supported.")
 
@@ -49,26 +52,21 @@ def create_modified_sequence(sequence: str, seq_start: int, mods: list) -> str:
     return mod_sequence
 
 
-def calculate_mass(seq_charge: tuple):
+def calculate_mass(seq_charge: tuple, registry: ModificationRegistry = STANDARD_REGISTRY):
     """
     Calculate the 14N and 15N mass for a given sequence and the m/z for a given charge. :param seq_charge: Tuple
     containing the sequence and the charge. Also the constant minimum m/z-value to filter of too small peptides .
+    :param registry: The modified residues of the sequence. Default no modifications.
     :return: The tuple containing the 14N and 15N mass and m/z (for the given charge).
     """
     sequence: str = seq_charge[0]
     charge: int = seq_charge[1]
     minimum_mz: float = seq_charge[2]
-    # Get the composition
+    # Get the masses and m/z
     try:
-        compositions = list(pyteomics.mass.isotopologues(sequence, elements_with_isotopes='N'))
-        n14_comp = compositions[0]
-        n15_comp = compositions[-1]
-        # Calculate the mass
-        n14_mass = round(pyteomics.mass.calculate_mass(n14_comp, type='M'), 3)
-        n15_mass = round(pyteomics.mass.calculate_mass(n15_comp, type='M'), 3)
-        # Get the m/z
-        n14_mz = round(pyteomics.mass.calculate_mass(n14_comp, charge=charge), 3)
-        n15_mz = round(pyteomics.mass.calculate_mass(n15_comp, charge=charge), 3)
+        n14_mass, n15_mass = calculate_neutral_masses(sequence, registry)
+        n14_mz, n15_mz = calculate_mz(sequence, charge, registry)
+        n14_mass, n15_mass, n14_mz, n15_mz = (round(float(value), 3) for value in (n14_mass, n15_mass, n14_mz, n15_mz))
         if n14_mz < minimum_mz or n15_mz < minimum_mz:
             return 0, 0, 0, 0
         else:
@@ -78,76 +76,161 @@ def calculate_mass(seq_charge: tuple):
         return 0, 0, 0, 0
 
 
-def calculate_intensities(peptide_df: pd.DataFrame, mzxml_filepath: str, tolerance: float = 0.01) -> pd.DataFrame:
+def calculate_masses(sequences: pd.Series, charges: pd.Series, minimum_mz: float,
+                     registry: ModificationRegistry = STANDARD_REGISTRY) -> pd.DataFrame:
     """
-    Calculate intensities from a mzXML file.
+    Calculate the 14N and 15N masses and m/z of many peptides at once. The masses are calculated once for each unique
+    sequence and used for all its charges. The values are rounded to three decimals, and peptides with an m/z below the
+    minimum m/z or a sequence which cannot be parsed get zeros, as in calculate_mass.
+    :param sequences: The (modified) sequences.
+    :param charges: The charges.
+    :param minimum_mz: The minimum m/z.
+    :param registry: The modified residues of the sequences. Default no modifications.
+    :return: The DataFrame with the columns '14N mass', '14N mz (Thr)', '15N mass' and '15N mz (Thr)' in the order of
+        the sequences.
+    """
+    # The codes of categorical sequences are used as they are
+    codes, unique_sequences = pd.factorize(sequences)
+    neutral_masses: np.ndarray = np.zeros((len(unique_sequences), 2), dtype=np.float64)
+    parsed: np.ndarray = np.ones(len(unique_sequences), dtype=bool)
+    for sequence_idx, sequence in enumerate(unique_sequences):
+        try:
+            neutral_masses[sequence_idx] = calculate_neutral_masses(sequence, registry)
+        except pyteomics.auxiliary.structures.PyteomicsError:
+            print(f"\tCould not parse {sequence}")
+            parsed[sequence_idx] = False
+
+    charges = np.asarray(charges, dtype=np.float64)
+    n14_mass: np.ndarray = neutral_masses[codes, 0]
+    n15_mass: np.ndarray = neutral_masses[codes, 1]
+    n14_mz: np.ndarray = np.round((n14_mass + charges * PROTON_MASS) / charges, 3)
+    n15_mz: np.ndarray = np.round((n15_mass + charges * PROTON_MASS) / charges, 3)
+    masses: pd.DataFrame = pd.DataFrame({'14N mass': np.round(n14_mass, 3), '14N mz (Thr)': n14_mz,
+                                         '15N mass': np.round(n15_mass, 3), '15N mz (Thr)': n15_mz})
+    masses[~parsed[codes] | (n14_mz < minimum_mz) | (n15_mz < minimum_mz)] = 0
+    return masses
+
+
+def calculate_intensities(peptide_df: pd.DataFrame, mzxml_filepath: str, tolerance: float = 0.01,
+                          rt_tolerance: float = 1.0, cache_dir: Union[str, None] = None,
+                          preprocessing: Union[PreprocessingSettings, None] = None, tolerance_unit: str = 'Da',
+                          isotopes: int = 0) -> pd.DataFrame:
+    """
+    Calculate intensities from a mzXML file. The MS1 scans are read one at a time and each peptide uses the scan
+    closest to its retention time.
     :param peptide_df: The dataframe containing information about the peptide.
     :param mzxml_filepath: The path to the mzXML.
-    :param tolerance: The tolerance in Da. Default is 0.01
+    :param tolerance: The tolerance. Default is 0.01
+    :param rt_tolerance: The maximum difference in seconds between the peptide RT and the MS1 scan. Default is 1.0
+    :param cache_dir: The directory of the MS1 cache. If None, the mzXML file is read without caching.
+    :param preprocessing: The settings for centroiding the scans and removing the noise before the peak lookups. If
+        None, the raw scans are searched.
+    :param tolerance_unit: The unit of the tolerance, either 'Da', where the tolerance is divided by the charge, or
+        'ppm'. Default 'Da'.
+    :param isotopes: The number of isotope peaks summed with the monoisotopic peak of the 14N and 15N envelope.
+        Default 0, i.e. only the monoisotopic peak.
     :return: The input dataframe with the intensity information.
     """
-    # Load MS file
-    exp = MSExperiment()
-    MzXMLFile().load(mzxml_filepath, exp)
-    # Remove all MSn spectra
-    spec = []
-    for s in exp.getSpectra():
-        if s.getMSLevel() == 1:
-            s.sortByPosition()
-            spec.append(s)
-    exp.setSpectra(spec)
-
-    # Create lists to hold additional data
-    scan_numbers: list = []
-    n14_ints: list = []
-    n15_ints: list = []
-    n14_mzs: list = []
-    n15_mzs: list = []
-    ratios: list = []
-
-    # Loop over the rows
-    for _, row in peptide_df.iterrows():
-        try:
-            # Get spectrum from with the given RT
-            spectrum = [s for s in exp if math.floor(row['RT']) < s.getRT() < math.ceil(row['RT'])][0]
-
-            # Get the the closest peak closest to 14N and 15N m/z, respectively, within a given tolerance.
-            n14_peak = spectrum[spectrum.findNearest(row['14N mz (Thr)'], tolerance / row['Charge'])]
-            n15_peak = spectrum[spectrum.findNearest(row['15N mz (Thr)'], tolerance / row['Charge'])]
-        except IndexError:
-            print(f"\tWARN: Could not add {row['Sequence']}. No scans with N14 peak = {row['14N mz (Thr)']} m/z and "
-                  f"and N15 peak = {row['14N mz (Thr)']} m/z at RT = {row['RT']} s.")
-            scan_numbers.append(None)
-            n14_mzs.append(None)
-            n15_mzs.append(None)
-            n14_ints.append(None)
-            n15_ints.append(None)
-            ratios.append(None)
+    n_peptides: int = peptide_df.shape[0]
+    peptide_rts: np.ndarray = peptide_df['RT'].to_numpy(dtype=float)
+    charges: np.ndarray = peptide_df['Charge'].to_numpy(dtype=float)
+    # The isotope envelopes of the 14N targets followed by the 15N targets
+    targets: np.ndarray = envelope_targets(peptide_df['14N mz (Thr)'].to_numpy(dtype=float),
+                                           peptide_df['15N mz (Thr)'].to_numpy(dtype=float), charges,
+                                           isotopes=isotopes)
+    tolerances: np.ndarray = peak_tolerances(targets, np.tile(charges, 2), tolerance, tolerance_unit=tolerance_unit)
+    # Sort the peptides by RT to find the peptides of a scan by binary search
+    rt_order: np.ndarray = np.argsort(peptide_rts, kind='mergesort')
+    sorted_rts: np.ndarray = peptide_rts[rt_order]
+
+    # Create arrays to hold additional data
+    scan_distances: np.ndarray = np.full(n_peptides, np.inf)
+    scan_numbers: np.ndarray = np.full(n_peptides, None, dtype=object)
+    n14_mzs, n15_mzs, n14_ints, n15_ints = (np.full(n_peptides, np.nan) for _ in range(4))
+
+    for scan_id, scan_rt, scan_mz, scan_intensity in open_ms1_scans(mzxml_filepath, cache_dir=cache_dir,
+                                                                           preprocessing=preprocessing):
+        # Get the peptides which are closer to this scan than to the previous scans
+        first = np.searchsorted(sorted_rts, scan_rt - rt_tolerance, side='left')
+        last = np.searchsorted(sorted_rts, scan_rt + rt_tolerance, side='right')
+        rows = rt_order[first:last]
+        distances = np.abs(peptide_rts[rows] - scan_rt)
+        closer = distances < scan_distances[rows]
+        rows = rows[closer]
+        if rows.size == 0:
             continue
-
-        n14_int = n14_peak.getIntensity()
-        n15_int = n15_peak.getIntensity()
-        if n14_int == 0:
-            ratio = None
-        else:
-            ratio = round(n15_int / n14_int, 3)
-
-        # Set the data
-        scan_numbers.append(spectrum.getNativeID().split('=')[1])
-        n14_mzs.append(round(n14_peak.getMZ(), 3))
-        n15_mzs.append(round(n15_peak.getMZ(), 3))
-        n14_ints.append(round(n14_int, 3))
-        n15_ints.append(round(n15_int, 3))
-        ratios.append(ratio)
+        scan_distances[rows] = distances[closer]
+
+        # Get the 14N and 15N envelopes, where the monoisotopic peaks are the peaks closest to the 14N and 15N m/z
+        target_rows = np.concatenate([rows, rows + n_peptides])
+        envelope_mzs, envelope_ints = match_envelopes(scan_mz, scan_intensity, targets[target_rows],
+                                                      tolerances[target_rows])
+        found = ~np.isnan(envelope_mzs[:rows.size]) & ~np.isnan(envelope_mzs[rows.size:])
+        scan_numbers[rows] = np.where(found, scan_id, None)
+        n14_mzs[rows] = np.where(found, envelope_mzs[:rows.size], np.nan)
+        n15_mzs[rows] = np.where(found, envelope_mzs[rows.size:], np.nan)
+        n14_ints[rows] = np.where(found, envelope_ints[:rows.size], np.nan)
+        n15_ints[rows] = np.where(found, envelope_ints[rows.size:], np.nan)
+
+    for _, row in peptide_df[pd.isna(scan_numbers)].iterrows():
+        print(f"\tWARN: Could not add {row['Sequence']}. No scans with N14 peak = {row['14N mz (Thr)']} m/z and "
+              f"and N15 peak = {row['15N mz (Thr)']} m/z at RT = {row['RT']} s.")
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios: np.ndarray = np.where(n14_ints != 0, np.round(n15_ints / n14_ints, 3), np.nan)
 
     # Add data
     peptide_df['Scan number'] = scan_numbers
-    peptide_df['14N mz (Exp)'] = n14_mzs
-    peptide_df['15N mz (Exp)'] = n15_mzs
-    peptide_df['14N Int'] = n14_ints
-    peptide_df['15N Int'] = n15_ints
+    peptide_df['14N mz (Exp)'] = np.round(n14_mzs, 3)
+    peptide_df['15N mz (Exp)'] = np.round(n15_mzs, 3)
+    peptide_df['14N Int'] = np.round(n14_ints, 3)
+    peptide_df['15N Int'] = np.round(n15_ints, 3)
     peptide_df['Ratio'] = ratios
     # Remove rows with no values
     peptide_df = peptide_df[peptide_df['Ratio'].notna()]
 
     return peptide_df
+
+
+def calculate_peak_areas(peptide_df: pd.DataFrame, mzxml_filepath: str, tolerance: float = 0.01,
+                         rt_window: float = 30.0, cache_dir: Union[str, None] = None,
+                         preprocessing: Union[PreprocessingSettings, None] = None, tolerance_unit: str = 'Da',
+                         isotopes: int = 0, smoothing_window: int = 5) -> pd.DataFrame:
+    """
+    Calculate the 14N and 15N peak areas from a mzXML file. The chromatograms of all peptides are extracted while the
+    MS1 scans are read once, and the chromatographic peak closest to the retention time of each peptide is integrated.
+    Each chromatogram only covers the scans within twice rt_window of the peptide RT, so the memory grows with the
+    number of peptides and not with the length of the run. A peak extending beyond those scans is cut at their edge.
+    :param peptide_df: The dataframe containing information about the peptide.
+    :param mzxml_filepath: The path to the mzXML.
+    :param tolerance: The tolerance. Default is 0.01
+    :param rt_window: The maximum difference in seconds between the peptide RT and the apex of the peak. Default 30.
+    :param cache_dir: The directory of the MS1 cache. If None, the mzXML file is read without caching.
+    :param preprocessing: The settings for centroiding the scans and removing the noise before the peak lookups. If
+        None, the raw scans are searched.
+    :param tolerance_unit: The unit of the tolerance, either 'Da', where the tolerance is divided by the charge, or
+        'ppm'. Default 'Da'.
+    :param isotopes: The number of isotope peaks summed with the monoisotopic peak of the 14N and 15N envelope.
+        Default 0, i.e. only the monoisotopic peak.
+    :param smoothing_window: The number of scans of the moving average used to find the peaks. Default 5.
+    :return: The input dataframe with the peak information in the columns of PeakPicking.AREA_COLUMNS.
+    """
+    xics: XICs = extract_xics(open_ms1_scans(mzxml_filepath, cache_dir=cache_dir, preprocessing=preprocessing),
+                              n14_mzs=peptide_df['14N mz (Thr)'].to_numpy(dtype=float),
+                              n15_mzs=peptide_df['15N mz (Thr)'].to_numpy(dtype=float),
+                              charges=peptide_df['Charge'].to_numpy(dtype=int), tolerance=tolerance,
+                              tolerance_unit=tolerance_unit, isotopes=isotopes,
+                              expected_rts=peptide_df['RT'].to_numpy(dtype=float), rt_window=2 * rt_window)
+    peaks: pd.DataFrame = integrate_peaks(xics, expected_rts=peptide_df['RT'].to_numpy(dtype=float),
+                                          rt_window=rt_window, smoothing_window=smoothing_window)
+
+    for _, row in peptide_df[peaks['Area ratio'].isna().to_numpy()].iterrows():
+        print(f"\tWARN: Could not add {row['Sequence']}. No peak with N14 peak = {row['14N mz (Thr)']} m/z and "
+              f"N15 peak = {row['15N mz (Thr)']} m/z within {rt_window} s of RT = {row['RT']} s.")
+
+    # Add data
+    peptide_df = peptide_df.copy()
+    for column in AREA_COLUMNS:
+        peptide_df[column] = peaks[column].to_numpy()
+    # Remove rows with no values
+    return peptide_df[peptide_df['Area ratio'].notna()]
@@ -1,18 +1,14 @@
 """
 Description: Script for calculating the N14 and N15 mass from a sequence
 """
-import pyteomics
-from pyteomics import mass
+from IsotopeMass import calculate_mz
 
 
 def calculate_mass(seq: str, ch: int) -> tuple:
-    # Get the composition
-    compositions = list(pyteomics.mass.isotopologues(seq, elements_with_isotopes='N'))
-    n14_comp = compositions[0]
-    n15_comp = compositions[-1]
     # Get the m/z
-    n14_mass = round(pyteomics.mass.calculate_mass(n14_comp, ch), 3)
-    n15_mass = round(pyteomics.mass.calculate_mass(n15_comp, ch), 3)
+    n14_mz, n15_mz = calculate_mz(seq, ch)
+    n14_mass = round(float(n14_mz), 3)
+    n15_mass = round(float(n15_mz), 3)
     return n14_mass, n15_mass
 
 
@@ -0,0 +1,228 @@
+"""
+Description: Write the result tables as Parquet, CSV or streamed Excel files, optionally in a background thread
+"""
+
+# Import packages
+import math
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Union
+
+import pandas as pd
+from openpyxl import Workbook
+
+from WorkbookCache import read_workbook_sheet
+
+try:
+    import pyarrow  # noqa: F401 (Parquet engine)
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# The file extension of each output format
+OUTPUT_FORMATS: Dict[str, str] = {'parquet': '.parquet', 'csv': '.csv', 'xlsx': '.xlsx'}
+DEFAULT_FORMAT: str = 'parquet' if PARQUET_AVAILABLE else 'csv'
+
+
+def output_filepath(filepath: str, output_format: str, sheet_name: Union[str, None] = None) -> str:
+    """
+    Get the path to a table in an output format. The extension of the path is replaced by the one of the format. In the
+    columnar formats every sheet but the first is written to its own file with the sheet name appended to the path.
+    :param filepath: The path to the table.
+    :param output_format: The output format, 'parquet', 'csv' or 'xlsx'.
+    :param sheet_name: The name of the sheet if it is not the first sheet, otherwise None.
+    :return: The path.
+    """
+    check_output_format(output_format)
+    stem: str = os.path.splitext(filepath)[0]
+    if sheet_name is not None and output_format != 'xlsx':
+        stem = f"{stem}_{sheet_name}"
+    return stem + OUTPUT_FORMATS[output_format]
+
+
+def check_output_format(output_format: str):
+    """
+    Check the output format.
+    :param output_format: The output format.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"The output format must be one of {list(OUTPUT_FORMATS)}, not '{output_format}'.")
+
+
+def write_sheets(sheets: Dict[str, pd.DataFrame], filepath: str, output_format: str = DEFAULT_FORMAT) -> str:
+    """
+    Write the tables with their index. In Excel the tables are sheets of one workbook, which is streamed row by row
+    with the write-only mode of openpyxl. In Parquet and CSV every sheet but the first is written to its own file.
+    :param sheets: The dictionary with the sheet name and its table.
+    :param filepath: The path to the output. The extension is replaced by the one of the output format.
+    :param output_format: The output format, 'parquet', 'csv' or 'xlsx'. Default Parquet if pyarrow is installed,
+        otherwise CSV.
+    :return: The path to the file of the first sheet, which is a CSV file if the sheet cannot be stored in Parquet.
+    """
+    filepath = output_filepath(filepath, output_format)
+    if output_format == 'xlsx':
+        _write_workbook(sheets, filepath)
+        return filepath
+
+    sheet_filepaths: List[str] = []
+    for sheet_idx, (sheet_name, table) in enumerate(sheets.items()):
+        sheet_filepath: str = output_filepath(filepath, output_format, sheet_name=sheet_name if sheet_idx else None)
+        if output_format == 'parquet':
+            try:
+                table.to_parquet(sheet_filepath)
+                sheet_filepaths.append(sheet_filepath)
+                continue
+            except (ValueError, TypeError, NotImplementedError) as error:
+                # E.g. columns with mixed types, which cannot be stored in Parquet
+                print(f"\tWARN: Could not write {sheet_filepath} as Parquet, writing CSV instead: {error}")
+                sheet_filepath = output_filepath(sheet_filepath, 'csv')
+        table.to_csv(sheet_filepath)
+        sheet_filepaths.append(sheet_filepath)
+    return sheet_filepaths[0]
+
+
+def write_table(table: pd.DataFrame, filepath: str, output_format: str = DEFAULT_FORMAT,
+                sheet_name: str = 'List') -> str:
+    """
+    Write a table with its index.
+    :param table: The table.
+    :param filepath: The path to the output. The extension is replaced by the one of the output format.
+    :param output_format: The output format, 'parquet', 'csv' or 'xlsx'. Default Parquet if pyarrow is installed,
+        otherwise CSV.
+    :param sheet_name: The name of the sheet in Excel. Default 'List'.
+    :return: The path to the file.
+    """
+    return write_sheets({sheet_name: table}, filepath, output_format=output_format)
+
+
+def read_table(filepath: str, sheet_name: Union[str, int] = 0, usecols: Union[List[str], None] = None) \
+        -> pd.DataFrame:
+    """
+    Read a table written by write_table or write_sheets, or a sheet of any workbook. The format is given by the
+    extension.
+    :param filepath: The path to the file of the first sheet.
+    :param sheet_name: The name or index of the sheet. Default is the first sheet.
+    :param usecols: The columns to read. If None, all the columns are read.
+    :return: The table.
+    """
+    extension: str = os.path.splitext(filepath)[1].lower()
+    if extension not in ('.parquet', '.csv'):
+        return read_workbook_sheet(filepath, sheet_name=sheet_name, usecols=usecols)
+
+    # Every sheet but the first is stored in its own file
+    if isinstance(sheet_name, str) and os.path.exists(output_filepath(filepath, extension[1:], sheet_name)):
+        filepath = output_filepath(filepath, extension[1:], sheet_name)
+    if extension == '.parquet':
+        return pd.read_parquet(filepath, columns=usecols)
+    table: pd.DataFrame = pd.read_csv(filepath, index_col=0)
+    return table if usecols is None else table[[column for column in table.columns if column in usecols]]
+
+
+class OutputWriter:
+    """
+    The writer of the result tables of a run. With background writing, the tables are written one at a time in a
+    thread while the next stage is computed, so a table must not be changed in place after it is written. wait or
+    close raise the first error of the writes.
+    """
+
+    def __init__(self, output_format: str = DEFAULT_FORMAT, background: bool = False):
+        """
+        :param output_format: The output format, 'parquet', 'csv' or 'xlsx'. Default Parquet if pyarrow is installed,
+            otherwise CSV.
+        :param background: Whether the tables are written in a background thread. Default False.
+        """
+        check_output_format(output_format)
+        self.output_format: str = output_format
+        self._executor: Union[ThreadPoolExecutor, None] = \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='OutputWriter') if background else None
+        self._pending: List[Future] = []
+
+    def write(self, table: pd.DataFrame, filepath: str, sheet_name: str = 'List') -> str:
+        """
+        Write a table with its index.
+        :param table: The table.
+        :param filepath: The path to the output. The extension is replaced by the one of the output format.
+        :param sheet_name: The name of the sheet in Excel. Default 'List'.
+        :return: The path to the file, which exists when the write is done.
+        """
+        return self.write_sheets({sheet_name: table}, filepath)
+
+    def write_sheets(self, sheets: Dict[str, pd.DataFrame], filepath: str) -> str:
+        """
+        Write the tables as the sheets of an output.
+        :param sheets: The dictionary with the sheet name and its table.
+        :param filepath: The path to the output. The extension is replaced by the one of the output format.
+        :return: The path to the file of the first sheet, which exists when the write is done.
+        """
+        if self._executor is None:
+            return write_sheets(sheets, filepath, output_format=self.output_format)
+        # A deep copy keeps the tables from changing when the caller changes them while they are written
+        sheets = {sheet_name: table.copy() for sheet_name, table in sheets.items()}
+        self._pending.append(self._executor.submit(write_sheets, sheets, filepath, output_format=self.output_format))
+        return output_filepath(filepath, self.output_format)
+
+    def wait(self):
+        """
+        Wait until all the tables are written.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """
+        Wait until all the tables are written and stop the background thread.
+        """
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def __enter__(self) -> 'OutputWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# The writer used by the functions when no writer is given
+SYNCHRONOUS_WRITER = OutputWriter()
+
+
+def _write_workbook(sheets: Dict[str, pd.DataFrame], filepath: str):
+    """
+    Stream the tables to a workbook with the index in the first columns, as DataFrame.to_excel does.
+    :param sheets: The dictionary with the sheet name and its table.
+    :param filepath: The path to the workbook.
+    """
+    workbook: Workbook = Workbook(write_only=True)
+    for sheet_name, table in sheets.items():
+        sheet = workbook.create_sheet(title=sheet_name)
+        sheet.append([_cell_value(name) if name is not None else None for name in table.index.names] +
+                     [_cell_value(column) for column in table.columns])
+        for index, row in zip(table.index, table.itertuples(index=False, name=None)):
+            index_values: tuple = index if isinstance(index, tuple) else (index,)
+            sheet.append([_cell_value(value) for value in index_values + row])
+    workbook.save(filepath)
+
+
+def _cell_value(value):
+    """
+    Convert a value to a value openpyxl can write. Missing values become empty cells.
+    :param value: The value.
+    :return: The cell value.
+    """
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    if isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return _cell_value(value.item())
+    return str(value)
@@ -0,0 +1,178 @@
+"""
+Description: Find and integrate the chromatographic peaks of the 14N and 15N ion chromatograms
+"""
+
+# Import packages
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from XICExtraction import XICs
+
+AREA_COLUMNS = ['Apex RT', 'Start RT', 'End RT', 'Scans', '14N Area', '15N Area', 'Area ratio']
+# The number of chromatogram points processed at once, which bounds the memory of the intermediate arrays
+CHUNK_POINTS = 2 ** 20
+
+
+def integrate_peaks(xics: XICs, expected_rts: Union[np.ndarray, None] = None, rt_window: float = 30.0,
+                    smoothing_window: int = 5, boundary_fraction: float = 0.05) -> pd.DataFrame:
+    """
+    Find the chromatographic peak of every target and integrate the 14N and the 15N chromatogram over it. The peak is
+    found in the smoothed sum of the 14N and 15N chromatograms, so both labels are integrated over the same scans. The
+    chromatograms are processed in chunks of targets, so the intermediate arrays stay small however many targets and
+    scans there are.
+    :param xics: The chromatograms with one row per target. Peaks of chromatograms extracted within a window of each
+        target end at the edge of the window.
+    :param expected_rts: The expected retention time of each target, e.g. of the identification. The apex is searched
+        within rt_window of it. If None, the apex is the maximum of the whole chromatogram.
+    :param rt_window: The maximum distance in seconds between the apex and the expected retention time.
+    :param smoothing_window: The number of scans of the moving average. 1 disables the smoothing.
+    :param boundary_fraction: The peak ends where the smoothed intensity falls below this fraction of the apex or at a
+        valley between two peaks.
+    :return: The DataFrame with the columns in AREA_COLUMNS and one row per target. The values are NaN if the target
+        has no peak.
+    """
+    n_targets, n_columns = xics.n14_intensity.shape
+    chunk_size: int = max(CHUNK_POINTS // max(n_columns, 1), 1)
+    expected_rts = np.asarray(expected_rts, dtype=np.float64) if expected_rts is not None else None
+    chunks: List[pd.DataFrame] = [
+        _integrate_chunk(xics, slice(start, start + chunk_size),
+                         expected_rts[start:start + chunk_size] if expected_rts is not None else None,
+                         rt_window, smoothing_window, boundary_fraction)
+        for start in range(0, n_targets, chunk_size)]
+    if not chunks:
+        return pd.DataFrame(columns=AREA_COLUMNS, dtype=np.float64)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _integrate_chunk(xics: XICs, rows: slice, expected_rts: Union[np.ndarray, None], rt_window: float,
+                     smoothing_window: int, boundary_fraction: float) -> pd.DataFrame:
+    """
+    Find and integrate the peaks of a chunk of targets.
+    :param xics: The chromatograms.
+    :param rows: The targets of the chunk.
+    :param expected_rts: The expected retention time of each target of the chunk, or None.
+    :param rt_window: The maximum distance in seconds between the apex and the expected retention time.
+    :param smoothing_window: The number of scans of the moving average.
+    :param boundary_fraction: The fraction of the apex intensity where the peak ends.
+    :return: The DataFrame with the columns in AREA_COLUMNS and one row per target of the chunk.
+    """
+    rts: np.ndarray = xics.target_rts(rows)
+    scan_counts: np.ndarray = xics.target_scan_counts(rows)
+    n14: np.ndarray = np.nan_to_num(xics.n14_intensity[rows].astype(np.float64))
+    n15: np.ndarray = np.nan_to_num(xics.n15_intensity[rows].astype(np.float64))
+    smoothed: np.ndarray = smooth_traces(n14 + n15, smoothing_window, lengths=scan_counts)
+
+    search_mask: np.ndarray = np.arange(rts.shape[1])[None, :] < scan_counts[:, None]
+    if expected_rts is not None:
+        search_mask &= np.abs(rts - expected_rts[:, None]) <= rt_window
+    apexes, has_peak = find_apexes(smoothed, search_mask)
+    starts, ends = find_boundaries(smoothed, apexes, boundary_fraction)
+    ends = np.minimum(ends, np.maximum(scan_counts - 1, 0))
+
+    n14_areas: np.ndarray = trapezoid_areas(n14, rts, starts, ends)
+    n15_areas: np.ndarray = trapezoid_areas(n15, rts, starts, ends)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios: np.ndarray = np.where(n14_areas != 0, np.round(n15_areas / n14_areas, 3), np.nan)
+
+    targets: np.ndarray = np.arange(rts.shape[0])
+    peaks: pd.DataFrame = pd.DataFrame({
+        'Apex RT': rts[targets, apexes] if rts.shape[1] else np.nan,
+        'Start RT': rts[targets, starts] if rts.shape[1] else np.nan,
+        'End RT': rts[targets, ends] if rts.shape[1] else np.nan,
+        'Scans': ends - starts + 1,
+        '14N Area': np.round(n14_areas, 3),
+        '15N Area': np.round(n15_areas, 3),
+        'Area ratio': ratios
+    }, columns=AREA_COLUMNS)
+    peaks.loc[~has_peak, :] = np.nan
+    return peaks
+
+
+def smooth_traces(traces: np.ndarray, window: int, lengths: Union[np.ndarray, None] = None) -> np.ndarray:
+    """
+    Smooth the traces with a centred moving average, which is shortened at the ends of the traces.
+    :param traces: The traces with one row per trace.
+    :param window: The number of points of the moving average.
+    :param lengths: The number of points of every trace, where the points after it are padding. If None, all the
+        points.
+    :return: The smoothed traces. The padding is zero.
+    """
+    if window <= 1 or traces.shape[1] == 0:
+        return traces
+    half: int = window // 2
+    cumulative: np.ndarray = np.zeros((traces.shape[0], traces.shape[1] + 1))
+    np.cumsum(traces, axis=1, out=cumulative[:, 1:])
+    columns: np.ndarray = np.arange(traces.shape[1])
+    lower: np.ndarray = np.maximum(columns - half, 0)
+    upper: np.ndarray = np.minimum(columns + half + 1, traces.shape[1])
+    if lengths is None:
+        return (cumulative[:, upper] - cumulative[:, lower]) / (upper - lower)
+    upper = np.minimum(upper[None, :], lengths[:, None])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        smoothed: np.ndarray = (np.take_along_axis(cumulative, upper, axis=1) - cumulative[:, lower]) / \
+            (upper - lower[None, :])
+    return np.where(columns[None, :] < lengths[:, None], smoothed, 0)
+
+
+def find_apexes(smoothed: np.ndarray, search_mask: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the apex of every trace.
+    :param smoothed: The smoothed traces.
+    :param search_mask: The scans in which the apex of each trace may be. If None, all scans are searched.
+    :return: The tuple containing the scan index of the apex and whether the trace has a peak, i.e. a positive
+        intensity within the search mask.
+    """
+    if smoothed.shape[1] == 0:
+        return np.zeros(smoothed.shape[0], dtype=np.int64), np.zeros(smoothed.shape[0], dtype=bool)
+    searched: np.ndarray = smoothed if search_mask is None else np.where(search_mask, smoothed, -np.inf)
+    apexes: np.ndarray = np.argmax(searched, axis=1)
+    return apexes, searched[np.arange(smoothed.shape[0]), apexes] > 0
+
+
+def find_boundaries(smoothed: np.ndarray, apexes: np.ndarray, boundary_fraction: float) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the first and last scan of the peak around every apex. The peak ends at the first scan on each side of the apex
+    where the intensity is below the fraction of the apex or where the intensity rises again.
+    :param smoothed: The smoothed traces.
+    :param apexes: The scan index of the apex of every trace.
+    :param boundary_fraction: The fraction of the apex intensity.
+    :return: The tuple containing the scan index of the first and the last scan of every peak.
+    """
+    n_traces, n_scans = smoothed.shape
+    if n_scans == 0:
+        return np.zeros(n_traces, dtype=np.int64), np.zeros(n_traces, dtype=np.int64)
+    columns: np.ndarray = np.arange(n_scans)[None, :]
+    apex_column: np.ndarray = apexes[:, None]
+    below: np.ndarray = smoothed <= boundary_fraction * smoothed[np.arange(n_traces), apexes][:, None]
+    # A scan is a valley on the left side of the apex if the scan before it is higher, and vice versa on the right side
+    rising_left: np.ndarray = np.zeros(smoothed.shape, dtype=bool)
+    rising_left[:, 1:] = smoothed[:, :-1] > smoothed[:, 1:]
+    rising_right: np.ndarray = np.zeros(smoothed.shape, dtype=bool)
+    rising_right[:, :-1] = smoothed[:, 1:] > smoothed[:, :-1]
+
+    left_stops: np.ndarray = (below | rising_left) & (columns < apex_column)
+    right_stops: np.ndarray = (below | rising_right) & (columns > apex_column)
+    starts: np.ndarray = np.where(left_stops, columns, -1).max(axis=1)
+    ends: np.ndarray = np.where(right_stops, columns, n_scans).min(axis=1)
+    return np.maximum(starts, 0), np.minimum(ends, n_scans - 1)
+
+
+def trapezoid_areas(traces: np.ndarray, rts: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Integrate the traces between their first and last scan with the trapezoidal rule.
+    :param traces: The traces with one row per trace.
+    :param rts: The retention times of the scans, shared by the traces or with one row per trace.
+    :param starts: The first scan of every trace.
+    :param ends: The last scan of every trace.
+    :return: The areas in intensity times seconds.
+    """
+    if rts.shape[-1] < 2:
+        return np.zeros(traces.shape[0])
+    # The segment between scan j and j + 1 is part of the peak if both scans are
+    segments: np.ndarray = np.arange(rts.shape[-1] - 1)[None, :]
+    inside: np.ndarray = (segments >= starts[:, None]) & (segments < ends[:, None])
+    segment_areas: np.ndarray = (traces[:, :-1] + traces[:, 1:]) / 2 * np.diff(rts, axis=-1)
+    return np.where(inside, segment_areas, 0).sum(axis=1)
@@ -0,0 +1,119 @@
+"""
+Description: Compact peptide tables with dictionary encoded strings, small integers and integer join keys
+"""
+
+# Import packages
+from typing import Iterable, List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_integer_dtype, is_object_dtype, is_string_dtype
+
+# The columns of the peptide tables stored as categoricals, i.e. integer codes into the unique strings
+STRING_COLUMNS = ['Sequence', 'ModSequence', 'Modifications', 'ModSeq', 'Region', 'seq', 'modifs']
+# The columns stored as the smallest integer type holding their values, e.g. int8 for the charges
+INTEGER_COLUMNS = ['Charge', 'Start', 'End', 'z', 'from', 'to']
+# A string column is only stored as a categorical if at most this fraction of its values are unique, as the codes of a
+# column with mostly unique values take more memory than they save
+MAX_UNIQUE_FRACTION = 0.5
+
+
+def compact_peptides(peptides: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store the string columns of a peptide table with repeated values as categoricals and the integer columns as the
+    smallest integer type holding their values. The masses, m/z values and retention times are kept as float64.
+    Integer columns with missing values, e.g. from a workbook, are left unchanged.
+    :param peptides: The peptide table.
+    :return: The compact peptide table.
+    """
+    dtypes: dict = {}
+    for column in STRING_COLUMNS:
+        if column in peptides.columns and _is_string_column(peptides[column]) and \
+                peptides[column].nunique() <= MAX_UNIQUE_FRACTION * len(peptides):
+            dtypes[column] = 'category'
+    for column in INTEGER_COLUMNS:
+        if column in peptides.columns and is_integer_dtype(peptides[column].dtype):
+            dtypes[column] = pd.to_numeric(peptides[column], downcast='integer').dtype
+    return peptides.astype(dtypes) if dtypes else peptides
+
+
+def unify_categories(tables: Sequence[pd.DataFrame], columns: Union[List[str], None] = None) -> List[pd.DataFrame]:
+    """
+    Give the categorical columns of the tables the same sorted categories, so the tables can be concatenated and joined
+    on the codes. A column which is categorical in one table is made categorical in all the tables.
+    :param tables: The tables.
+    :param columns: The columns to unify. If None, all the string columns which are categorical in any table.
+    :return: The tables with the unified categories.
+    """
+    tables = list(tables)
+    if columns is None:
+        columns = [column for column in STRING_COLUMNS
+                   if any(isinstance(table[column].dtype, CategoricalDtype) for table in tables if column in table)]
+    for column in columns:
+        present: List[int] = [table_idx for table_idx, table in enumerate(tables) if column in table.columns]
+        if not present:
+            continue
+        categories: pd.Index = pd.Index(pd.unique(np.concatenate(
+            [np.asarray(pd.Categorical(tables[table_idx][column]).categories, dtype=object) for table_idx in present])))
+        try:
+            categories = categories.sort_values()
+        except TypeError:
+            # Values which cannot be sorted, e.g. numbers and strings, keep the order they are found in
+            pass
+        for table_idx in present:
+            tables[table_idx] = tables[table_idx].astype({column: CategoricalDtype(categories)})
+    return tables
+
+
+def concat_peptides(tables: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate peptide tables. The categorical columns stay categorical, where pandas would otherwise fall back to
+    Python strings for categoricals with different categories.
+    :param tables: The peptide tables.
+    :return: The concatenated table with a new index.
+    """
+    return pd.concat(unify_categories(list(tables)), ignore_index=True)
+
+
+def peptide_keys(tables: Sequence[pd.DataFrame], keys: List[str]) -> List[np.ndarray]:
+    """
+    Encode the key columns of the tables as one integer per row, which is equal for rows with equal key values across
+    all the tables. Joins and duplicate checks can then compare the integers rather than the strings. Categorical
+    columns with the same categories are encoded from their codes without hashing the strings.
+    :param tables: The tables.
+    :param keys: The key columns, e.g. sequence, modifications and charge.
+    :return: The key of each row of each table. The key is -1 if a key value of the row is missing.
+    """
+    lengths: List[int] = [len(table) for table in tables]
+    combined: np.ndarray = np.zeros(sum(lengths), dtype=np.int64)
+    missing: np.ndarray = np.zeros(sum(lengths), dtype=bool)
+    for key in keys:
+        values: pd.Series = pd.concat([table[key] for table in tables], ignore_index=True)
+        codes, uniques = pd.factorize(values)
+        missing |= codes < 0
+        # Renumber the combined keys after each column, so they stay below the number of rows
+        combined, _ = pd.factorize(combined * max(len(uniques), 1) + np.maximum(codes, 0))
+    combined = combined.astype(np.int64)
+    combined[missing] = -1
+    return np.split(combined, np.cumsum(lengths)[:-1])
+
+
+def take_categorical(values: pd.Series, indices: np.ndarray) -> pd.Categorical:
+    """
+    Repeat the values of a column, e.g. once for every scan of a peptide, as a categorical.
+    :param values: The column.
+    :param indices: The row of each value.
+    :return: The categorical values.
+    """
+    return pd.Categorical(values).take(indices)
+
+
+def _is_string_column(values: pd.Series) -> bool:
+    """
+    Check if a column holds strings, i.e. it has the object or the string dtype and is not categorical.
+    :param values: The column.
+    :return: True if the column holds strings.
+    """
+    if isinstance(values.dtype, CategoricalDtype):
+        return False
+    return is_object_dtype(values.dtype) or is_string_dtype(values.dtype)
@@ -0,0 +1,271 @@
+"""
+Description: Run the 14N/15N workflow for a batch of samples described in a JSON manifest
+
+The manifest contains the settings and the samples, e.g.
+
+{
+    "output_dir": "Results",
+    "modifications": "Modifications.csv",
+    "peptide_list": "PeptideList.xlsx",
+    "ms1_cache_dir": "mzXML/MS1Cache",
+    "tolerance": 0.01, "tolerance_unit": "Da", "isotopes": 0, "rt_tolerance": 1.0, "rt_window": 30.0,
+    "minimum_mz": 500,
+    "domains": "Domains.csv", "protein": "CRT",
+    "preprocessing": {"centroid": true, "noise_factor": 3.0}, "quantitation": "area", "output_format": "parquet",
+    "samples": [
+        {"name": "37", "tandem": "XTandem/EXP3_01258_VM_mix_37.xml", "mzxml": "mzXML/EXP3_01258_VM.mzXML",
+         "n14_sheet": "Mix_37_14N", "n15_sheet": "Mix_37_15N"}
+    ]
+}
+
+Relative paths are relative to the manifest. For each sample the X!Tandem result is parsed, the masses are calculated
+and the intensities are extracted (ratios_<name>). If the sample has peptide list sheets, the 14N/15N hits are
+found (hits_<name>) and their intensities are extracted (hit_intensity_<name>). A sample without a
+'tandem' or 'mzxml' file skips the stages that need it, and a sample can override 'peptide_list' and 'protein'. The
+regions are assigned from the domains of the protein, by default calreticulin in Domains.csv next to this script. With
+'preprocessing' the profile MS1 scans are centroided and the noise is removed before the peak lookups, while
+centroided scans are used as they are, and with 'isotopes' the intensities are summed over the isotope envelopes.
+The tolerance is in Da divided by the charge, or in ppm with "tolerance_unit": "ppm". The samples run in parallel, and
+the hits of all samples are matched across conditions at the end (MatchingHits). With "quantitation": "area", the
+default, the chromatographic peaks are integrated and the ratio is the ratio of the 15N and 14N peak areas, with one row
+per peptide and hit. With "quantitation": "scan" the ratios of the single scan closest to each peptide and of every scan
+of each hit are written instead.
+
+The tables are written as Parquet (CSV without pyarrow) in a background thread, or with "output_format": "csv" or
+"xlsx", where the Excel files are streamed with the write-only mode of openpyxl. The time, the output rows, the RSS
+at the start and the end and the peak RSS of every stage are written to run_report.json in the output directory (or to
+"report"). With "profile": true the stages are profiled with cProfile, and with "trace_memory": true the peak of the
+Python allocations in each stage is traced with tracemalloc.
+"""
+
+# Import packages
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import pandas as pd
+
+import CalculateN145HitIntensity
+import N145CalculatorUtilities
+from DomainMap import DEFAULT_PROTEIN, DOMAINS_FILE, DomainMap, load_domain_map
+from FindMatchingPeptides import find_matching_hits
+from FindN145Hits import find_hits, read_peptide_lists
+from Instrumentation import Instrumentation, peak_rss_mb
+from MS1Cache import load_ms1_index
+from OutputWriter import DEFAULT_FORMAT, OutputWriter
+from ModificationRegistry import STANDARD_REGISTRY, ModificationRegistry
+from PeakPicking import AREA_COLUMNS
+from ScanPreprocessing import PreprocessingSettings
+from N145Calculator import read_tandem_result_file, setup_df
+from N145CalculatorUtilities import create_modification_list
+
+STAGES = ['parse', 'mass', 'ms1 load', 'intensity', 'write', 'hit matching', 'hit intensity', 'cross-condition']
+REPORT_FILE = 'run_report.json'
+RATIO_COLUMNS = ['Sequence', 'Charge', 'Start', 'End', 'Modifications', 'RT', 'Scan number', '14N mass',
+                 '14N mz (Thr)', '14N mz (Exp)', '14N Int', '15N mass', '15N mz (Thr)', '15N mz (Exp)', '15N Int',
+                 'Ratio', 'Region']
+AREA_RATIO_COLUMNS = ['Sequence', 'Charge', 'Start', 'End', 'Modifications', 'RT', '14N mass', '14N mz (Thr)',
+                      '15N mass', '15N mz (Thr)'] + AREA_COLUMNS + ['Region']
+
+
+def read_manifest(manifest_filepath: str) -> dict:
+    """
+    Read the manifest and make the paths absolute.
+    :param manifest_filepath: The path to the manifest.
+    :return: The manifest.
+    """
+    with open(manifest_filepath, 'r') as manifest_file:
+        manifest: dict = json.load(manifest_file)
+    if not manifest.get('samples'):
+        raise ValueError(f"The manifest {manifest_filepath} contains no samples.")
+
+    base_dir: str = os.path.dirname(os.path.abspath(manifest_filepath))
+    manifest.setdefault('output_dir', '.')
+    for key in ['output_dir', 'modifications', 'peptide_list', 'ms1_cache_dir', 'domains', 'report']:
+        if manifest.get(key) is not None:
+            manifest[key] = os.path.join(base_dir, manifest[key])
+    for sample in manifest['samples']:
+        if 'name' not in sample:
+            raise ValueError(f"A sample in the manifest {manifest_filepath} has no name.")
+        for key in ['tandem', 'mzxml', 'peptide_list']:
+            if sample.get(key) is not None:
+                sample[key] = os.path.join(base_dir, sample[key])
+        sample.setdefault('peptide_list', manifest.get('peptide_list'))
+        sample.setdefault('protein', manifest.get('protein', DEFAULT_PROTEIN))
+    return manifest
+
+
+def run_sample(sample: dict, settings: dict, writer: Union[OutputWriter, None] = None) \
+        -> Tuple[str, Union[pd.DataFrame, None], dict]:
+    """
+    Run the stages of a single sample.
+    :param sample: The sample from the manifest.
+    :param settings: The manifest with the modification registry under 'registry' and the preprocessing settings under
+        'preprocessing'.
+    :param writer: The writer of the result tables. If None, the tables of the sample are written in a background
+        thread, which is done when the sample is done.
+    :return: The tuple containing the sample name, the hit list (None if the sample has no peptide list sheets) and
+        the report of the sample with the time, the number of output rows and the peak memory of each stage.
+    """
+    name: str = sample['name']
+    output_dir: str = settings['output_dir']
+    per_scan: bool = settings.get('quantitation', 'area') == 'scan'
+    instrumentation: Instrumentation = Instrumentation(name, verbose=True, profile=settings.get('profile', False),
+                                                       trace_memory=settings.get('trace_memory', False))
+    own_writer: bool = writer is None
+    if own_writer:
+        writer = OutputWriter(settings.get('output_format', DEFAULT_FORMAT), background=True)
+
+    def timed(stage: str, function, *args, **kwargs):
+        with instrumentation.stage(stage) as record:
+            result = function(*args, **kwargs)
+            record.rows = len(result)
+        return result
+
+    # The MS1 scans are cached before the lookups, so the decoding is measured on its own. Without a cache the scans
+    # are decoded while the intensities are extracted.
+    if sample.get('mzxml') is not None and settings.get('ms1_cache_dir') is not None:
+        timed('ms1 load', load_ms1_index, sample['mzxml'], cache_dir=settings['ms1_cache_dir'],
+              preprocessing=settings.get('preprocessing'))
+
+    # Ratios of the identified peptides
+    if sample.get('tandem') is not None and sample.get('mzxml') is not None:
+        registry: ModificationRegistry = settings.get('registry', STANDARD_REGISTRY)
+        peptides: pd.DataFrame = timed('parse', read_tandem_result_file, sample['tandem'], registry=registry)
+        domain_map: DomainMap = load_domain_map(sample['protein'], settings.get('domains') or DOMAINS_FILE)
+        peptides = timed('mass', setup_df, peptides, settings.get('minimum_mz', 500), domain_map=domain_map,
+                         registry=registry)
+        if per_scan:
+            peptides = timed('intensity', N145CalculatorUtilities.calculate_intensities, peptides, sample['mzxml'],
+                             tolerance=settings.get('tolerance', 0.01), rt_tolerance=settings.get('rt_tolerance', 1.0),
+                             cache_dir=settings.get('ms1_cache_dir'), preprocessing=settings.get('preprocessing'),
+                             tolerance_unit=settings.get('tolerance_unit', 'Da'), isotopes=settings.get('isotopes', 0))
+            peptides = peptides[RATIO_COLUMNS].reset_index(drop=True)
+        else:
+            peptides = timed('intensity', N145CalculatorUtilities.calculate_peak_areas, peptides, sample['mzxml'],
+                             tolerance=settings.get('tolerance', 0.01), rt_window=settings.get('rt_window', 30.0),
+                             cache_dir=settings.get('ms1_cache_dir'), preprocessing=settings.get('preprocessing'),
+                             tolerance_unit=settings.get('tolerance_unit', 'Da'), isotopes=settings.get('isotopes', 0))
+            peptides = peptides[AREA_RATIO_COLUMNS].reset_index(drop=True)
+        with instrumentation.stage('write') as record:
+            writer.write(peptides, os.path.join(output_dir, f"ratios_{name}"))
+            record.rows = len(peptides)
+
+    # Hits in both the 14N and the 15N peptide list
+    hit_list: Union[pd.DataFrame, None] = None
+    if sample.get('n14_sheet') is not None and sample.get('n15_sheet') is not None:
+        n14_list, n15_list = read_peptide_lists(peptide_list_file=sample['peptide_list'],
+                                                n14_tab_name=sample['n14_sheet'], n15_tab_name=sample['n15_sheet'])
+        hit_list_filepath: str = os.path.join(output_dir, f"hits_{name}")
+        hit_list = timed('hit matching', find_hits, n14_list, n15_list, output_filepath=hit_list_filepath,
+                         writer=writer)
+        if sample.get('mzxml') is not None:
+            # The hit list is passed on, as it may still be being written
+            timed('hit intensity', CalculateN145HitIntensity.calculate_intensities,
+                  hit_list_filepath=hit_list_filepath, mzxml_filepath=sample['mzxml'],
+                  intensity_hit_list_filepath=os.path.join(output_dir, f"hit_intensity_{name}"),
+                  tolerance=settings.get('tolerance', 0.01), cache_dir=settings.get('ms1_cache_dir'),
+                  preprocessing=settings.get('preprocessing'), tolerance_unit=settings.get('tolerance_unit', 'Da'),
+                  isotopes=settings.get('isotopes', 0), per_scan=per_scan, hit_list=hit_list, writer=writer)
+
+    if own_writer:
+        # The tables still being written in the background are waited for, so their time is part of the report
+        with instrumentation.stage('write'):
+            writer.close()
+    instrumentation.stop()
+    return name, hit_list, instrumentation.report()
+
+
+def run_pipeline(manifest: dict, workers: Union[int, None] = None) -> dict:
+    """
+    Run the pipeline of the manifest. The samples are run in parallel worker processes, and the hits of all the
+    samples are matched when all the samples are done. The report of the run is written to JSON.
+    :param manifest: The manifest from read_manifest.
+    :param workers: The number of worker processes. If 1, the samples are run in this process. If None, one worker
+        per CPU is used.
+    :return: The report of the run with the report of each sample under 'samples'.
+    """
+    instrumentation: Instrumentation = Instrumentation('All', verbose=True)
+    os.makedirs(manifest['output_dir'], exist_ok=True)
+    samples: List[dict] = manifest['samples']
+    settings: dict = {key: value for key, value in manifest.items() if key != 'samples'}
+    # The modified residues are read once and sent to the workers with the settings
+    if manifest.get('modifications') is not None:
+        settings['registry'] = create_modification_list(manifest['modifications'])
+
+    # The tables are written in the background, so the next sample starts while the last one is written
+    writer: OutputWriter = OutputWriter(manifest.get('output_format', DEFAULT_FORMAT), background=True)
+    if workers == 1 or len(samples) == 1:
+        if manifest.get('preprocessing') is not None:
+            settings['preprocessing'] = PreprocessingSettings(**manifest['preprocessing'])
+        results: list = [run_sample(sample, settings, writer=writer) for sample in samples]
+    else:
+        # The samples already run in parallel, so the scans of a sample are preprocessed in its worker
+        if manifest.get('preprocessing') is not None:
+            settings['preprocessing'] = PreprocessingSettings(**{**manifest['preprocessing'], 'workers': 1})
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_sample, samples, [settings] * len(samples)))
+
+    sample_reports: Dict[str, dict] = {name: sample_report for name, _, sample_report in results}
+    hits: Dict[str, pd.DataFrame] = {name: hit_list for name, hit_list, _ in results if hit_list is not None}
+    if len(hits) > 1:
+        with instrumentation.stage('cross-condition') as record:
+            matching_hits, _ = find_matching_hits(hits=hits, output=os.path.join(manifest['output_dir'],
+                                                                                 "MatchingHits"), writer=writer)
+            record.rows = len(matching_hits)
+    with instrumentation.stage('write'):
+        writer.close()
+    if instrumentation.records:
+        sample_reports['All'] = instrumentation.report()
+
+    report: dict = {'manifest': manifest, 'workers': workers, 'started': instrumentation.started,
+                    'total_seconds': instrumentation.report()['total_seconds'], 'process_peak_rss_mb': peak_rss_mb(),
+                    'samples': sample_reports}
+    with open(manifest.get('report') or os.path.join(manifest['output_dir'], REPORT_FILE), 'w') as report_file:
+        json.dump(report, report_file, indent=1, default=str)
+    return report
+
+
+def print_timings(report: dict):
+    """
+    Print the time of each stage for each sample and the total time of each stage.
+    :param report: The report of the run from run_pipeline.
+    """
+    table: pd.DataFrame = pd.DataFrame([(name, record['stage'], record['seconds'], record['rows'])
+                                        for name, sample_report in report['samples'].items()
+                                        for record in sample_report['stages']],
+                                       columns=['Sample', 'Stage', 'Time (s)', 'Rows'])
+    if table.empty:
+        print("No stages were run.")
+        return
+    table['Stage'] = pd.Categorical(table['Stage'], categories=STAGES, ordered=True)
+    print(table.pivot_table(index='Sample', columns='Stage', values='Time (s)', aggfunc='sum', observed=True)
+          .round(2).to_string())
+    print(table.groupby('Stage', observed=True)['Time (s)'].sum().round(2).to_string())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the 14N/15N workflow for the samples of a manifest.")
+    parser.add_argument('manifest', help="The path to the JSON manifest.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="The number of worker processes. Default one per CPU.")
+    parser.add_argument('--report', default=None,
+                        help="The path to the JSON report of the run. Default run_report.json in the output directory.")
+    parser.add_argument('--profile', action='store_true', help="Profile the stages of each sample with cProfile.")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Trace the peak of the Python allocations in each stage with tracemalloc. Slow.")
+    arguments = parser.parse_args()
+
+    start = time.time()
+    run_manifest = read_manifest(arguments.manifest)
+    if arguments.report is not None:
+        run_manifest['report'] = arguments.report
+    run_manifest['profile'] = arguments.profile or run_manifest.get('profile', False)
+    run_manifest['trace_memory'] = arguments.trace_memory or run_manifest.get('trace_memory', False)
+    run_report = run_pipeline(run_manifest, workers=arguments.workers)
+    print_timings(run_report)
+    run_time = time.time() - start
+    print("Done in {} seconds ({} minutes).".format(round(run_time, 2), round(run_time/60, 2)))
@@ -0,0 +1,216 @@
+"""
+Description: Centroid the MS1 scans and remove the peaks below the noise floor before the peak lookups
+"""
+
+# Import packages
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+# The number of scans sent to a worker process at a time
+BATCH_SIZE: int = 64
+# A scan is a profile scan if at least this fraction of its points are within max_gap of a neighbouring point
+PROFILE_FRACTION: float = 0.5
+
+
+@dataclass(frozen=True)
+class PreprocessingSettings:
+    """
+    The settings of the MS1 scan preprocessing. Only profile scans are preprocessed, scans which are already
+    centroided are left unchanged.
+    """
+    # Replace the profile peaks by their centroids
+    centroid: bool = True
+    # The peaks below noise_factor times the median intensity of the profile points, which are mostly baseline, are
+    # removed. 0 keeps all the peaks.
+    noise_factor: float = 3.0
+    # The maximum m/z distance in Da between two points of the same profile peak
+    max_gap: float = 0.025
+    # The number of worker processes. If None, one worker per CPU is used. The workers do not change the result.
+    workers: Union[int, None] = field(default=1, compare=False)
+
+    def key(self) -> str:
+        """
+        Get the key of the settings used to store the preprocessed scans next to the raw scans.
+        :return: The key.
+        """
+        return f"c{int(self.centroid)}-n{self.noise_factor:g}-g{self.max_gap:g}"
+
+    def to_dict(self) -> dict:
+        """
+        Get the settings, which change the result, as a dictionary.
+        :return: The dictionary.
+        """
+        settings: dict = asdict(self)
+        del settings['workers']
+        return settings
+
+
+def centroid_peaks(mz: np.ndarray, intensity: np.ndarray, max_gap: float = 0.025) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Centroid a profile scan. Every local intensity maximum becomes a peak with the intensity weighted m/z of the
+    maximum and its two neighbours and the intensity of the maximum. Points further apart than max_gap are not part of
+    the same peak. Centroided scans must not be centroided again, as close centroids would be merged, see
+    is_profile_scan.
+    :param mz: The m/z values sorted ascending.
+    :param intensity: The intensities.
+    :param max_gap: The maximum m/z distance in Da between two points of the same peak.
+    :return: The tuple containing the m/z and intensity arrays of the centroids sorted by m/z.
+    """
+    if mz.size == 0:
+        return mz, intensity
+    # The intensities of the neighbours, which are zero at gaps and at the ends of the scan
+    connected: np.ndarray = np.diff(mz) <= max_gap
+    left: np.ndarray = np.zeros(mz.size)
+    right: np.ndarray = np.zeros(mz.size)
+    left[1:] = np.where(connected, intensity[:-1], 0)
+    right[:-1] = np.where(connected, intensity[1:], 0)
+    left_mz: np.ndarray = np.concatenate([mz[:1], mz[:-1]])
+    right_mz: np.ndarray = np.concatenate([mz[1:], mz[-1:]])
+
+    # The first point of a plateau is the apex
+    apexes: np.ndarray = np.flatnonzero((intensity > 0) & (intensity > left) & (intensity >= right))
+    weights: np.ndarray = left[apexes] + intensity[apexes] + right[apexes]
+    centroids: np.ndarray = (left[apexes] * left_mz[apexes] + intensity[apexes] * mz[apexes] +
+                             right[apexes] * right_mz[apexes]) / weights
+    return centroids, intensity[apexes]
+
+
+def is_profile_scan(mz: np.ndarray, max_gap: float = 0.025) -> bool:
+    """
+    Check if a scan is a profile scan from the spacing of its points. In a profile scan most points are within max_gap
+    of the next point of the same peak, while the centroids of a centroided scan are mostly further apart.
+    :param mz: The m/z values sorted ascending.
+    :param max_gap: The maximum m/z distance in Da between two points of the same peak.
+    :return: True if the scan is a profile scan.
+    """
+    if mz.size < 2:
+        return False
+    connected: np.ndarray = np.diff(mz) <= max_gap
+    has_neighbour: np.ndarray = np.zeros(mz.size, dtype=bool)
+    has_neighbour[1:] |= connected
+    has_neighbour[:-1] |= connected
+    return bool(np.mean(has_neighbour) >= PROFILE_FRACTION)
+
+
+def noise_floor(intensity: np.ndarray, noise_factor: float) -> float:
+    """
+    Estimate the intensity floor of a profile scan as a multiple of the median intensity of the points with an
+    intensity. Most points of a profile scan are baseline, so the median is the baseline level. The median of a
+    centroided scan is the level of the real peaks, so it must not be used as a floor.
+    :param intensity: The intensities of the profile scan.
+    :param noise_factor: The multiple of the median intensity.
+    :return: The intensity floor. 0 if the scan has no peaks or the noise factor is 0.
+    """
+    positive: np.ndarray = intensity[intensity > 0]
+    if noise_factor <= 0 or positive.size == 0:
+        return 0.0
+    return float(noise_factor * np.median(positive))
+
+
+def preprocess_peaks(mz: np.ndarray, intensity: np.ndarray, settings: PreprocessingSettings) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Centroid the peaks of a profile scan and remove the peaks below the intensity floor of the scan. The floor is
+    estimated from the raw points, as most of the points of a profile scan are baseline. Centroided scans are returned
+    unchanged.
+    :param mz: The m/z values sorted ascending.
+    :param intensity: The intensities.
+    :param settings: The preprocessing settings.
+    :return: The tuple containing the m/z and intensity arrays of the remaining peaks sorted by m/z.
+    """
+    mz = np.asarray(mz, dtype=np.float64)
+    intensity = np.asarray(intensity, dtype=np.float64)
+    if not is_profile_scan(mz, max_gap=settings.max_gap):
+        return mz, intensity
+    floor: float = noise_floor(intensity, settings.noise_factor)
+    if settings.centroid:
+        mz, intensity = centroid_peaks(mz, intensity, max_gap=settings.max_gap)
+    keep: np.ndarray = intensity >= floor
+    return mz[keep], intensity[keep]
+
+
+def preprocess_scans(scans: Iterable[Tuple[str, float, np.ndarray, np.ndarray]], settings: PreprocessingSettings,
+                     peak_counts: Union[List[Tuple[int, int]], None] = None) \
+        -> Iterator[Tuple[str, float, np.ndarray, np.ndarray]]:
+    """
+    Preprocess the MS1 scans. With several workers the scans are preprocessed in batches in worker processes, and
+    only a few batches are read ahead, so the scans can still be streamed. The scans are returned in the input order.
+    :param scans: The MS1 scans as tuples containing the scan number, the retention time and the m/z and intensity
+        arrays.
+    :param settings: The preprocessing settings.
+    :param peak_counts: The list the number of peaks of each scan before and after the preprocessing is appended to. If
+        None, the peaks are not counted.
+    :return: The iterator over the preprocessed scans.
+    """
+    scans = iter(scans)
+    if settings.workers == 1:
+        for scan in scans:
+            yield _preprocess_scan(scan, settings, peak_counts)
+        return
+
+    n_workers: int = settings.workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        preprocess_batch = partial(_preprocess_batch, settings=settings)
+        # Keep a batch per worker in flight while the results of the first batch are returned
+        pending: list = []
+        while True:
+            while len(pending) <= n_workers:
+                batch: list = list(islice(scans, BATCH_SIZE))
+                if not batch:
+                    break
+                pending.append((batch, executor.submit(preprocess_batch, [scan[2:] for scan in batch])))
+            if not pending:
+                return
+            batch, future = pending.pop(0)
+            for (scan_id, rt, mz, _), (processed_mz, processed_intensity) in zip(batch, future.result()):
+                if peak_counts is not None:
+                    peak_counts.append((mz.size, processed_mz.size))
+                yield scan_id, rt, processed_mz, processed_intensity
+
+
+def summarise_peak_counts(peak_counts: List[Tuple[int, int]]) -> str:
+    """
+    Summarise the number of peaks per scan before and after the preprocessing.
+    :param peak_counts: The number of peaks of each scan before and after the preprocessing.
+    :return: The summary.
+    """
+    if not peak_counts:
+        return "No scans were preprocessed."
+    counts: np.ndarray = np.array(peak_counts, dtype=np.int64)
+    before, after = counts.sum(axis=0)
+    return (f"{len(counts)} scans, peaks per scan {round(before / len(counts), 1)} -> {round(after / len(counts), 1)} "
+            f"(median {int(np.median(counts[:, 0]))} -> {int(np.median(counts[:, 1]))}, "
+            f"{round(100 * after / max(before, 1), 1)} % kept)")
+
+
+def _preprocess_scan(scan: Tuple[str, float, np.ndarray, np.ndarray], settings: PreprocessingSettings,
+                     peak_counts: Union[List[Tuple[int, int]], None]) -> Tuple[str, float, np.ndarray, np.ndarray]:
+    """
+    Preprocess a scan in this process.
+    :param scan: The scan.
+    :param settings: The preprocessing settings.
+    :param peak_counts: The list of peak counts or None.
+    :return: The preprocessed scan.
+    """
+    scan_id, rt, mz, intensity = scan
+    processed_mz, processed_intensity = preprocess_peaks(mz, intensity, settings)
+    if peak_counts is not None:
+        peak_counts.append((mz.size, processed_mz.size))
+    return scan_id, rt, processed_mz, processed_intensity
+
+
+def _preprocess_batch(peaks: List[Tuple[np.ndarray, np.ndarray]], settings: PreprocessingSettings) \
+        -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Preprocess the peaks of a batch of scans in a worker process.
+    :param peaks: The m/z and intensity arrays of the scans.
+    :param settings: The preprocessing settings.
+    :return: The preprocessed m/z and intensity arrays.
+    """
+    return [preprocess_peaks(mz, intensity, settings) for mz, intensity in peaks]
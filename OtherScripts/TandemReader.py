@@ -0,0 +1,184 @@
+"""
+Description: Read the peptides of X!Tandem result files in a single pass into column buffers
+"""
+
+# Import packages
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+from pyteomics import tandem
+
+from N145CalculatorUtilities import create_modified_sequence
+from ModificationRegistry import STANDARD_REGISTRY, ModificationRegistry
+from PeptideTable import compact_peptides, concat_peptides
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+TANDEM_COLUMNS = ['Sequence', 'ModSequence', 'Charge', 'Start', 'End', 'RT', 'Modifications']
+TANDEM_DTYPES = {'Sequence': object, 'ModSequence': object, 'Charge': np.int64, 'Start': np.int64, 'End': np.int64,
+                 'RT': np.float64, 'Modifications': object}
+
+
+def read_tandem_peptides(tandem_result_filepath: str, fdr: Union[float, None] = 0.05, decoy_prefix: str = 'DECOY_',
+                         chunk_size: int = 100000, parquet_filepath: Union[str, None] = None,
+                         registry: ModificationRegistry = STANDARD_REGISTRY) -> pd.DataFrame:
+    """
+    Read the peptides of an X!Tandem result file with one row per protein match. The PSMs are read once. The rows are
+    collected in column buffers, which are converted to typed arrays every chunk_size rows, while the expectation
+    values and decoy flags of the PSMs are collected for the FDR filtering, which is done when the whole file is read.
+    As with pyteomics.tandem.filter, the PSMs are ordered by their expectation value. Each chunk is stored compactly
+    with the sequences and modifications as categoricals and small integer positions and charges.
+    :param tandem_result_filepath: The X!Tandem result file path.
+    :param fdr: The false discovery rate of the target-decoy filtering. If None, all the PSMs are kept.
+    :param decoy_prefix: The prefix of the decoy protein labels. A PSM is a decoy if all its proteins are decoys.
+    :param chunk_size: The number of rows in a chunk.
+    :param parquet_filepath: The Parquet file the peptides are written to with one row group per chunk_size rows. If
+        None, no file is written.
+    :param registry: The modified residues of the modified sequences. Default no modifications.
+    :return: The compact peptide DataFrame.
+    """
+    if parquet_filepath is not None and not PARQUET_AVAILABLE:
+        raise ImportError("pyarrow is required for writing the peptides to a Parquet file.")
+
+    chunks: List[Dict[str, np.ndarray]] = []
+    buffers: Dict[str, list] = {column: [] for column in TANDEM_COLUMNS + ['PSM']}
+    expects: list = []
+    decoys: list = []
+
+    for psm_idx, psm in enumerate(tandem.read(tandem_result_filepath)):
+        expects.append(psm['expect'])
+        decoys.append(all(protein['label'].startswith(decoy_prefix) for protein in psm['protein']))
+        rt: float = psm['rt'] if psm.get('rt') is not None else np.nan
+        for protein in psm['protein']:
+            peptide: dict = protein['peptide']
+            # Handle peptide modification
+            mod_sequence: str = peptide['seq']
+            modification_str: Union[str, None] = None
+            if 'aa' in peptide:
+                mod_sequence = create_modified_sequence(peptide['seq'], peptide['start'], peptide['aa'], registry)
+                modification_str = ", ".join([f"{mod['type']}{mod['at']}@{mod['modified']}" for mod in peptide['aa']])
+
+            for column, value in zip(TANDEM_COLUMNS + ['PSM'], [peptide['seq'], mod_sequence, psm['z'],
+                                                                peptide['start'], peptide['end'], rt,
+                                                                modification_str, psm_idx]):
+                buffers[column].append(value)
+
+        if len(buffers['PSM']) >= chunk_size:
+            chunks.append(_flush(buffers))
+    if buffers['PSM']:
+        chunks.append(_flush(buffers))
+
+    # Keep the rows of the PSMs passing the FDR filter, ordered by the expectation value of the PSMs
+    expects_array: np.ndarray = np.array(expects, dtype=np.float64)
+    decoys_array: np.ndarray = np.array(decoys, dtype=bool)
+    psm_ranks: np.ndarray = np.empty(expects_array.size, dtype=np.int64)
+    psm_ranks[np.lexsort((decoys_array, expects_array))] = np.arange(expects_array.size)
+    keep: Union[np.ndarray, None] = None
+    if fdr is not None:
+        keep = fdr_filter(expects_array, decoys_array, fdr=fdr)
+
+    frames: List[pd.DataFrame] = []
+    for chunk in chunks:
+        frame: pd.DataFrame = pd.DataFrame(chunk, columns=TANDEM_COLUMNS + ['PSM'])
+        if keep is not None:
+            frame = frame[keep[frame['PSM'].to_numpy()]]
+        frames.append(compact_peptides(frame))
+    if not frames:
+        return compact_peptides(pd.DataFrame({column: np.array([], dtype=dtype)
+                                              for column, dtype in TANDEM_DTYPES.items()}))
+    peptide_df: pd.DataFrame = concat_peptides(frames)
+    peptide_df = peptide_df.iloc[np.argsort(psm_ranks[peptide_df['PSM'].to_numpy()], kind='mergesort')]
+    peptide_df = peptide_df[TANDEM_COLUMNS].reset_index(drop=True)
+
+    if parquet_filepath is not None:
+        _write_parquet(peptide_df, parquet_filepath, chunk_size=chunk_size)
+    return peptide_df
+
+
+def calculate_qvalues(expects: np.ndarray, decoys: np.ndarray) -> np.ndarray:
+    """
+    Calculate the q-values of the PSMs with the target-decoy approach, i.e. the number of decoys divided by the number
+    of targets with at most the same expectation value. PSMs with the same expectation value get the same q-value, and
+    the q-values never decrease with the expectation value, as in pyteomics.
+    :param expects: The expectation values of the PSMs.
+    :param decoys: Whether the PSMs are decoys.
+    :return: The q-values in the order of the expectation values, i.e. sorted by lowest expectation value first and
+        targets before decoys.
+    """
+    order: np.ndarray = np.lexsort((decoys, expects))
+    sorted_expects: np.ndarray = expects[order]
+    decoy_count: np.ndarray = np.cumsum(decoys[order], dtype=np.float64)
+    target_count: np.ndarray = np.arange(1, expects.size + 1, dtype=np.float64) - decoy_count
+    with np.errstate(divide='ignore'):
+        qvalues: np.ndarray = decoy_count / target_count
+
+    # Tied PSMs get the q-value of the last tied PSM, which is the minimum of the q-values from there on
+    last_tied: np.ndarray = np.searchsorted(sorted_expects, sorted_expects, side='right') - 1
+    group_qvalues: np.ndarray = np.full(qvalues.size, np.inf)
+    group_qvalues[last_tied] = qvalues[last_tied]
+    qvalues = np.minimum.accumulate(group_qvalues[::-1])[::-1]
+    return qvalues[last_tied]
+
+
+def fdr_filter(expects: np.ndarray, decoys: np.ndarray, fdr: float) -> np.ndarray:
+    """
+    Find the target PSMs with an expectation value below the first target PSM exceeding the FDR.
+    :param expects: The expectation values of the PSMs.
+    :param decoys: Whether the PSMs are decoys.
+    :param fdr: The false discovery rate.
+    :return: The mask of the PSMs to keep in the order of the PSMs.
+    """
+    if expects.size == 0:
+        return np.zeros(0, dtype=bool)
+    order: np.ndarray = np.lexsort((decoys, expects))
+    qvalues: np.ndarray = calculate_qvalues(expects, decoys)
+    targets: np.ndarray = ~decoys[order]
+    target_expects: np.ndarray = expects[order][targets]
+    if target_expects.size == 0:
+        return np.zeros(expects.size, dtype=bool)
+
+    cutoff_idx: int = int(np.searchsorted(qvalues[targets], fdr, side='right'))
+    cutoff: float = target_expects[cutoff_idx] if cutoff_idx < target_expects.size else target_expects[-1] + 1
+    return ~decoys & (expects < cutoff)
+
+
+def _flush(buffers: Dict[str, list]) -> Dict[str, np.ndarray]:
+    """
+    Convert the column buffers to typed arrays and empty the buffers.
+    :param buffers: The column buffers.
+    :return: The columns of the chunk.
+    """
+    chunk: Dict[str, np.ndarray] = {column: np.array(buffers[column], dtype=TANDEM_DTYPES.get(column, np.int64))
+                                    for column in buffers}
+    for buffer in buffers.values():
+        buffer.clear()
+    return chunk
+
+
+def _write_parquet(peptide_df: pd.DataFrame, parquet_filepath: str, chunk_size: int):
+    """
+    Write the peptides to a Parquet file with one row group per chunk.
+    :param peptide_df: The peptide DataFrame.
+    :param parquet_filepath: The Parquet file path.
+    :param chunk_size: The number of rows in a row group.
+    """
+    with pyarrow.parquet.ParquetWriter(parquet_filepath, _parquet_schema()) as parquet_writer:
+        for start in range(0, max(len(peptide_df), 1), chunk_size):
+            parquet_writer.write_table(pyarrow.Table.from_pandas(peptide_df.iloc[start:start + chunk_size],
+                                                                 schema=_parquet_schema(), preserve_index=False))
+
+
+def _parquet_schema():
+    """
+    Get the Parquet schema of the peptides, so all chunks have the same column types.
+    :return: The schema.
+    """
+    return pyarrow.schema([('Sequence', pyarrow.string()), ('ModSequence', pyarrow.string()),
+                           ('Charge', pyarrow.int64()), ('Start', pyarrow.int64()), ('End', pyarrow.int64()),
+                           ('RT', pyarrow.float64()), ('Modifications', pyarrow.string())])
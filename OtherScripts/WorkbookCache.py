@@ -0,0 +1,115 @@
+"""
+Description: Read workbook sheets through a columnar Parquet sidecar cache
+"""
+
+# Import packages
+import json
+import os
+import threading
+from typing import List, Union
+
+import pandas as pd
+
+try:
+    import pyarrow  # Parquet engine
+    PARQUET_AVAILABLE = True
+    # The errors of reading a truncated or otherwise broken sidecar
+    SIDECAR_ERRORS: tuple = (OSError, ValueError, KeyError, pyarrow.ArrowInvalid)
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+SIDECAR_DIR = '.workbook_cache'
+
+
+def read_workbook_sheet(workbook_filepath: str, sheet_name: Union[str, int] = 0,
+                        usecols: Union[List[str], None] = None) -> pd.DataFrame:
+    """
+    Read a sheet of a workbook. The first read converts the whole sheet to a Parquet sidecar file, which is used for
+    later reads until the size or modification time of the workbook changes. A broken sidecar is replaced by reading
+    the workbook again. The sidecar is written to a temporary file and moved into place, so processes reading the same
+    workbook never see half a sidecar. Without pyarrow the workbook is read directly.
+    :param workbook_filepath: The path to the workbook.
+    :param sheet_name: The name or index of the sheet. Default is the first sheet.
+    :param usecols: The columns to read. If None, all the columns are read.
+    :return: The sheet data with the header in the first row.
+    """
+    if not PARQUET_AVAILABLE:
+        return pd.read_excel(workbook_filepath, sheet_name=sheet_name, usecols=usecols, header=0)
+
+    sidecar_filepath: str = _sidecar_filepath(workbook_filepath, sheet_name)
+    meta_filepath: str = f"{sidecar_filepath}.json"
+    workbook_stat = os.stat(workbook_filepath)
+
+    # Use the sidecar if it is created from the current workbook
+    sidecar_columns: Union[List[str], None] = None
+    if os.path.exists(sidecar_filepath) and os.path.exists(meta_filepath):
+        try:
+            with open(meta_filepath, 'r') as meta_file:
+                meta: dict = json.load(meta_file)
+            if meta['size'] == workbook_stat.st_size and meta['mtime_ns'] == workbook_stat.st_mtime_ns:
+                sidecar_columns = list(meta['columns'])
+        except SIDECAR_ERRORS as error:
+            _warn_broken_sidecar(workbook_filepath, sheet_name, error)
+    if sidecar_columns is not None:
+        # Missing columns are an error of the caller, not of the sidecar
+        columns: List[str] = _select_columns(sidecar_columns, usecols)
+        try:
+            return pd.read_parquet(sidecar_filepath, columns=columns)
+        except SIDECAR_ERRORS as error:
+            _warn_broken_sidecar(workbook_filepath, sheet_name, error)
+
+    sheet: pd.DataFrame = pd.read_excel(workbook_filepath, sheet_name=sheet_name, header=0)
+    temporary_suffix: str = f".tmp{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.makedirs(os.path.dirname(sidecar_filepath), exist_ok=True)
+        sheet.to_parquet(sidecar_filepath + temporary_suffix, index=False)
+        with open(meta_filepath + temporary_suffix, 'w') as meta_file:
+            json.dump({'size': workbook_stat.st_size, 'mtime_ns': workbook_stat.st_mtime_ns,
+                       'columns': list(sheet.columns)}, meta_file)
+        # The sidecar is replaced before its meta file, so the meta file never describes a sidecar not yet written
+        os.replace(sidecar_filepath + temporary_suffix, sidecar_filepath)
+        os.replace(meta_filepath + temporary_suffix, meta_filepath)
+    except (OSError, ValueError, TypeError, NotImplementedError) as error:
+        # E.g. columns with mixed types, which cannot be stored in Parquet
+        print(f"\tWARN: Could not cache sheet {sheet_name} of {workbook_filepath}: {error}")
+        for temporary_filepath in (sidecar_filepath + temporary_suffix, meta_filepath + temporary_suffix):
+            if os.path.exists(temporary_filepath):
+                os.remove(temporary_filepath)
+    return sheet[_select_columns(list(sheet.columns), usecols)]
+
+
+def _warn_broken_sidecar(workbook_filepath: str, sheet_name: Union[str, int], error: Exception):
+    """
+    Warn that a sidecar cannot be read, so the workbook is read and the sidecar is rebuilt.
+    :param workbook_filepath: The path to the workbook.
+    :param sheet_name: The name or index of the sheet.
+    :param error: The error of reading the sidecar.
+    """
+    print(f"\tWARN: Could not read the cached sheet {sheet_name} of {workbook_filepath}, reading the workbook "
+          f"instead: {error}")
+
+
+def _select_columns(columns: list, usecols: Union[List[str], None]) -> list:
+    """
+    Select the requested columns in the order of the sheet, as pandas.read_excel does.
+    :param columns: The columns of the sheet.
+    :param usecols: The requested columns. If None, all the columns are selected.
+    :return: The selected columns.
+    """
+    if usecols is None:
+        return columns
+    missing: list = [column for column in usecols if column not in columns]
+    if missing:
+        raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+    return [column for column in columns if column in usecols]
+
+
+def _sidecar_filepath(workbook_filepath: str, sheet_name: Union[str, int]) -> str:
+    """
+    Get the path to the sidecar of a sheet, which is placed in a directory next to the workbook.
+    :param workbook_filepath: The path to the workbook.
+    :param sheet_name: The name or index of the sheet.
+    :return: The path to the sidecar.
+    """
+    workbook_dir, workbook_name = os.path.split(os.path.abspath(workbook_filepath))
+    return os.path.join(workbook_dir, SIDECAR_DIR, f"{workbook_name}.{sheet_name}.parquet")
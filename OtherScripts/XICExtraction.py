@@ -0,0 +1,243 @@
+"""
+Description: Extract 14N and 15N ion chromatograms for many targets at once
+"""
+
+# Import packages
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+
+from IsotopeMass import C13_DELTA, N15_DELTA
+from MS1Index import find_nearest
+
+
+class XICs:
+    """
+    The extracted ion chromatograms of the 14N and 15N targets. The arrays have one row per target and one column per
+    scan. The m/z is the m/z of the monoisotopic peak, and the intensity is the intensity of the monoisotopic peak or
+    the summed intensity of the isotope envelope. Peaks not found within the tolerance are NaN.
+
+    Chromatograms extracted within a retention time window of each target have one column per scan of the window
+    instead. scan_index then gives the scan of every column, and the columns after the scan count of a target are
+    padding with NaN peaks, which repeat the last scan of the target.
+    """
+
+    def __init__(self, rts: np.ndarray, scan_ids: np.ndarray, n14_mz: np.ndarray, n14_intensity: np.ndarray,
+                 n15_mz: np.ndarray, n15_intensity: np.ndarray, scan_index: Union[np.ndarray, None] = None,
+                 scan_counts: Union[np.ndarray, None] = None):
+        """
+        Create the chromatograms.
+        :param rts: The retention times of all the scans.
+        :param scan_ids: The scan numbers of all the scans.
+        :param n14_mz: The experimental m/z of the 14N peaks.
+        :param n14_intensity: The intensities of the 14N peaks.
+        :param n15_mz: The experimental m/z of the 15N peaks.
+        :param n15_intensity: The intensities of the 15N peaks.
+        :param scan_index: The index in rts of the scan of every target and column. None if every target has all the
+            scans.
+        :param scan_counts: The number of scans of every target. None if every target has all the scans.
+        """
+        self.rts = rts
+        self.scan_ids = scan_ids
+        self.n14_mz = n14_mz
+        self.n14_intensity = n14_intensity
+        self.n15_mz = n15_mz
+        self.n15_intensity = n15_intensity
+        self.scan_index = scan_index
+        self.scan_counts = scan_counts
+
+    def target_rts(self, rows: slice = slice(None)) -> np.ndarray:
+        """
+        Get the retention time of every column of the targets.
+        :param rows: The targets. Default all.
+        :return: The retention times with one row per target.
+        """
+        n_targets: int = self.n14_intensity[rows].shape[0]
+        if self.scan_index is None:
+            return np.broadcast_to(self.rts, (n_targets, self.rts.size))
+        return self.rts[self.scan_index[rows]] if self.rts.size else np.zeros(self.scan_index[rows].shape)
+
+    def target_scan_counts(self, rows: slice = slice(None)) -> np.ndarray:
+        """
+        Get the number of scans of the targets.
+        :param rows: The targets. Default all.
+        :return: The number of scans of every target.
+        """
+        if self.scan_counts is None:
+            return np.full(self.n14_intensity[rows].shape[0], self.rts.size)
+        return self.scan_counts[rows]
+
+
+def extract_xics(scans: Iterable[Tuple[str, float, np.ndarray, np.ndarray]], n14_mzs: np.ndarray,
+                 n15_mzs: np.ndarray, charges: np.ndarray, tolerance: float = 0.01, tolerance_unit: str = 'Da',
+                 isotopes: int = 0, expected_rts: Union[np.ndarray, None] = None, rt_window: float = 60.0) -> XICs:
+    """
+    Extract the 14N and 15N chromatograms of all targets. The peaks of each scan are read once and the nearest peak of
+    every target and isotope is found with a binary search over the sorted m/z values.
+
+    Without expected retention times, every target is extracted from every scan, so the chromatograms take memory in
+    proportion to the number of targets times the number of scans of the run. With expected retention times, every
+    target is only extracted from the scans within rt_window of it.
+    :param scans: The MS1 scans as tuples containing the scan number, the retention time and the m/z and intensity
+        arrays, e.g. from MzXMLReader.iter_ms1_scans or an MS1Index.
+    :param n14_mzs: The theoretical 14N m/z of the targets.
+    :param n15_mzs: The theoretical 15N m/z of the targets.
+    :param charges: The charges of the targets.
+    :param tolerance: The tolerance. Default is 0.01
+    :param tolerance_unit: The unit of the tolerance, either 'Da', where the tolerance is divided by the charge, or
+        'ppm'. Default 'Da'.
+    :param isotopes: The number of isotope peaks summed with the monoisotopic peak. Default 0, i.e. only the
+        monoisotopic peak.
+    :param expected_rts: The expected retention time of each target, e.g. of the identification. If None, the targets
+        are extracted from all the scans.
+    :param rt_window: The maximum distance in seconds between the scans and the expected retention time of a target.
+        Default 60.
+    :return: The chromatograms.
+    """
+    n_targets: int = len(n14_mzs)
+    # Search the 14N and 15N targets and their isotopes together
+    targets: np.ndarray = envelope_targets(n14_mzs, n15_mzs, charges, isotopes=isotopes)
+    tolerances: np.ndarray = peak_tolerances(targets, np.tile(np.asarray(charges, dtype=np.float64), 2), tolerance,
+                                             tolerance_unit=tolerance_unit)
+    if expected_rts is not None:
+        return _extract_windowed_xics(scans, targets, tolerances, np.asarray(expected_rts, dtype=np.float64),
+                                      rt_window)
+
+    # Get the peaks scan by scan and transpose them to targets x scans afterwards
+    scan_ids: list = []
+    rts: list = []
+    mz_rows: list = []
+    intensity_rows: list = []
+    for scan_id, rt, scan_mz, scan_intensity in scans:
+        mz_row, intensity_row = match_envelopes(scan_mz, scan_intensity, targets, tolerances)
+        scan_ids.append(scan_id)
+        rts.append(rt)
+        mz_rows.append(mz_row)
+        intensity_rows.append(intensity_row.astype(np.float32))
+
+    mz_matrix: np.ndarray = np.array(mz_rows, dtype=np.float64).reshape(-1, 2 * n_targets).T
+    intensity_matrix: np.ndarray = np.array(intensity_rows, dtype=np.float32).reshape(-1, 2 * n_targets).T
+    return XICs(rts=np.array(rts, dtype=np.float64), scan_ids=np.array(scan_ids, dtype=str),
+                n14_mz=mz_matrix[:n_targets], n14_intensity=intensity_matrix[:n_targets],
+                n15_mz=mz_matrix[n_targets:], n15_intensity=intensity_matrix[n_targets:])
+
+
+def _extract_windowed_xics(scans: Iterable[Tuple[str, float, np.ndarray, np.ndarray]], targets: np.ndarray,
+                           tolerances: np.ndarray, expected_rts: np.ndarray, rt_window: float) -> XICs:
+    """
+    Extract the chromatograms of the targets within a retention time window of each target.
+    :param scans: The MS1 scans.
+    :param targets: The m/z of the isotope envelopes, e.g. from envelope_targets.
+    :param tolerances: The tolerances in Da in the shape of the targets.
+    :param expected_rts: The expected retention time of each target.
+    :param rt_window: The maximum distance in seconds between the scans and the expected retention time of a target.
+    :return: The chromatograms with one column per scan in the window of each target.
+    """
+    n_targets: int = expected_rts.size
+    rt_order: np.ndarray = np.argsort(expected_rts, kind='stable')
+    sorted_rts: np.ndarray = expected_rts[rt_order]
+
+    # Get the peaks of the targets within the window of each scan
+    scan_ids: list = []
+    rts: list = []
+    row_chunks: List[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+    position_chunks: List[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+    mz_chunks: List[np.ndarray] = [np.zeros((2, 0))]
+    intensity_chunks: List[np.ndarray] = [np.zeros((2, 0), dtype=np.float32)]
+    for position, (scan_id, rt, scan_mz, scan_intensity) in enumerate(scans):
+        scan_ids.append(scan_id)
+        rts.append(rt)
+        first: int = np.searchsorted(sorted_rts, rt - rt_window, side='left')
+        last: int = np.searchsorted(sorted_rts, rt + rt_window, side='right')
+        rows: np.ndarray = rt_order[first:last]
+        if rows.size == 0:
+            continue
+        target_rows: np.ndarray = np.concatenate([rows, rows + n_targets])
+        mz, intensity = match_envelopes(scan_mz, scan_intensity, targets[target_rows], tolerances[target_rows])
+        row_chunks.append(rows)
+        position_chunks.append(np.full(rows.size, position))
+        mz_chunks.append(mz.reshape(2, -1))
+        intensity_chunks.append(intensity.reshape(2, -1).astype(np.float32))
+
+    # Put the peaks of every target in scan order in its own row
+    rows = np.concatenate(row_chunks)
+    positions: np.ndarray = np.concatenate(position_chunks)
+    order: np.ndarray = np.lexsort((positions, rows))
+    rows, positions = rows[order], positions[order]
+    scan_counts: np.ndarray = np.bincount(rows, minlength=n_targets)
+    columns: np.ndarray = np.arange(rows.size) - (np.cumsum(scan_counts) - scan_counts)[rows]
+    shape: Tuple[int, int] = (n_targets, int(scan_counts.max()) if n_targets else 0)
+
+    mz_matrix: np.ndarray = np.full((2,) + shape, np.nan)
+    mz_matrix[:, rows, columns] = np.concatenate(mz_chunks, axis=1)[:, order]
+    intensity_matrix: np.ndarray = np.full((2,) + shape, np.nan, dtype=np.float32)
+    intensity_matrix[:, rows, columns] = np.concatenate(intensity_chunks, axis=1)[:, order]
+    # The padding repeats the last scan of the target, so it adds no time to the peak areas
+    scan_index: np.ndarray = np.full(shape, -1, dtype=np.int64)
+    scan_index[rows, columns] = positions
+    last_scans: np.ndarray = scan_index[np.arange(n_targets), np.maximum(scan_counts - 1, 0)] if shape[1] else \
+        np.zeros(n_targets, dtype=np.int64)
+    scan_index = np.where(np.arange(shape[1])[None, :] < scan_counts[:, None], scan_index, last_scans[:, None])
+    return XICs(rts=np.array(rts, dtype=np.float64), scan_ids=np.array(scan_ids, dtype=str),
+                n14_mz=mz_matrix[0], n14_intensity=intensity_matrix[0], n15_mz=mz_matrix[1],
+                n15_intensity=intensity_matrix[1], scan_index=scan_index, scan_counts=scan_counts)
+
+
+def envelope_targets(n14_mzs: np.ndarray, n15_mzs: np.ndarray, charges: np.ndarray, isotopes: int = 0) -> np.ndarray:
+    """
+    Get the m/z of the isotope envelopes of the targets. The 14N envelope continues upwards with the 13C isotopes,
+    while the 15N envelope continues downwards, as every 14N atom left by incomplete labelling lowers the mass.
+    :param n14_mzs: The theoretical 14N m/z of the targets.
+    :param n15_mzs: The theoretical 15N m/z of the targets.
+    :param charges: The charges of the targets.
+    :param isotopes: The number of isotope peaks after the monoisotopic peak.
+    :return: The m/z with a row per 14N target followed by a row per 15N target and a column per isotope, where the
+        first column is the monoisotopic peak.
+    """
+    charges = np.asarray(charges, dtype=np.float64)
+    steps: np.ndarray = np.arange(isotopes + 1, dtype=np.float64)
+    n14_targets: np.ndarray = np.asarray(n14_mzs, dtype=np.float64)[:, None] + \
+        steps[None, :] * C13_DELTA / charges[:, None]
+    n15_targets: np.ndarray = np.asarray(n15_mzs, dtype=np.float64)[:, None] - \
+        steps[None, :] * N15_DELTA / charges[:, None]
+    return np.concatenate([n14_targets, n15_targets])
+
+
+def peak_tolerances(targets: np.ndarray, charges: np.ndarray, tolerance: float, tolerance_unit: str = 'Da') \
+        -> np.ndarray:
+    """
+    Get the tolerance of every target.
+    :param targets: The target m/z with a row per target.
+    :param charges: The charge of each row.
+    :param tolerance: The tolerance.
+    :param tolerance_unit: The unit of the tolerance, either 'Da', where the tolerance is divided by the charge, or
+        'ppm'. Default 'Da'.
+    :return: The tolerances in Da in the shape of the targets.
+    """
+    if tolerance_unit not in ('Da', 'ppm'):
+        raise ValueError(f"The tolerance unit must be 'Da' or 'ppm', not '{tolerance_unit}'.")
+    if tolerance_unit == 'ppm':
+        return np.abs(targets) * tolerance * 1e-6
+    charges = np.asarray(charges, dtype=np.float64).reshape((-1,) + (1,) * (targets.ndim - 1))
+    return np.broadcast_to(tolerance / charges, targets.shape)
+
+
+def match_envelopes(scan_mz: np.ndarray, scan_intensity: np.ndarray, targets: np.ndarray, tolerances: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the isotope envelopes of the targets in a scan. A target is found if its monoisotopic peak is found, and its
+    intensity is the sum of the intensities of the isotope peaks found.
+    :param scan_mz: The sorted m/z values of the scan.
+    :param scan_intensity: The intensities of the scan.
+    :param targets: The target m/z with a row per target and a column per isotope, e.g. from envelope_targets.
+    :param tolerances: The tolerances in Da in the shape of the targets.
+    :return: The tuple containing the m/z of the monoisotopic peak and the summed intensity of each target. NaN if the
+        target is not found.
+    """
+    peaks: np.ndarray = find_nearest(scan_mz, targets.ravel(), tolerances.ravel()).reshape(targets.shape)
+    found: np.ndarray = peaks != -1
+    intensities: np.ndarray = np.where(found, scan_intensity[peaks] if scan_intensity.size else 0, 0).sum(axis=1)
+    monoisotopic_found: np.ndarray = found[:, 0]
+    mz: np.ndarray = np.full(targets.shape[0], np.nan)
+    mz[monoisotopic_found] = scan_mz[peaks[monoisotopic_found, 0]]
+    return mz, np.where(monoisotopic_found, intensities, np.nan)